@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+
+class BinnedMomentAccumulator(object):
+    """Weighted moments of particle quantities in bins (e.g. longitudinal slices of a bunch).
+
+    Each moment is obtained for all the bins at once with a single np.bincount pass over the
+    particles, without looping over the bins or sorting the data.
+
+    Keyword arguments:
+    binIndices -- index of the bin of each particle.
+    weights -- weight of each particle (e.g. its charge).
+    numberOfBins -- total number of bins.
+    """
+    defaultNumberOfSlices = 20 # longitudinal slices of the slice parameters of a bunch, wherever they are calculated
+
+    def __init__(self, binIndices, weights, numberOfBins):
+        self.binIndices = binIndices
+        self.weights = weights
+        self.numberOfBins = numberOfBins
+        self.binEdges = None
+        self._sums = {} # cached weighted sums, so that each one is computed only once
+        self._totalWeight = np.bincount(binIndices, weights, numberOfBins)
+
+    @classmethod
+    def FromCoordinate(cls, coordinate, weights, numberOfBins):
+        """Creates the accumulator with 'numberOfBins' equal bins between the minimum and maximum of 'coordinate'."""
+        binEdges = np.linspace(np.min(coordinate), np.max(coordinate), numberOfBins+1)
+        binWidth = binEdges[1] - binEdges[0]
+        if binWidth > 0:
+            binIndices = np.clip(((coordinate - binEdges[0]) / binWidth).astype(int), 0, numberOfBins-1)
+        else:
+            binIndices = np.zeros(len(coordinate), dtype=int)
+        accumulator = cls(binIndices, weights, numberOfBins)
+        accumulator.binEdges = binEdges
+        return accumulator
+
+    def GetBinCenters(self):
+        return (self.binEdges[1:] + self.binEdges[:-1]) / 2
+
+    def GetTotalWeight(self):
+        return self._totalWeight
+
+    def GetMean(self, values, name = None):
+        """Weighted mean of 'values' in each bin. If a 'name' is given, the sum is cached under it."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self._GetWeightedSum(values, name) / self._totalWeight
+
+    def GetCovariance(self, valuesA, valuesB, nameA = None, nameB = None):
+        productName = None
+        if nameA is not None and nameB is not None:
+            productName = nameA + "*" + nameB
+        meanA = self.GetMean(valuesA, nameA)
+        meanB = self.GetMean(valuesB, nameB)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            meanAB = self._GetWeightedSum(valuesA*valuesB, productName) / self._totalWeight
+        return meanAB - meanA*meanB
+
+    def GetVariance(self, values, name = None):
+        # negative values can only come from round-off errors
+        return np.clip(self.GetCovariance(values, values, name, name), 0, None)
+
+    def GetEmittance(self, position, momentum, positionName = None, momentumName = None):
+        """Emittance of each bin, sqrt(<x^2><p^2> - <xp>^2), from the centered second moments."""
+        positionVariance = self.GetVariance(position, positionName)
+        momentumVariance = self.GetVariance(momentum, momentumName)
+        correlation = self.GetCovariance(position, momentum, positionName, momentumName)
+        return np.sqrt(np.clip(positionVariance*momentumVariance - correlation**2, 0, None))
+
+    def BroadcastToParticles(self, binValues):
+        """Returns an array with the value of the bin of each particle."""
+        return binValues[self.binIndices]
+
+    def _GetWeightedSum(self, values, name):
+        if name is not None and name in self._sums:
+            return self._sums[name]
+        weightedSum = np.bincount(self.binIndices, self.weights*values, self.numberOfBins)
+        if name is not None:
+            self._sums[name] = weightedSum
+        return weightedSum
@@ -18,9 +18,12 @@
 #along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
-from scipy import interpolate as ip
 import math
 from VisualPIC.DataHandling.dataElement import DataElement
+from VisualPIC.DataReading.dataCache import DataCache
+from VisualPIC.DataHandling.customDataExpressions import FieldTerm, RawDataTerm, FieldSlice1D, FieldSlice2D, Square, Sqrt
+from VisualPIC.DataHandling.binnedMomentAccumulator import BinnedMomentAccumulator
+from VisualPIC.DataHandling.cylindricalReconstruction import CylindricalReconstruction
 
 
 """
@@ -34,6 +37,18 @@ class CustomDataElement(DataElement):
     units = ""
     ISUnits = True
     standardName = ""
+    # Parameters used in the conversion of the base data to IS units.
+    conversionParameters = ["SimulationCode", "n_p"]
+    _resultCache = DataCache(512*1024**2) # calculated data, shared by all custom elements
+
+    @classmethod
+    def SetResultCache(cls, resultCache):
+        cls._resultCache.Clear()
+        cls._resultCache = resultCache
+
+    @classmethod
+    def GetResultCache(cls):
+        return cls._resultCache
 
     def __init__(self, dataContainer, speciesName = ''):
         self.c = 299792458 #m/s
@@ -60,12 +75,40 @@ class CustomDataElement(DataElement):
     def _SetBaseData(self):
         raise NotImplementedError
 
+    def GetExpression(self, timeStep):
+        """Returns the Expression which calculates the data (in IS units), or None if the data
+        is calculated in a different way. To be implemented in each subclass."""
+        return None
+
+    def DependsOnParameters(self, parameterNames):
+        return not set(parameterNames).isdisjoint(self.necessaryParameters + self.conversionParameters)
+
+    def InvalidateResults(self):
+        self._resultCache.Invalidate(self)
+        for dataCache in self.GetDerivedDataCaches():
+            dataCache.Invalidate(self)
+
+    def _GetResult(self, key, calculateFunction):
+        """Returns the result stored under 'key' (kind of result, time step, other arguments), calculating it if needed.
+        The cached arrays are shared, so they must not be modified."""
+        return self._resultCache.GetData((self,) + key + (None,), calculateFunction)
+
+    def _GetResultInUnits(self, key, units, getOriginalData):
+        if units == self.GetDataOriginalUnits():
+            return getOriginalData()
+        return self._resultCache.GetData((self,) + key + (units,), lambda: self._unitConverter.GetDataInUnits(self, units, getOriginalData()))
+
     def GetDataOriginalUnits(self):
         return self.units
 
     def GetTimeInOriginalUnits(self, timeStep):
         return list(self.data.items())[0][1].GetTimeInOriginalUnits(timeStep)
 
+    def GetTimeTableInOriginalUnits(self):
+        baseElement = list(self.data.items())[0][1]
+        indices = np.searchsorted(baseElement.GetTimeSteps(), self.timeSteps)
+        return baseElement.GetTimeTableInOriginalUnits()[indices]
+
     def GetTimeOriginalUnits(self):
         return list(self.data.items())[0][1].GetTimeOriginalUnits()
 
@@ -84,6 +127,9 @@ class CustomField(CustomDataElement):
         for FieldName in self.necessaryData[dimension]:
             self.data[FieldName] = self.dataContainer.GetDomainField(FieldName)
 
+    def _GetTerm(self, fieldName):
+        return FieldTerm(self.data[fieldName])
+
     def GetFieldDimension(self):
         return list(self.data.items())[0][1].GetFieldDimension()
 
@@ -100,113 +146,79 @@ class CustomField(CustomDataElement):
     Get data in original units
     """
     def Get1DSliceInOriginalUnits(self, timeStep, slicePositionX, slicePositionY = None):
-        fieldData = self.CalculateField(timeStep)
-        if self.GetFieldDimension() == '2D':
-            elementsX = fieldData.shape[-2]
-            selectedRow = round(elementsX*(float(slicePositionX)/100))
-            sliceData = fieldData[selectedRow]
-        elif self.GetFieldDimension() == '3D':
-            elementsX = fieldData.shape[-3]
-            elementsY = fieldData.shape[-2]
-            selectedX = round(elementsX*(float(slicePositionX)/100))
-            selectedY = round(elementsY*(float(slicePositionY)/100))
-            sliceData = fieldData[selectedX, selectedY]
-        return sliceData
+        key = ("Slice-1D", timeStep, slicePositionX, slicePositionY)
+        return self._GetResult(key, lambda: self._Calculate1DSlice(timeStep, slicePositionX, slicePositionY))
 
     def Get2DSliceInOriginalUnits(self, sliceAxis, slicePosition, timeStep):
-        fieldData = self.CalculateField(timeStep)
-        elementsX3 = fieldData.shape[-3]
-        selectedRow = round(elementsX3*(float(slicePosition)/100))
-        sliceData = fieldData[selectedRow]
-        return sliceData
+        key = ("Slice-2D", timeStep, sliceAxis, slicePosition)
+        return self._GetResult(key, lambda: self._Calculate2DSlice(sliceAxis, slicePosition, timeStep))
 
     def GetAllFieldDataInOriginalUnits(self, timeStep):
-        return self.CalculateField(timeStep)
+        return self._GetResult(("AllData", timeStep), lambda: self.CalculateField(timeStep))
+
+    def Get3DFieldFrom2DSliceInOriginalUnits(self, timeStep, transvEl, longEl, fraction, interpolation = "nearest"):
+        key = ("3DFrom2D", timeStep, transvEl, longEl, fraction, interpolation)
+        return self._GetResult(key, lambda: self._Calculate3DFieldFrom2DSlice(timeStep, transvEl, longEl, fraction, interpolation))
 
-    def Get3DFieldFrom2DSliceInOriginalUnits(self, timeStep, transvEl, longEl, fraction):
+    def _Calculate3DFieldFrom2DSlice(self, timeStep, transvEl, longEl, fraction, interpolation):
         """
             fraction: used to define the range of data we want to visualize in the transverse direction.
                 - fraction = 1 -> get all the data
                 - fraction = 0.5 -> get only from x=0 to x=x_max/2
+            interpolation: "nearest" or "linear" (in r).
         """
         field2D = self.GetAllFieldDataInOriginalUnits(timeStep)
-        nx = field2D.shape[0]
-        field2D = field2D[int(nx/2):int(nx/2+nx/2*fraction)] # we get only half
-        cilShape = field2D.shape
-        Rin,Zin = np.mgrid[0:cilShape[0], 0:cilShape[1]] # cyl. coordinates of original data
-        Zin = np.reshape(Zin, Zin.shape[0]*Zin.shape[1])
-        Rin = np.reshape(Rin, Rin.shape[0]*Rin.shape[1])
-        field2D = np.reshape(field2D, field2D.shape[0]*field2D.shape[1])
-        transvSpacing = cilShape[0]*2/transvEl
-        lonSpacing = cilShape[1]/longEl
-        field3D = np.zeros((transvEl, transvEl, longEl))
-        X, Y, Z = np.mgrid[0:cilShape[0]:transvSpacing,0:cilShape[0]:transvSpacing,0:cilShape[1]:lonSpacing] # cart. coordinates of 3D field
-        Rout = np.sqrt(X**2 + Y**2)
-        # Fill the field sector by sector (only the first has to be calculated. The rest are simlpy mirrored)
-        field3D[int(transvEl/2):transvEl+1,int(transvEl/2):transvEl+1] = ip.griddata(np.column_stack((Rin,Zin)), field2D, (Rout, Z), method='nearest', fill_value = 0) # top right section when looking back from z to the x-y plane.
-        field3D[0:int(transvEl/2),int(transvEl/2):transvEl+1] = np.flip(field3D[int(transvEl/2):transvEl+1,int(transvEl/2):transvEl+1], 0)
-        field3D[0:int(transvEl/2),0:int(transvEl/2)] = np.flip(field3D[0:int(transvEl/2),int(transvEl/2):transvEl+1], 1)
-        field3D[int(transvEl/2):transvEl+1,0:int(transvEl/2)] = np.flip(field3D[int(transvEl/2):transvEl+1,int(transvEl/2):transvEl+1], 1)
-        return field3D
+        reconstruction = CylindricalReconstruction.GetReconstruction(np.shape(field2D), transvEl, longEl, fraction, interpolation)
+        return reconstruction.Reconstruct(field2D)
     
     """
     Get data in any units
     """
     def Get1DSlice(self, timeStep, units, slicePositionX, slicePositionY = None):
-        fieldData = self.CalculateField(timeStep)
-        if self.GetFieldDimension() == '2D':
-            elementsX = fieldData.shape[-2]
-            selectedRow = round(elementsX*(float(slicePositionX)/100))
-            sliceData = fieldData[selectedRow]
-        elif self.GetFieldDimension() == '3D':
-            elementsX = fieldData.shape[-3]
-            elementsY = fieldData.shape[-2]
-            selectedX = round(elementsX*(float(slicePositionX)/100))
-            selectedY = round(elementsY*(float(slicePositionY)/100))
-            sliceData = fieldData[selectedX, selectedY]
-        return self._unitConverter.GetDataInUnits(self, units, sliceData)
+        key = ("Slice-1D", timeStep, slicePositionX, slicePositionY)
+        return self._GetResultInUnits(key, units, lambda: self.Get1DSliceInOriginalUnits(timeStep, slicePositionX, slicePositionY))
 
     def Get2DSlice(self, sliceAxis, slicePosition, timeStep, units):
-        fieldData = self.CalculateField(timeStep)
-        elementsX3 = fieldData.shape[-3]
-        selectedRow = round(elementsX3*(float(slicePosition)/100))
-        sliceData = fieldData[selectedRow]
-        return self._unitConverter.GetDataInUnits(self, units, sliceData)
+        key = ("Slice-2D", timeStep, sliceAxis, slicePosition)
+        return self._GetResultInUnits(key, units, lambda: self.Get2DSliceInOriginalUnits(sliceAxis, slicePosition, timeStep))
 
     def GetAllFieldData(self, timeStep, units):
-        fieldData = self.CalculateField(timeStep)
-        return self._unitConverter.GetDataInUnits(self, units, fieldData)
+        return self._GetResultInUnits(("AllData", timeStep), units, lambda: self.GetAllFieldDataInOriginalUnits(timeStep))
 
     """
     Get data in IS units
     """
     def Get1DSliceISUnits(self, timeStep, slicePositionX, slicePositionY = None):
-        fieldData = self.CalculateField(timeStep)
-        if self.GetFieldDimension() == '2D':
-            elementsX = fieldData.shape[-2]
-            selectedRow = round(elementsX*(float(slicePositionX)/100))
-            sliceData = fieldData[selectedRow]
-        elif self.GetFieldDimension() == '3D':
-            elementsX = fieldData.shape[-3]
-            elementsY = fieldData.shape[-2]
-            selectedX = round(elementsX*(float(slicePositionX)/100))
-            selectedY = round(elementsY*(float(slicePositionY)/100))
-            sliceData = fieldData[selectedX, selectedY]
+        sliceData = self.Get1DSliceInOriginalUnits(timeStep, slicePositionX, slicePositionY)
         return self._unitConverter.GetDataInISUnits(self, sliceData)
 
     def Get2DSliceISUnits(self, sliceAxis, slicePosition, timeStep):
-        fieldData = self.CalculateField(timeStep)
-        elementsX3 = fieldData.shape[-3]
-        selectedRow = round(elementsX3*(float(slicePosition)/100))
-        sliceData = fieldData[selectedRow]
+        sliceData = self.Get2DSliceInOriginalUnits(sliceAxis, slicePosition, timeStep)
         return self._unitConverter.GetDataInISUnits(self, sliceData)
 
     def GetAllFieldDataISUnits(self, timeStep):
-        fieldData = self.CalculateField(timeStep)
+        fieldData = self.GetAllFieldDataInOriginalUnits(timeStep)
         return self._unitConverter.GetDataInISUnits(self, fieldData)
 
     def CalculateField(self, timeStep):
-        raise NotImplementedError
+        expression = self.GetExpression(timeStep)
+        if expression is None:
+            raise NotImplementedError
+        return expression.Evaluate(timeStep)
+
+    def _Calculate1DSlice(self, timeStep, slicePositionX, slicePositionY = None):
+        return self._CalculateFieldRegion(timeStep, FieldSlice1D(slicePositionX, slicePositionY))
+
+    def _Calculate2DSlice(self, sliceAxis, slicePosition, timeStep):
+        return self._CalculateFieldRegion(timeStep, FieldSlice2D(sliceAxis, slicePosition))
+
+    def _CalculateFieldRegion(self, timeStep, fieldSlice):
+        expression = self.GetExpression(timeStep)
+        if expression is None or self._resultCache.Contains((self, "AllData", timeStep, None)):
+            # e.g. stencil operations (np.gradient), which also need the data around the slice
+            return fieldSlice.ExtractFrom(self.GetAllFieldDataInOriginalUnits(timeStep), self.GetFieldDimension())
+        # otherwise, only the slice of the base fields is read and calculated
+        return expression.Evaluate(timeStep, fieldSlice)
 
 
 class TransverseWakefield(CustomField):
@@ -218,9 +230,9 @@ class TransverseWakefield(CustomField):
     ISUnits = True
     standardName = "Transverse Wakefield"
 
-    def CalculateField(self, timeStep):
-        Ey = self.data["Ey"].GetAllFieldDataISUnits(timeStep)
-        Bx = self.data["Bx"].GetAllFieldDataISUnits(timeStep)
+    def GetExpression(self, timeStep):
+        Ey = self._GetTerm("Ey")
+        Bx = self._GetTerm("Bx")
         TranvsWF = Ey - self.c*Bx
         return TranvsWF
 
@@ -234,15 +246,15 @@ class LaserIntensityField(CustomField):
     ISUnits = True
     standardName = "Laser Intensity"
 
-    def CalculateField(self, timeStep):
-        Ey = self.data["Ey"].GetAllFieldDataISUnits(timeStep)
-        Ez = self.data["Ez"].GetAllFieldDataISUnits(timeStep)
+    def GetExpression(self, timeStep):
+        Ey = self._GetTerm("Ey")
+        Ez = self._GetTerm("Ez")
         n_p = self.dataContainer.GetSimulationParameter("n_p") * 1e24
         w_p = math.sqrt(n_p * (self.e)**2 / (self.m_e * self.eps_0)) #plasma freq (1/s)
         lambda_l = self.dataContainer.GetSimulationParameter("lambda_l") * 1e-9 # laser wavelength (m)
         w_l = 2 * math.pi * self.c / lambda_l # laser angular frequency (rad/sec)
         n = math.sqrt(1-(w_p/w_l)**2) # index of refraction
-        E2 = np.square(Ez) + np.square(Ey) # square of electric field modulus
+        E2 = Square(Ez) + Square(Ey) # square of electric field modulus
         Intensity = self.c*self.eps_0*n/2*E2
         return Intensity
 
@@ -256,17 +268,17 @@ class NormalizedVectorPotential(CustomField):
     ISUnits = True
     standardName = "Normalized Vector Potential"
 
-    def CalculateField(self, timeStep):
-        Ey = self.data["Ey"].GetAllFieldDataISUnits(timeStep)
-        Ez = self.data["Ez"].GetAllFieldDataISUnits(timeStep)
+    def GetExpression(self, timeStep):
+        Ey = self._GetTerm("Ey")
+        Ez = self._GetTerm("Ez")
         n_p = self.dataContainer.GetSimulationParameter("n_p") * 1e24
         w_p = math.sqrt(n_p * (self.e)**2 / (self.m_e * self.eps_0)) #plasma freq (1/s)
         lambda_l = self.dataContainer.GetSimulationParameter("lambda_l") * 1e-9 # laser wavelength (m)
         w_l = 2 * math.pi * self.c / lambda_l # laser angular frequency (rad/sec)
         n = math.sqrt(1-(w_p/w_l)**2) # index of refraction
-        E2 = np.square(Ez) + np.square(Ey) # square of electric field modulus
+        E2 = Square(Ez) + Square(Ey) # square of electric field modulus
         Intensity = self.c*self.eps_0*n/2*E2
-        a = np.sqrt(7.3e-11 * lambda_l**2 * Intensity) # normalized vector potential
+        a = Sqrt(7.3e-11 * lambda_l**2 * Intensity) # normalized vector potential
         return a
 
 
@@ -280,9 +292,7 @@ class TransverseWakefieldSlope(CustomField):
     standardName = "Transverse Wakefield Slope"
 
     def CalculateField(self, timeStep):
-        Ey = self.data["Ey"].GetAllFieldDataISUnits( timeStep)
-        Bx = self.data["Bx"].GetAllFieldDataISUnits( timeStep)
-        TranvsWF = Ey - self.c*Bx
+        TranvsWF = (self._GetTerm("Ey") - self.c*self._GetTerm("Bx")).Evaluate(timeStep)
         y = self.data["Ey"].GetAxisInISUnits("y", timeStep)
         dy = abs(y[1]-y[0]) # distance between data points in y direction
         slope = np.gradient(TranvsWF, dy, axis=0)
@@ -337,17 +347,33 @@ class CustomRawDataSet(CustomDataElement):
         for DataSetName in self.necessaryData[dimension]:
             self.data[DataSetName] = self.dataContainer.GetSpecies(self.speciesName).GetRawDataSet(DataSetName)
 
+    def _GetTerm(self, dataSetName):
+        return RawDataTerm(self.data[dataSetName])
+
     """
-    Get data in original units (to be implemented in each subclass)
+    Get data in original units
     """
     def GetDataInOriginalUnits(self, timeStep):
-        raise NotImplementedError
+        return self._GetResult(("Data", timeStep), lambda: self.CalculateData(timeStep))
+
+    def GetDataChunksInOriginalUnits(self, timeStep, chunkSize):
+        expression = self.GetExpression(timeStep)
+        if expression is not None and not self._resultCache.Contains((self, "Data", timeStep, None)):
+            # only the chunk is read and calculated each time
+            numberOfParticles = list(self.data.values())[0].GetNumberOfParticles(timeStep)
+            for start in range(0, numberOfParticles, chunkSize):
+                yield start, expression.Evaluate(timeStep, slice(start, start+chunkSize))
+            return
+        # otherwise, the custom data is calculated at once and then split in chunks
+        data = self.GetDataInOriginalUnits(timeStep)
+        for start in range(0, len(data), chunkSize):
+            yield start, data[start:start+chunkSize]
 
     """
     Get data in any units
     """
     def GetDataInUnits(self, units, timeStep):
-        return self._unitConverter.GetDataInUnits(self, units, self.GetDataInOriginalUnits(timeStep))
+        return self._GetResultInUnits(("Data", timeStep), units, lambda: self.GetDataInOriginalUnits(timeStep))
 
     """
     Get data in IS units
@@ -355,6 +381,13 @@ class CustomRawDataSet(CustomDataElement):
     def GetDataInISUnits(self, timeStep):
         return self._unitConverter.GetDataInISUnits(self, self.GetDataInOriginalUnits(timeStep))
 
+    def CalculateData(self, timeStep):
+        """Calculates the data in original units (to be implemented in each subclass, either here or in GetExpression)."""
+        expression = self.GetExpression(timeStep)
+        if expression is None:
+            raise NotImplementedError
+        return expression.Evaluate(timeStep)
+
 
 class xPrimeDataSet(CustomRawDataSet):
     # List of necessary data sets and simulation parameters.
@@ -365,10 +398,8 @@ class xPrimeDataSet(CustomRawDataSet):
     ISUnits = True
     standardName = "xP"
 
-    def GetDataInOriginalUnits(self, timeStep):
-        Px = self.data["Px"].GetDataInISUnits( timeStep)
-        Pz = self.data["Pz"].GetDataInISUnits( timeStep)
-        xP = np.divide(Px, Pz)
+    def GetExpression(self, timeStep):
+        xP = self._GetTerm("Px") / self._GetTerm("Pz")
         return xP
 
 
@@ -381,10 +412,8 @@ class yPrimeDataSet(CustomRawDataSet):
     ISUnits = True
     standardName = "yP"
 
-    def GetDataInOriginalUnits(self, timeStep):
-        Py = self.data["Py"].GetDataInISUnits( timeStep)
-        Pz = self.data["Pz"].GetDataInISUnits( timeStep)
-        yP = np.divide(Py, Pz)
+    def GetExpression(self, timeStep):
+        yP = self._GetTerm("Py") / self._GetTerm("Pz")
         return yP
 
 
@@ -397,7 +426,7 @@ class deltaZPrimeDataSet(CustomRawDataSet):
     ISUnits = True
     standardName = "Δz"
 
-    def GetDataInOriginalUnits(self, timeStep):
+    def CalculateData(self, timeStep):
         z = self.data["z"].GetDataInISUnits( timeStep)
         q = self.data["Charge"].GetDataInISUnits( timeStep)
         meanZ = np.average(z, weights=q)
@@ -414,7 +443,7 @@ class forwardMomentumVariationDataSet(CustomRawDataSet):
     ISUnits = True
     standardName = "ΔPz/Pz"
 
-    def GetDataInOriginalUnits(self, timeStep):
+    def CalculateData(self, timeStep):
         Pz = self.data["Pz"].GetDataInISUnits( timeStep)
         meanPz = np.average(Pz)
         dPz = np.divide(Pz-meanPz, meanPz)
@@ -430,8 +459,8 @@ class SpeedOfLightCoordinate(CustomRawDataSet):
     ISUnits = True
     standardName = "xi"
 
-    def GetDataInOriginalUnits(self, timeStep):
-        z = self.data["z"].GetDataInISUnits(timeStep)
+    def GetExpression(self, timeStep):
+        z = self._GetTerm("z")
         t = self.data["z"].GetTimeInUnits("s", timeStep)
         xi = z - 299792458*t
         return xi
@@ -445,11 +474,76 @@ class BeamComovingCoordinate(CustomRawDataSet):
     ISUnits = True
     standardName = "xi_beam"
 
-    def GetDataInOriginalUnits(self, timeStep):
+    def CalculateData(self, timeStep):
         z = self.data["z"].GetDataInISUnits(timeStep)
         xi_b = z - min(z)
         return xi_b
 
+
+class SliceDataSet(CustomRawDataSet):
+    """Base class for slice quantities. The bunch is divided in longitudinal slices along xi and each particle
+    takes the value of its slice, so that the slice quantities can be plotted against xi."""
+    numberOfSlices = BinnedMomentAccumulator.defaultNumberOfSlices # same slices as in the BunchAnalyzer
+
+    def _GetSliceAccumulator(self, timeStep):
+        # z and xi only differ by a constant in each time step, so the slices are the same
+        z = self.data["z"].GetDataInISUnits(timeStep)
+        q = np.abs(self.data["Charge"].GetDataInISUnits(timeStep))
+        return BinnedMomentAccumulator.FromCoordinate(z, q, self.numberOfSlices)
+
+
+class SliceEmittanceX(SliceDataSet):
+    # List of necessary data sets and simulation parameters.
+    necessaryData = {"2D":["x", "Px", "z", "Charge"],
+                     "3D":["x", "Px", "z", "Charge"]}
+    necessaryParameters = []
+    units = "m"
+    ISUnits = True
+    standardName = "Slice emittance x"
+
+    def CalculateData(self, timeStep):
+        accumulator = self._GetSliceAccumulator(timeStep)
+        x = self.data["x"].GetDataInISUnits(timeStep)
+        ux = self.data["Px"].GetDataInISUnits(timeStep) / (self.m_e*self.c)
+        return accumulator.BroadcastToParticles(accumulator.GetEmittance(x, ux))
+
+
+class SliceEmittanceY(SliceDataSet):
+    # List of necessary data sets and simulation parameters.
+    necessaryData = {"2D":["y", "Py", "z", "Charge"],
+                     "3D":["y", "Py", "z", "Charge"]}
+    necessaryParameters = []
+    units = "m"
+    ISUnits = True
+    standardName = "Slice emittance y"
+
+    def CalculateData(self, timeStep):
+        accumulator = self._GetSliceAccumulator(timeStep)
+        y = self.data["y"].GetDataInISUnits(timeStep)
+        uy = self.data["Py"].GetDataInISUnits(timeStep) / (self.m_e*self.c)
+        return accumulator.BroadcastToParticles(accumulator.GetEmittance(y, uy))
+
+
+class SliceEnergySpread(SliceDataSet):
+    # List of necessary data sets and simulation parameters.
+    necessaryData = {"2D":["Py", "Pz", "z", "Charge"],
+                     "3D":["Px", "Py", "Pz", "z", "Charge"]}
+    necessaryParameters = []
+    units = ""
+    ISUnits = True
+    standardName = "Slice energy spread"
+
+    def CalculateData(self, timeStep):
+        accumulator = self._GetSliceAccumulator(timeStep)
+        momentum = np.zeros(len(accumulator.binIndices))
+        for momentumName in ["Px", "Py", "Pz"]:
+            if momentumName in self.data:
+                momentum += np.square(self.data[momentumName].GetDataInISUnits(timeStep))
+        gamma = np.sqrt(1 + momentum/(self.m_e*self.c)**2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            relativeSpread = np.sqrt(accumulator.GetVariance(gamma)) / (accumulator.GetMean(gamma)-1)
+        return accumulator.BroadcastToParticles(relativeSpread)
+
     
 class CustomRawDataSetCreator:
     customDataSets = [
@@ -458,7 +552,10 @@ class CustomRawDataSetCreator:
         deltaZPrimeDataSet,
         forwardMomentumVariationDataSet,
         SpeedOfLightCoordinate,
-        BeamComovingCoordinate
+        BeamComovingCoordinate,
+        SliceEmittanceX,
+        SliceEmittanceY,
+        SliceEnergySpread
         ]
     @classmethod
     def GetCustomDataSets(cls, dataContainer, speciesName):
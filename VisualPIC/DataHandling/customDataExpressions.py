@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+from VisualPIC.DataHandling.dataElement import DataElement
+from VisualPIC.DataReading.fieldReaders import FieldReaderBase
+
+
+class Expression(object):
+    """Element-wise expression of fields or raw data sets, used to calculate the custom data elements.
+
+    The expression is only built when combining the terms, and is evaluated afterwards in blocks of
+    'blockSize' elements, writing each operation in place. This way, the only full-size arrays are the
+    input data (in original units, as stored in the data cache) and the result, instead of one
+    temporary array per operation and per conversion to IS units.
+    """
+    blockSize = 2**18
+
+    @classmethod
+    def SetBlockSize(cls, blockSize):
+        cls.blockSize = max(1, int(blockSize))
+
+    def Evaluate(self, timeStep, region = None):
+        """Returns the value of the expression in IS units. If a 'region' is given, only the values in
+        that region are read and calculated. For fields, the region is a FieldSlice1D or FieldSlice2D;
+        for raw data sets, an index (e.g. a slice with a chunk of particles)."""
+        inputs = {}
+        for term in self.GetTerms():
+            data, factor = term.GetData(timeStep, region)
+            inputs[term] = (np.asarray(data), factor)
+        arrays = [data for data, factor in inputs.values()]
+        result = np.empty(arrays[0].shape, np.result_type(np.float32, *arrays))
+        if result.ndim == 0 or len(result) == 0:
+            self._EvaluateBlock(inputs, result)
+            return result
+        rowSize = max(1, result[0].size)
+        rowsPerBlock = max(1, self.blockSize // rowSize)
+        for start in range(0, len(result), rowsPerBlock):
+            blockInputs = {}
+            for term, (data, factor) in inputs.items():
+                blockInputs[term] = (data[start:start+rowsPerBlock], factor)
+            self._EvaluateBlock(blockInputs, result[start:start+rowsPerBlock])
+        return result
+
+    def GetTerms(self):
+        """Returns the (non-repeated) data terms of the expression."""
+        terms = []
+        for operand in self._GetOperands():
+            for term in operand.GetTerms():
+                if term not in terms:
+                    terms.append(term)
+        return terms
+
+    def _GetOperands(self):
+        return []
+
+    def _EvaluateBlock(self, inputs, out):
+        """Writes the value of the expression in the given block of input data into 'out'."""
+        raise NotImplementedError
+
+    """
+    Operators
+    """
+    def __add__(self, other):
+        return BinaryOperation(np.add, self, other)
+
+    def __radd__(self, other):
+        return BinaryOperation(np.add, other, self)
+
+    def __sub__(self, other):
+        return BinaryOperation(np.subtract, self, other)
+
+    def __rsub__(self, other):
+        return BinaryOperation(np.subtract, other, self)
+
+    def __mul__(self, other):
+        return BinaryOperation(np.multiply, self, other)
+
+    def __rmul__(self, other):
+        return BinaryOperation(np.multiply, other, self)
+
+    def __truediv__(self, other):
+        return BinaryOperation(np.divide, self, other)
+
+    def __rtruediv__(self, other):
+        return BinaryOperation(np.divide, other, self)
+
+    def __pow__(self, other):
+        return BinaryOperation(np.power, self, other)
+
+    def __neg__(self):
+        return UnaryOperation(np.negative, self)
+
+
+class Constant(Expression):
+    def __init__(self, value):
+        self.value = value
+
+    def _EvaluateBlock(self, inputs, out):
+        out[...] = self.value
+
+
+class DataTerm(Expression):
+    """Data of a field or raw data set. The conversion to IS units is applied block by block."""
+    def __init__(self, dataElement):
+        self.dataElement = dataElement
+
+    def GetTerms(self):
+        return [self]
+
+    def GetData(self, timeStep, region = None):
+        """Returns the data in the region (in original units) and the factor which converts it to IS units."""
+        factor = DataElement._unitConverter.GetDataInISUnits(self.dataElement, np.ones(1))[0]
+        return self._ReadData(timeStep, region), factor
+
+    def _ReadData(self, timeStep, region):
+        raise NotImplementedError
+
+    def _EvaluateBlock(self, inputs, out):
+        data, factor = inputs[self]
+        np.multiply(data, factor, out=out)
+
+
+class FieldTerm(DataTerm):
+    def _ReadData(self, timeStep, region):
+        if region is None:
+            return self.dataElement.GetAllFieldDataInOriginalUnits(timeStep)
+        # only the slice is read from the file
+        return region.ReadFrom(self.dataElement, timeStep)
+
+
+class RawDataTerm(DataTerm):
+    def _ReadData(self, timeStep, region):
+        if isinstance(region, slice):
+            # only the chunk is read from the file
+            return self.dataElement.GetDataRangeInOriginalUnits(timeStep, region.start, region.stop)
+        data = self.dataElement.GetDataInOriginalUnits(timeStep)
+        if region is None:
+            return data
+        return np.asarray(data)[region]
+
+
+class UnaryOperation(Expression):
+    def __init__(self, function, operand):
+        self.function = function
+        self.operand = _AsExpression(operand)
+
+    def _GetOperands(self):
+        return [self.operand]
+
+    def _EvaluateBlock(self, inputs, out):
+        self.operand._EvaluateBlock(inputs, out)
+        self.function(out, out=out)
+
+
+class BinaryOperation(Expression):
+    def __init__(self, function, left, right):
+        self.function = function
+        self.left = _AsExpression(left)
+        self.right = _AsExpression(right)
+
+    def _GetOperands(self):
+        return [self.left, self.right]
+
+    def _EvaluateBlock(self, inputs, out):
+        # constants are used directly, without filling a block with them
+        if isinstance(self.right, Constant):
+            self.left._EvaluateBlock(inputs, out)
+            self.function(out, self.right.value, out=out)
+        elif isinstance(self.left, Constant):
+            self.right._EvaluateBlock(inputs, out)
+            self.function(self.left.value, out, out=out)
+        else:
+            self.left._EvaluateBlock(inputs, out)
+            rightValues = np.empty_like(out)
+            self.right._EvaluateBlock(inputs, rightValues)
+            self.function(out, rightValues, out=out)
+
+
+"""
+Field regions
+"""
+class FieldSlice1D(object):
+    """1D slice of a field, with the same positions (in % of the number of elements) as Get1DSlice."""
+    def __init__(self, slicePositionX, slicePositionY = None):
+        self.slicePositionX = slicePositionX
+        self.slicePositionY = slicePositionY
+
+    def ReadFrom(self, field, timeStep):
+        return field.Get1DSliceInOriginalUnits(timeStep, self.slicePositionX, self.slicePositionY)
+
+    def ExtractFrom(self, fieldData, fieldDimension):
+        """Returns the slice from the data of the whole field."""
+        if fieldDimension == '2D':
+            selectedRow = FieldReaderBase.GetSliceIndex(fieldData.shape[-2], self.slicePositionX)
+            return fieldData[selectedRow]
+        elif fieldDimension == '3D':
+            selectedX = FieldReaderBase.GetSliceIndex(fieldData.shape[-3], self.slicePositionX)
+            selectedY = FieldReaderBase.GetSliceIndex(fieldData.shape[-2], self.slicePositionY)
+            return fieldData[selectedX, selectedY]
+
+
+class FieldSlice2D(object):
+    """2D slice of a 3D field, with the same position (in % of the number of elements) as Get2DSlice."""
+    def __init__(self, sliceAxis, slicePosition):
+        self.sliceAxis = sliceAxis
+        self.slicePosition = slicePosition
+
+    def ReadFrom(self, field, timeStep):
+        return field.Get2DSliceInOriginalUnits(self.sliceAxis, self.slicePosition, timeStep)
+
+    def ExtractFrom(self, fieldData, fieldDimension):
+        selectedRow = FieldReaderBase.GetSliceIndex(fieldData.shape[-3], self.slicePosition)
+        return fieldData[selectedRow]
+
+
+def _AsExpression(value):
+    if isinstance(value, Expression):
+        return value
+    return Constant(value)
+
+
+"""
+Functions
+"""
+def Square(expression):
+    return UnaryOperation(np.square, expression)
+
+def Sqrt(expression):
+    return UnaryOperation(np.sqrt, expression)
+
+def Abs(expression):
+    return UnaryOperation(np.abs, expression)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+from collections import OrderedDict
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class CylindricalReconstruction(object):
+    """Builds a 3D field from a 2D (r-z) field of a cylindrically symmetric simulation.
+
+    The position in the 2D field of each point of the 3D field only depends on the shapes, so it is
+    calculated once and each reconstruction is then a gather of the 2D data. The value in each point
+    is the one of the nearest 2D point or, with "linear" interpolation, interpolated in r.
+
+    The nearest points are found with a k-d tree of the 2D grid, as griddata(method="nearest") does, so
+    that points at the same distance of several 2D points (which are common, e.g. when the longitudinal
+    spacing is 2.5 elements) take the same value as with griddata.
+
+    Keyword arguments:
+    fieldShape -- shape of the 2D field (transverse elements, longitudinal elements).
+    transvEl -- number of elements of the 3D field in each transverse direction.
+    longEl -- number of elements of the 3D field in the longitudinal direction.
+    fraction -- used to define the range of data we want to visualize in the transverse direction.
+        - fraction = 1 -> get all the data
+        - fraction = 0.5 -> get only from x=0 to x=x_max/2
+    interpolation -- "nearest" or "linear".
+    """
+    maxStoredReconstructions = 8
+    _storedReconstructions = OrderedDict() # (fieldShape, transvEl, longEl, fraction, interpolation) -> reconstruction
+    _lock = threading.Lock()
+
+    @classmethod
+    def GetReconstruction(cls, fieldShape, transvEl, longEl, fraction, interpolation = "nearest"):
+        """Returns the reconstruction for these settings, reusing it if it was already created."""
+        key = (tuple(fieldShape), transvEl, longEl, fraction, interpolation)
+        with cls._lock:
+            if key in cls._storedReconstructions:
+                cls._storedReconstructions.move_to_end(key)
+                return cls._storedReconstructions[key]
+        reconstruction = cls(fieldShape, transvEl, longEl, fraction, interpolation)
+        with cls._lock:
+            cls._storedReconstructions[key] = reconstruction
+            while len(cls._storedReconstructions) > cls.maxStoredReconstructions:
+                cls._storedReconstructions.popitem(last=False)
+        return reconstruction
+
+    def __init__(self, fieldShape, transvEl, longEl, fraction, interpolation = "nearest"):
+        if interpolation not in ["nearest", "linear"]:
+            raise ValueError("Unknown interpolation: " + str(interpolation))
+        nx = fieldShape[0]
+        self.interpolation = interpolation
+        self.firstRow = int(nx/2)
+        self.lastRow = int(nx/2+nx/2*fraction) # we get only half
+        numberOfRadialElements = len(range(nx)[self.firstRow:self.lastRow])
+        numberOfLongitudinalElements = fieldShape[1]
+        transvSpacing = numberOfRadialElements*2/transvEl
+        lonSpacing = numberOfLongitudinalElements/longEl
+        # Transverse coordinate of each row of the 3D field (in units of the 2D grid). The first half
+        # of the rows is the mirror of the second one.
+        halfIndex = int(transvEl/2)
+        rows = np.arange(transvEl)
+        mirroredRows = np.where(rows >= halfIndex, rows - halfIndex, halfIndex - 1 - rows)
+        transverseCoordinates = mirroredRows*transvSpacing
+        radius = np.sqrt(transverseCoordinates[:, np.newaxis]**2 + transverseCoordinates[np.newaxis, :]**2)
+        longitudinalCoordinates = np.arange(longEl)*lonSpacing
+        if interpolation == "nearest":
+            # The radius only takes a few distinct values, so the nearest 2D point (as a flat index of the
+            # half field) is only searched for each distinct radius and longitudinal position.
+            uniqueRadii, self.radiusIndices = np.unique(radius, return_inverse=True)
+            self.radiusIndices = self.radiusIndices.reshape(radius.shape)
+            gridR, gridZ = np.mgrid[0:numberOfRadialElements, 0:numberOfLongitudinalElements]
+            tree = cKDTree(np.column_stack((gridR.ravel(), gridZ.ravel())).astype(float))
+            pointsR, pointsZ = np.meshgrid(uniqueRadii, longitudinalCoordinates, indexing="ij")
+            _, nearestPoints = tree.query(np.column_stack((pointsR.ravel(), pointsZ.ravel())))
+            self.nearestPoints = nearestPoints.reshape(len(uniqueRadii), longEl)
+        else:
+            # The 2D grid points have integer coordinates, so the nearest one along z is found by rounding.
+            self.longitudinalIndices = np.clip(np.round(longitudinalCoordinates), 0, numberOfLongitudinalElements-1).astype(np.intp)
+            lowerIndices = np.clip(np.floor(radius), 0, numberOfRadialElements-1)
+            self.radialIndices = lowerIndices.astype(np.intp)
+            self.upperRadialIndices = np.minimum(self.radialIndices+1, numberOfRadialElements-1)
+            self.radialWeights = np.clip(radius - lowerIndices, 0, 1)[:, :, np.newaxis]
+
+    def Reconstruct(self, field2D):
+        """Returns the 3D field with shape (transvEl, transvEl, longEl)."""
+        halfField = np.asarray(field2D)[self.firstRow:self.lastRow]
+        if self.interpolation == "nearest":
+            # values for each distinct radius, then gathered for all the transverse positions
+            return halfField.reshape(-1)[self.nearestPoints][self.radiusIndices]
+        # the longitudinal gather is done first, on the (smaller) 2D data
+        radialData = halfField[:, self.longitudinalIndices]
+        field3D = radialData[self.radialIndices].astype(np.result_type(radialData, np.float32), copy=False)
+        field3D *= 1 - self.radialWeights
+        field3D += self.radialWeights * radialData[self.upperRadialIndices]
+        return field3D
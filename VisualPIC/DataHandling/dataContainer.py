@@ -19,8 +19,10 @@
 
 
 from VisualPIC.DataReading.folderDataReader import FolderDataReader
-from VisualPIC.DataHandling.customDataElements import CustomFieldCreator, CustomRawDataSetCreator
+from VisualPIC.DataHandling.customDataElements import CustomDataElement, CustomFieldCreator, CustomRawDataSetCreator
 from VisualPIC.DataHandling.dataElement import DataElement
+from VisualPIC.DataReading.dataReader import DataReader
+from VisualPIC.DataReading.rawDataReaders import RawDataReaderBase
 import VisualPIC.DataHandling.unitConverters as unitConverters
 
 
@@ -58,6 +60,7 @@ class DataContainer:
         return self._simulationParams["SimulationCode"]
 
     def SetSimulationParameters(self, parameters):
+        changedParameters = [name for name in set(self._simulationParams) | set(parameters) if self._simulationParams.get(name) != parameters.get(name)]
         # If there is no unitConverter or the simulation code has changed, create a new unitConverter.
         if (self.unitConverter == None) or (self._simulationParams["SimulationCode"] != parameters["SimulationCode"]):
             self.unitConverter = unitConverters.UnitConverterSelector.GetUnitConverter(parameters)
@@ -66,6 +69,18 @@ class DataContainer:
         else:
             self.unitConverter.SetSimulationParameters(parameters)
         self._simulationParams = parameters
+        self._InvalidateCustomDataResults(changedParameters)
+
+    def _InvalidateCustomDataResults(self, changedParameters):
+        """Removes the cached results of the custom data elements which depend on the changed parameters."""
+        if len(changedParameters) == 0:
+            return
+        dataElements = list(self._availableDomainFields)
+        for species in self._availableSpecies:
+            dataElements += species.GetAvailableFields() + species.GetAllRawDataSets()
+        for dataElement in dataElements:
+            if isinstance(dataElement, CustomDataElement) and dataElement.DependsOnParameters(changedParameters):
+                dataElement.InvalidateResults()
 
     def GetSimulationParameters(self):
         return self._simulationParams
@@ -76,6 +91,32 @@ class DataContainer:
             paramNames.append(paramName)
         return paramNames
 
+    def SetFilePoolCapacity(self, capacity):
+        DataReader.GetFilePool().SetCapacity(capacity)
+
+    def SetFilePoolIdleTimeout(self, idleTimeout):
+        DataReader.GetFilePool().SetIdleTimeout(idleTimeout)
+
+    """
+    Memory budget of the caches. By default, up to 2.5 GB: 1 GB of data read from the files, 512 MB of
+    data calculated by the custom data elements and 1 GB of volumes prepared by the 3D visualizer
+    (see VolumeVTK.SetQuantizedVolumesCacheSize).
+    """
+    def SetDataCacheSize(self, maxBytes):
+        DataReader.GetDataCache().SetMaxBytes(maxBytes)
+
+    def GetDataCacheStatistics(self):
+        return DataReader.GetDataCache().GetStatistics()
+
+    def SetCustomDataCacheSize(self, maxBytes):
+        CustomDataElement.GetResultCache().SetMaxBytes(maxBytes)
+
+    def SetMetadataIndexEnabled(self, enabled):
+        DataReader.GetMetadataIndex().SetEnabled(enabled)
+
+    def SetTagIndexPersistence(self, enabled):
+        RawDataReaderBase.SetTagIndexPersistence(enabled)
+
     def GetSimulationParameter(self, paramName):
         return self._simulationParams[paramName]
                 
@@ -214,4 +255,10 @@ class DataContainer:
         self._availableDomainFields = list()
         self._selectedSpecies = list()
         self._selectedDomainField = None
-        self._selectedSpeciesFieldName = None
\ No newline at end of file
+        self._selectedSpeciesFieldName = None
+        DataReader.GetMetadataIndex().Save()
+        DataReader.GetDataCache().Clear()
+        CustomDataElement.GetResultCache().Clear()
+        for dataCache in DataElement.GetDerivedDataCaches():
+            dataCache.Clear()
+        DataReader.GetFilePool().CloseAll()
\ No newline at end of file
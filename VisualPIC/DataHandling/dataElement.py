@@ -18,17 +18,31 @@
 #along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import numpy as np
+
 from VisualPIC.DataReading.dataReader import DataReader
 
 
 class DataElement(object):
     """Base class for all data elements (fields and rawDataSets)"""
     _unitConverter = None
+    _derivedDataCaches = [] # caches of data calculated from the data elements (e.g. the volumes of the 3D visualizer)
 
     @classmethod
     def SetUnitConverter(cls, unitConverter):
         cls._unitConverter = unitConverter
 
+    @classmethod
+    def RegisterDerivedDataCache(cls, dataCache):
+        """Registers a DataCache whose keys start with a data element, so that its entries are removed
+        when the data of the element changes."""
+        if dataCache not in DataElement._derivedDataCaches:
+            DataElement._derivedDataCaches.append(dataCache)
+
+    @classmethod
+    def GetDerivedDataCaches(cls):
+        return list(DataElement._derivedDataCaches)
+
     def __init__(self, standardName, timeSteps, speciesName = "", hasNonISUnits = True):
         self.dataStandardName = standardName
         self.speciesName = speciesName
@@ -79,5 +93,9 @@ class DataElement(object):
 
     def GetTimeInOriginalUnits(self, timeStep):
         raise NotImplementedError
+
+    def GetTimeTableInOriginalUnits(self):
+        """Returns an array with the time of each of the time steps in 'timeSteps'."""
+        return np.array([self.GetTimeInOriginalUnits(timeStep) for timeStep in self.timeSteps])
     
 
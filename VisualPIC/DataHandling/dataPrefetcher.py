@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+class DataPrefetcher(object):
+    """Loads in the background the data of the time steps that are likely to be shown next.
+
+    The data sources are objects with a 'LoadData(timeStep)' method (e.g. FieldToPlot and
+    RawDataSetToPlot), which reads the data into the cache of the data readers.
+
+    Keyword arguments:
+    numberOfThreads -- number of threads used for reading the data.
+    stepsAhead -- number of time steps to load in the browsing direction.
+    """
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, numberOfThreads = 2, stepsAhead = 1):
+        self._executor = ThreadPoolExecutor(max_workers = numberOfThreads)
+        self._stepsAhead = stepsAhead
+        self._enabled = True
+        self._dataSources = list()
+        self._visitedTimeSteps = list()
+        self._scheduledReads = list()
+        self._generation = 0 # increased on every new request, so that outdated reads can be skipped
+        self._lock = threading.Lock()
+
+    def SetEnabled(self, enabled):
+        self._enabled = enabled
+        if not enabled:
+            self.CancelAll()
+
+    def IsEnabled(self):
+        return self._enabled
+
+    def SetStepsAhead(self, stepsAhead):
+        self._stepsAhead = stepsAhead
+
+    def SetDataSources(self, dataSources):
+        self._dataSources = list(dataSources)
+
+    def TimeStepChanged(self, timeStep, availableTimeSteps):
+        """Registers the time step which is being shown and loads its neighbours."""
+        if len(self._visitedTimeSteps) == 0 or self._visitedTimeSteps[-1] != timeStep:
+            self._visitedTimeSteps.append(timeStep)
+            self._visitedTimeSteps = self._visitedTimeSteps[-3:]
+        if self._enabled:
+            self._ScheduleReads(self._GetTimeStepsToPrefetch(timeStep, availableTimeSteps))
+
+    def GetBrowsingDirection(self):
+        """Returns 1 (forward), -1 (backward) or 0 (unknown) based on the last visited time steps."""
+        if len(self._visitedTimeSteps) < 2:
+            return 0
+        steps = np.diff(self._visitedTimeSteps)
+        if np.all(steps > 0):
+            return 1
+        elif np.all(steps < 0):
+            return -1
+        else:
+            return int(np.sign(steps[-1]))
+
+    def CancelAll(self):
+        with self._lock:
+            self._generation += 1
+            for future in self._scheduledReads:
+                future.cancel()
+            self._scheduledReads = list()
+
+    def Shutdown(self):
+        self.CancelAll()
+        self._executor.shutdown(wait = False)
+
+    def _GetTimeStepsToPrefetch(self, timeStep, availableTimeSteps):
+        availableTimeSteps = np.asarray(availableTimeSteps)
+        indices = np.where(availableTimeSteps == timeStep)[0]
+        if len(indices) == 0:
+            return list()
+        currentIndex = indices[0]
+        direction = self.GetBrowsingDirection()
+        if direction == 0:
+            # unknown direction: load the closest neighbours on both sides
+            offsets = [1, -1]
+        else:
+            offsets = [direction*(i+1) for i in range(self._stepsAhead)] + [-direction]
+        timeStepsToPrefetch = list()
+        for offset in offsets:
+            index = currentIndex + offset
+            if 0 <= index < len(availableTimeSteps):
+                timeStepsToPrefetch.append(availableTimeSteps[index])
+        return timeStepsToPrefetch
+
+    def _ScheduleReads(self, timeSteps):
+        self.CancelAll()
+        with self._lock:
+            generation = self._generation
+            for timeStep in timeSteps:
+                for dataSource in self._dataSources:
+                    self._scheduledReads.append(self._executor.submit(self._LoadData, dataSource, timeStep, generation))
+
+    def _LoadData(self, dataSource, timeStep, generation):
+        if generation != self._generation:
+            return # the user has moved to another time step
+        try:
+            dataSource.LoadData(timeStep)
+        except Exception:
+            # not fatal: nothing is cached, so the data is read again (and the error reported) when it is plotted
+            self._logger.warning("Prefetching the data of time step %s failed", timeStep, exc_info=True)
@@ -20,7 +20,7 @@
 
 from VisualPIC.DataHandling.dataElement import DataElement
 from VisualPIC.DataReading.dataReaderSelectors import *
-from scipy import interpolate as ip
+from VisualPIC.DataHandling.cylindricalReconstruction import CylindricalReconstruction
 
 
 class FolderDataElement(DataElement):
@@ -30,6 +30,7 @@ class FolderDataElement(DataElement):
         self.dataNameInCode = nameInCode # name of the variable in the simulation code (e.g. "e1-savg" for the averaged longitudinal E field in Osiris)
         self.dataLocation = location
         self.dataReader = None # Each subclass will load its own
+        self._timeTable = None # time of each time step, read when first needed
 
     def GetNameInCode(self):
         return self.dataNameInCode
@@ -38,11 +39,26 @@ class FolderDataElement(DataElement):
         return self.dataReader.GetDataUnits()
 
     def GetTimeInOriginalUnits(self, timeStep):
+        # The whole table is only built by the callers which need all the time steps, since for some
+        # codes (e.g. Osiris) it means opening all the files. Until then, only this time step is read.
+        if self._timeTable is not None:
+            index = np.searchsorted(self.timeSteps, timeStep)
+            if index < len(self.timeSteps) and self.timeSteps[index] == timeStep:
+                return self._timeTable[index]
         return self.dataReader.GetTime(timeStep)
+
+    def GetTimeTableInOriginalUnits(self):
+        """Returns an array with the time of each time step, reading all of them the first time."""
+        if self._timeTable is None:
+            self._timeTable = self.dataReader.GetTimes(self.timeSteps)
+        return self._timeTable
         
     def GetTimeOriginalUnits(self):
         return self.dataReader.GetTimeUnits()
 
+    def GetFileModificationTime(self, timeStep):
+        return self.dataReader.GetFileModificationTime(timeStep)
+
 
 class FolderField(FolderDataElement):
     def __init__(self, simulationCode, nameInCode, standardName, location, timeSteps, speciesName="", hasNonISUnits = True):
@@ -70,34 +86,19 @@ class FolderField(FolderDataElement):
     def Get2DSliceInOriginalUnits(self, sliceAxis, slicePosition, timeStep):
         return self.dataReader.Get2DSlice(sliceAxis, slicePosition, timeStep)
 
-    def GetAllFieldDataInOriginalUnits(self, timeStep):
-        return  self.dataReader.GetAllFieldData(timeStep)
+    def GetAllFieldDataInOriginalUnits(self, timeStep, useCache = True):
+        return  self.dataReader.GetAllFieldData(timeStep, useCache)
 
-    def Get3DFieldFrom2DSliceInOriginalUnits(self, timeStep, transvEl, longEl, fraction):
+    def Get3DFieldFrom2DSliceInOriginalUnits(self, timeStep, transvEl, longEl, fraction, interpolation = "nearest"):
         """
             fraction: used to define the range of data we want to visualize in the transverse direction.
                 - fraction = 1 -> get all the data
                 - fraction = 0.5 -> get only from x=0 to x=x_max/2
+            interpolation: "nearest" or "linear" (in r).
         """
         field2D = self.GetAllFieldDataInOriginalUnits(timeStep)
-        nx = field2D.shape[0]
-        field2D = field2D[int(nx/2):int(nx/2+nx/2*fraction)] # we get only half
-        cilShape = field2D.shape
-        Rin,Zin = np.mgrid[0:cilShape[0], 0:cilShape[1]] # cyl. coordinates of original data
-        Zin = np.reshape(Zin, Zin.shape[0]*Zin.shape[1])
-        Rin = np.reshape(Rin, Rin.shape[0]*Rin.shape[1])
-        field2D = np.reshape(field2D, field2D.shape[0]*field2D.shape[1])
-        transvSpacing = cilShape[0]*2/transvEl
-        lonSpacing = cilShape[1]/longEl
-        field3D = np.zeros((transvEl, transvEl, longEl))
-        X, Y, Z = np.mgrid[0:cilShape[0]:transvSpacing,0:cilShape[0]:transvSpacing,0:cilShape[1]:lonSpacing] # cart. coordinates of 3D field
-        Rout = np.sqrt(X**2 + Y**2)
-        # Fill the field sector by sector (only the first has to be calculated. The rest are simlpy mirrored)
-        field3D[int(transvEl/2):transvEl+1,int(transvEl/2):transvEl+1] = ip.griddata(np.column_stack((Rin,Zin)), field2D, (Rout, Z), method='nearest', fill_value = 0) # top right section when looking back from z to the x-y plane.
-        field3D[0:int(transvEl/2),int(transvEl/2):transvEl+1] = np.flip(field3D[int(transvEl/2):transvEl+1,int(transvEl/2):transvEl+1], 0)
-        field3D[0:int(transvEl/2),0:int(transvEl/2)] = np.flip(field3D[0:int(transvEl/2),int(transvEl/2):transvEl+1], 1)
-        field3D[int(transvEl/2):transvEl+1,0:int(transvEl/2)] = np.flip(field3D[int(transvEl/2):transvEl+1,int(transvEl/2):transvEl+1], 1)
-        return field3D
+        reconstruction = CylindricalReconstruction.GetReconstruction(np.shape(field2D), transvEl, longEl, fraction, interpolation)
+        return reconstruction.Reconstruct(field2D)
     
     """
     Get data in any units
@@ -144,8 +145,17 @@ class FolderRawDataSet(FolderDataElement):
     """
     Get data in original units
     """
-    def GetDataInOriginalUnits(self, timeStep):
-        return self.dataReader.GetData(timeStep)
+    def GetDataInOriginalUnits(self, timeStep, useCache = True):
+        return self.dataReader.GetData(timeStep, useCache)
+
+    def GetDataChunksInOriginalUnits(self, timeStep, chunkSize):
+        return self.dataReader.GetDataChunks(timeStep, chunkSize)
+
+    def GetDataRangeInOriginalUnits(self, timeStep, start, stop):
+        return self.dataReader.GetDataRange(timeStep, start, stop)
+
+    def GetNumberOfParticles(self, timeStep):
+        return self.dataReader.GetNumberOfParticles(timeStep)
 
     """
     Get data in any units
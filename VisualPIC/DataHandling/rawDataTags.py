@@ -31,4 +31,10 @@ class RawDataTags(object):
         return self.timeSteps
 
     def GetTags(self, timeStep):
-        return self.dataReader.GetData(timeStep)
\ No newline at end of file
+        return self.dataReader.GetData(timeStep)
+
+    def GetTagChunks(self, timeStep, chunkSize):
+        return self.dataReader.GetDataChunks(timeStep, chunkSize)
+
+    def GetTagIndex(self, timeStep):
+        return self.dataReader.GetTagIndex(timeStep)
\ No newline at end of file
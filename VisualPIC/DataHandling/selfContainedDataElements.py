@@ -46,6 +46,9 @@ class SelfContainedDataElement(DataElement):
     def GetTimeInOriginalUnits(self, timeStep):
         index = np.where(self.timeSteps == timeStep)[0][0]
         return self.timeValues[index]
+
+    def GetTimeTableInOriginalUnits(self):
+        return self.timeValues
         
     def GetTimeOriginalUnits(self):
         return self.timeUnits
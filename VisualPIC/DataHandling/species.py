@@ -71,6 +71,12 @@ class Species:
     def GetRawDataTags(self, timeStep):
         return self.rawDataTags.GetTags(timeStep)
 
+    def GetRawDataTagChunks(self, timeStep, chunkSize):
+        return self.rawDataTags.GetTagChunks(timeStep, chunkSize)
+
+    def GetRawDataTagIndex(self, timeStep):
+        return self.rawDataTags.GetTagIndex(timeStep)
+
     def GetRawDataTimeSteps(self):
         """ Assumes all RawDataSets have the same number of time steps)"""
         return self.rawDataSets[0].GetTimeSteps()
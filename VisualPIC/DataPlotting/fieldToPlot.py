@@ -128,4 +128,17 @@ class FieldToPlot:
             if self.__dataToPlotDimension == "2D":
                 return self.__Get2DField(timeStep)
             elif self.__dataToPlotDimension == "1D":
-                return self.__Get1DSlice(timeStep, 50)
\ No newline at end of file
+                return self.__Get1DSlice(timeStep, 50)
+
+    def LoadData(self, timeStep):
+        """Reads the data of the time step without converting it, so that it gets cached by the data readers."""
+        if self.__fieldDimension == "3D":
+            if self.__dataToPlotDimension == "2D":
+                self.__field.Get2DSliceInOriginalUnits("z", 50, timeStep)
+            elif self.__dataToPlotDimension == "1D":
+                self.__field.Get1DSliceInOriginalUnits(timeStep, 50, 50)
+        elif self.__fieldDimension == "2D":
+            if self.__dataToPlotDimension == "2D":
+                self.__field.GetAllFieldDataInOriginalUnits(timeStep)
+            elif self.__dataToPlotDimension == "1D":
+                self.__field.Get1DSliceInOriginalUnits(timeStep, 50)
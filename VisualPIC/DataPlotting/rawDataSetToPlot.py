@@ -36,6 +36,10 @@ class RawDataSetToPlot:
         
     def GetDataSetPlotData(self, timeStep):
         return self._dataSet.GetDataInUnits(self._dataProperties["dataSetUnits"], timeStep)
+
+    def LoadData(self, timeStep):
+        """Reads the data of the time step without converting it, so that it gets cached by the data readers."""
+        self._dataSet.GetDataInOriginalUnits(timeStep)
     
     def GetProperty(self, propertyName):
         return self._dataProperties[propertyName]
@@ -179,6 +179,10 @@ class Subplot(object):
     def GetDataType(self):
         return self.dataType
 
+    def GetDataToPrefetch(self):
+        """Returns the data objects (with a 'LoadData(timeStep)' method) whose data changes with the time step."""
+        return list()
+
 
 class FieldSubplot(Subplot):
     def __init__(self, subplotPosition, colorMapsCollection, dataToPlot):
@@ -255,6 +259,9 @@ class FieldSubplot(Subplot):
     def RemoveField(self, index):
         del self.dataToPlot[index]
 
+    def GetDataToPrefetch(self):
+        return list(self.dataToPlot)
+
 
 class RawDataSubplot(Subplot):
     def __init__(self, subplotPosition, colorMapsCollection, dataToPlot):
@@ -403,6 +410,9 @@ class RawDataSubplot(Subplot):
     def GetPlotType(self):
         return self.plotProps["General"]["PlotType"]
 
+    def GetDataToPrefetch(self):
+        return list(self.dataToPlot.values())
+
     def SetPlotType(self, plotType):
         self.plotProps["General"]["PlotType"] = plotType
 
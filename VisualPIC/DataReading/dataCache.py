@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+from collections import OrderedDict
+
+
+class DataCache(object):
+    """LRU cache of data arrays limited by their total size in memory.
+
+    The keys are tuples whose first element is the object owning the data
+    (e.g. a data reader), so that all its entries can be invalidated at once.
+
+    Keyword arguments:
+    maxBytes -- memory budget of the cache in bytes.
+    """
+    def __init__(self, maxBytes = 1024**3):
+        self._maxBytes = maxBytes
+        self._currentBytes = 0
+        self._entries = OrderedDict() # key -> (data, size in bytes)
+        self._pendingReads = {} # key -> threading.Event, for data being read by another thread
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.RLock()
+
+    def SetMaxBytes(self, maxBytes):
+        with self._lock:
+            self._maxBytes = maxBytes
+            self._EvictExceedingEntries()
+
+    def GetMaxBytes(self):
+        return self._maxBytes
+
+    def GetCurrentBytes(self):
+        return self._currentBytes
+
+    def GetData(self, key, readFunction):
+        """Returns the data stored under 'key'. If not present, it is obtained by calling 'readFunction()' and stored.
+        If another thread is already reading the same data, waits for it instead of reading it twice."""
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._hits += 1
+                    self._entries.move_to_end(key)
+                    return self._entries[key][0]
+                pendingRead = self._pendingReads.get(key)
+                if pendingRead is None:
+                    self._misses += 1
+                    readFinished = threading.Event()
+                    self._pendingReads[key] = readFinished
+                    break
+            # If the other read failed or its data did not fit in the cache, the next iteration reads it again.
+            pendingRead.wait()
+        try:
+            data = readFunction() # read outside the lock, so that other threads are not blocked
+            self.AddData(key, data)
+        finally:
+            with self._lock:
+                if self._pendingReads.get(key) is readFinished:
+                    del self._pendingReads[key]
+            readFinished.set()
+        return data
+
+    def Contains(self, key):
+        return key in self._entries
+
+    def AddData(self, key, data):
+        size = self._GetSizeInBytes(data)
+        with self._lock:
+            if key in self._entries:
+                self._currentBytes -= self._entries.pop(key)[1]
+            if size > self._maxBytes:
+                return
+            self._entries[key] = (data, size)
+            self._currentBytes += size
+            self._EvictExceedingEntries()
+
+    def Invalidate(self, owner):
+        """Removes all the entries belonging to 'owner'."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] is owner]:
+                self._currentBytes -= self._entries.pop(key)[1]
+
+    def Clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._currentBytes = 0
+
+    def GetStatistics(self):
+        return {"hits":self._hits, "misses":self._misses, "entries":len(self._entries), "bytes":self._currentBytes, "maxBytes":self._maxBytes}
+
+    def ResetStatistics(self):
+        self._hits = 0
+        self._misses = 0
+
+    def _EvictExceedingEntries(self):
+        while self._currentBytes > self._maxBytes:
+            key, entry = self._entries.popitem(last=False)
+            self._currentBytes -= entry[1]
+
+    def _GetSizeInBytes(self, data):
+        if isinstance(data, (tuple, list)):
+            return sum(self._GetSizeInBytes(element) for element in data)
+        if isinstance(data, dict):
+            return sum(self._GetSizeInBytes(element) for element in data.values())
+        return getattr(data, "nbytes", 0)
@@ -18,12 +18,49 @@
 #along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
 import abc
+import numpy as np
+
+from VisualPIC.DataReading.h5FilePool import H5FilePool
+from VisualPIC.DataReading.dataCache import DataCache
+from VisualPIC.DataReading.folderMetadataIndex import FolderMetadataIndex
 
 
 class DataReader(object):
     """Parent class for all data readers (fieldReaders and rawDataReaders)"""
     __metaclass__  = abc.ABCMeta
+    _filePool = H5FilePool() # shared by all readers
+    _dataCache = DataCache() # shared by all readers
+    _metadataIndex = FolderMetadataIndex() # shared by all readers
+
+    @classmethod
+    def SetFilePool(cls, filePool):
+        cls._filePool.CloseAll()
+        cls._filePool = filePool
+
+    @classmethod
+    def GetFilePool(cls):
+        return cls._filePool
+
+    @classmethod
+    def SetDataCache(cls, dataCache):
+        cls._dataCache.Clear()
+        cls._dataCache = dataCache
+
+    @classmethod
+    def GetDataCache(cls):
+        return cls._dataCache
+
+    @classmethod
+    def SetMetadataIndex(cls, metadataIndex):
+        cls._metadataIndex.Save()
+        cls._metadataIndex = metadataIndex
+
+    @classmethod
+    def GetMetadataIndex(cls):
+        return cls._metadataIndex
+
     def __init__(self, location, speciesName, dataName, internalName = ""):
         self.location = location
         self.speciesName = speciesName
@@ -35,6 +72,36 @@ class DataReader(object):
         self.dataUnits = ""
         self.data = None
 
+    def GetTime(self, timeStep):
+        time = self._metadataIndex.GetTime(self.location, timeStep)
+        if time is None:
+            time = self._ReadTime(timeStep)
+            self._metadataIndex.SetTime(self.location, timeStep, time)
+        return time
+
+    def GetTimes(self, timeSteps):
+        """Returns an array with the simulation time of each of the given time steps."""
+        times = np.zeros(len(timeSteps))
+        for i, timeStep in enumerate(timeSteps):
+            times[i] = self.GetTime(timeStep)
+        return times
+
+    def GetFileModificationTime(self, timeStep):
+        """Returns the modification time (in ns) of the file with the data of the time step."""
+        return os.stat(self._GetFilePath(timeStep)).st_mtime_ns
+
+    def _GetIndexKey(self):
+        # name under which the metadata of this reader is stored in the metadata index
+        return "/".join([self.__class__.__name__, self.speciesName, self.dataName])
+
+    @abc.abstractmethod
+    def _GetFilePath(self, timeStep):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _ReadTime(self, timeStep):
+        raise NotImplementedError
+
     @abc.abstractmethod
     def _ReadUnits(self):
         raise NotImplementedError
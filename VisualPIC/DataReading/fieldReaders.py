@@ -19,7 +19,7 @@
 
 
 import abc
-from h5py import File as H5File
+import threading
 import numpy as np
 
 from VisualPIC.DataReading.dataReader import DataReader
@@ -42,36 +42,31 @@ class FieldReaderBase(DataReader):
         self.matrixShape = []
         self.axisUnits = {}
         self.axisData = {}
-        self.currentTimeStep = {"Slice-1D":-1, "Slice-2D":-1, "AllData":-1}
-        self.data = {"Slice-1D":[], "Slice-2D":[], "AllData":[]}
-        self.currentSliceAxis = {"Slice-1D":-1, "Slice-2D":-1}
-        self.currentSlicePosition = {"Slice-1D":-1, "Slice-2D":-1}
-        self._ReadBasicData()
+        if not self._LoadBasicDataFromIndex():
+            self._ReadBasicData()
+            self._ReadUnits()
+            self._StoreBasicDataInIndex()
+
+    @staticmethod
+    def GetSliceIndex(elements, slicePosition):
+        """Returns the index of the slice at 'slicePosition' (from 0 to 100 % of the 'elements')."""
+        return min(int(round(elements*(float(slicePosition)/100))), elements-1)
 
     def Get1DSlice(self, timeStep, slicePositionX, slicePositionY = None):
-        if (timeStep != self.currentTimeStep["Slice-1D"]) or ((slicePositionX, slicePositionY) != self.currentSlicePosition["Slice-1D"]):
-            self.currentTimeStep["Slice-1D"] = timeStep
-            self.currentSlicePosition["Slice-1D"] = (slicePositionX, slicePositionY)
-            self.data["Slice-1D"] = self._Read1DSlice(timeStep, slicePositionX, slicePositionY)
-        return self.data["Slice-1D"]
+        key = (self, "Slice-1D", timeStep, slicePositionX, slicePositionY)
+        return self._dataCache.GetData(key, lambda: self._Read1DSlice(timeStep, slicePositionX, slicePositionY))
 
     def Get2DSlice(self, sliceAxis, slicePosition, timeStep):
-        if (timeStep != self.currentTimeStep["Slice-2D"]) or (slicePosition != self.currentSlicePosition["Slice-2D"]) or (sliceAxis != self.currentSliceAxis["Slice-2D"]):
-            self.currentTimeStep["Slice-2D"] = timeStep
-            self.currentSlicePosition["Slice-2D"] = slicePosition
-            self.currentSliceAxis["Slice-2D"] = sliceAxis
-            self.data["Slice-2D"] = self._Read2DSlice(sliceAxis, slicePosition, timeStep)
-        return self.data["Slice-2D"]
-
-    def GetAllFieldData(self, timeStep):
-        if timeStep != self.currentTimeStep["AllData"]:
-            self.currentTimeStep["AllData"] = timeStep
-            self.data["AllData"] = self._ReadAllFieldData(timeStep)
-        return self.data["AllData"]
-
-    def GetTime(self, timeStep):
-        self._ReadTime(timeStep)
-        return self.currentTime
+        key = (self, "Slice-2D", timeStep, sliceAxis, slicePosition)
+        return self._dataCache.GetData(key, lambda: self._Read2DSlice(sliceAxis, slicePosition, timeStep))
+
+    def GetAllFieldData(self, timeStep, useCache = True):
+        """With useCache = False, the data is read without storing it in the data cache (e.g. when
+        going through all the time steps), unless it is already there."""
+        key = (self, "AllData", timeStep)
+        if not useCache and not self._dataCache.Contains(key):
+            return self._ReadAllFieldData(timeStep)
+        return self._dataCache.GetData(key, lambda: self._ReadAllFieldData(timeStep))
 
     def GetTimeUnits(self):
         if self.timeUnits == "":
@@ -92,6 +87,27 @@ class FieldReaderBase(DataReader):
             self._ReadUnits()
         return self.axisUnits
 
+    def _LoadBasicDataFromIndex(self):
+        basicData = self._metadataIndex.GetElementData(self.location, self._GetIndexKey())
+        if basicData is None or "matrixShape" not in basicData:
+            return False
+        self.internalName = basicData["internalName"]
+        self.fieldDimension = basicData["fieldDimension"]
+        self.matrixShape = tuple(basicData["matrixShape"])
+        self.axisUnits = dict(basicData["axisUnits"])
+        self.dataUnits = basicData["dataUnits"]
+        self.timeUnits = basicData["timeUnits"]
+        return True
+
+    def _StoreBasicDataInIndex(self):
+        basicData = {"internalName":self.internalName,
+                     "fieldDimension":self.fieldDimension,
+                     "matrixShape":[int(n) for n in self.matrixShape],
+                     "axisUnits":self.axisUnits,
+                     "dataUnits":self.dataUnits,
+                     "timeUnits":self.timeUnits}
+        self._metadataIndex.SetElementData(self.location, self._GetIndexKey(), basicData)
+
     @abc.abstractmethod
     def _ReadBasicData(self):
         raise NotImplementedError
@@ -124,21 +140,16 @@ class FieldReaderBase(DataReader):
     def _ReadAxisData(self, timeStep):
         raise NotImplementedError
 
-    @abc.abstractmethod
-    def _ReadTime(self, timeStep):
-        raise NotImplementedError
-
 
 class OsirisFieldReader(FieldReaderBase):
     def __init__(self, location, speciesName, dataName, firstTimeStep):
         FieldReaderBase.__init__(self, location, speciesName, dataName, firstTimeStep)
 
     def _ReadBasicData(self):
-        file_content = self._OpenFile(self.firstTimeStep)
-        self._ReadInternalName(file_content)
-        self._DetermineFieldDimension(file_content)
-        self._GetMatrixShape(file_content)
-        file_content.close()
+        with self._OpenFile(self.firstTimeStep) as file_content:
+            self._ReadInternalName(file_content)
+            self._DetermineFieldDimension(file_content)
+            self._GetMatrixShape(file_content)
 
     def _GetMatrixShape(self, file_content):
         self.matrixShape = file_content.get(self.internalName).shape
@@ -154,71 +165,67 @@ class OsirisFieldReader(FieldReaderBase):
 
     def _Read1DSlice(self, timeStep, slicePositionX, slicePositionY = None):
         # TODO: add support for 3D fields
-        file_content = self._OpenFile(timeStep)
-        fieldData = file_content[self.internalName]
-        if self.fieldDimension == '2D':
-            elementsX = self.matrixShape[-2]
-            selectedRow = round(elementsX*(float(slicePositionX)/100))
-            sliceData = np.array(fieldData[selectedRow])
-        elif self.fieldDimension == '3D':
-            elementsX = self.matrixShape[-3]
-            elementsY = self.matrixShape[-2]
-            selectedX = round(elementsX*(float(slicePositionX)/100))
-            selectedY = round(elementsY*(float(slicePositionY)/100))
-            sliceData = np.array(fieldData[selectedX, selectedY])
-        file_content.close()
-        return sliceData
+        with self._OpenFile(timeStep) as file_content:
+            fieldData = file_content[self.internalName]
+            if self.fieldDimension == '2D':
+                elementsX = self.matrixShape[-2]
+                selectedRow = self.GetSliceIndex(elementsX, slicePositionX)
+                sliceData = np.array(fieldData[selectedRow])
+            elif self.fieldDimension == '3D':
+                elementsX = self.matrixShape[-3]
+                elementsY = self.matrixShape[-2]
+                selectedX = self.GetSliceIndex(elementsX, slicePositionX)
+                selectedY = self.GetSliceIndex(elementsY, slicePositionY)
+                sliceData = np.array(fieldData[selectedX, selectedY])
+            return sliceData
 
     def _Read2DSlice(self, sliceAxis, slicePosition, timeStep):
-        file_content = self._OpenFile(timeStep)
-        fieldData = file_content[self.internalName]
-        elementsX3 = self.matrixShape[-3] # number of elements in the transverse direction
-        selectedRow = round(elementsX3*(float(slicePosition)/100))
-        sliceData = np.array(fieldData[selectedRow])
-        file_content.close()
-        return sliceData
+        with self._OpenFile(timeStep) as file_content:
+            fieldData = file_content[self.internalName]
+            elementsX3 = self.matrixShape[-3] # number of elements in the transverse direction
+            selectedRow = self.GetSliceIndex(elementsX3, slicePosition)
+            sliceData = np.array(fieldData[selectedRow])
+            return sliceData
 
     def _ReadAllFieldData(self, timeStep):
-        file_content = self._OpenFile(timeStep)
-        fieldData = np.array(file_content[self.internalName])
-        file_content.close()
-        return fieldData
+        with self._OpenFile(timeStep) as file_content:
+            fieldData = np.array(file_content[self.internalName])
+            return fieldData
 
     def _ReadAxisData(self, timeStep):
-        file_content = self._OpenFile(timeStep)
-        elementsX = self.matrixShape[-1] # number of elements in the longitudinal z direction
-        elementsY = self.matrixShape[-2] # number of elements in the transverse y direction
-        axisData = {}
-        axisData["x"] = np.linspace(file_content.attrs['XMIN'][0], file_content.attrs['XMAX'][0], elementsX)
-        axisData["y"] = np.linspace(file_content.attrs['XMIN'][1], file_content.attrs['XMAX'][1], elementsY)
-        if self.fieldDimension == "3D":
-            elementsZ = self.matrixShape[-3] # number of elements in the transverse x direction
-            axisData["z"] = np.linspace(file_content.attrs['XMIN'][2], file_content.attrs['XMAX'][2], elementsZ)
-        file_content.close()
-        return axisData
+        with self._OpenFile(timeStep) as file_content:
+            elementsX = self.matrixShape[-1] # number of elements in the longitudinal z direction
+            elementsY = self.matrixShape[-2] # number of elements in the transverse y direction
+            axisData = {}
+            axisData["x"] = np.linspace(file_content.attrs['XMIN'][0], file_content.attrs['XMAX'][0], elementsX)
+            axisData["y"] = np.linspace(file_content.attrs['XMIN'][1], file_content.attrs['XMAX'][1], elementsY)
+            if self.fieldDimension == "3D":
+                elementsZ = self.matrixShape[-3] # number of elements in the transverse x direction
+                axisData["z"] = np.linspace(file_content.attrs['XMIN'][2], file_content.attrs['XMAX'][2], elementsZ)
+            return axisData
 
     def _ReadTime(self, timeStep):
-        file_content = self._OpenFile(timeStep)
-        self.currentTime = file_content.attrs["TIME"][0]
-        file_content.close()
+        with self._OpenFile(timeStep) as file_content:
+            return file_content.attrs["TIME"][0]
 
     def _ReadUnits(self):
-        file_content = self._OpenFile(self.firstTimeStep)
-        self.axisUnits["x"] = str(list(file_content['/AXIS/AXIS1'].attrs["UNITS"])[0])[2:-1].replace("\\\\","\\")
-        self.axisUnits["y"] = str(list(file_content['/AXIS/AXIS2'].attrs["UNITS"])[0])[2:-1].replace("\\\\","\\")
-        self.dataUnits = str(list(file_content[self.internalName].attrs["UNITS"])[0])[2:-1].replace("\\\\","\\")
-        self.timeUnits = str(file_content.attrs["TIME UNITS"][0])[2:-1].replace("\\\\","\\")
-        file_content.close()
+        with self._OpenFile(self.firstTimeStep) as file_content:
+            self.axisUnits["x"] = str(list(file_content['/AXIS/AXIS1'].attrs["UNITS"])[0])[2:-1].replace("\\\\","\\")
+            self.axisUnits["y"] = str(list(file_content['/AXIS/AXIS2'].attrs["UNITS"])[0])[2:-1].replace("\\\\","\\")
+            self.dataUnits = str(list(file_content[self.internalName].attrs["UNITS"])[0])[2:-1].replace("\\\\","\\")
+            self.timeUnits = str(file_content.attrs["TIME UNITS"][0])[2:-1].replace("\\\\","\\")
 
     def _OpenFile(self, timeStep):
+        # lease of the file, to be used in a 'with' statement
+        return self._filePool.OpenFile(self._GetFilePath(timeStep))
+
+    def _GetFilePath(self, timeStep):
         fileName = self.dataName + "-"
         if self.speciesName != "":
             fileName += self.speciesName + "-"
         fileName += str(timeStep).zfill(6)
         ending = ".h5"
-        file_path = self.location + "/" + fileName + ending
-        file_content = H5File(file_path, 'r')
-        return file_content
+        return self.location + "/" + fileName + ending
 
 
 class OpenPMDFieldReader(FieldReaderBase):
@@ -227,15 +234,17 @@ class OpenPMDFieldReader(FieldReaderBase):
         # (Its API is used in order to conveniently extract data from the file)
         self.openpmd_ts = OpenPMDTimeSeries( location, check_all_files=False )
         self.openpmd_dataName = dataName
+        # The methods of openpmd_ts which read data change its state, so they can
+        # only be called by one thread at a time (e.g. when prefetching data).
+        self._openpmdLock = threading.Lock()
         # Initialize the instance
         FieldReaderBase.__init__(self, location, speciesName, dataName, firstTimeStep)
 
     def _ReadBasicData(self):
-        file_content = self._OpenFile(self.firstTimeStep)
-        self._ReadInternalName(file_content)
-        self._DetermineFieldDimension(file_content)
-        self._GetMatrixShape(file_content)
-        file_content.close()
+        with self._OpenFile(self.firstTimeStep) as file_content:
+            self._ReadInternalName(file_content)
+            self._DetermineFieldDimension(file_content)
+            self._GetMatrixShape(file_content)
 
     def _GetMatrixShape(self, file_content):
         _, dataset = openpmd_find_dataset( file_content, self.internalName )
@@ -256,77 +265,125 @@ class OpenPMDFieldReader(FieldReaderBase):
             raise ValueError("Unsupported geometry: %s" %geometry)
 
     def _Read1DSlice(self, timeStep, slicePositionX, slicePositionY = None):
-        # Find the name of the field ; vector fields like E are encoded as "E/x"
-        field_and_coord = self.internalName.split("/")
+        # Read only the needed hyperslab directly from the dataset
+        with self._OpenFile(timeStep) as file_content:
+            group, dataset = openpmd_find_dataset( file_content, self.internalName )
+            # (the hyperslab index assumes C-ordered data)
+            if self._GetDataOrder(group) != "F":
+                if self.fieldDimension == '2D':
+                    selectedRow = self.GetSliceIndex(self.matrixShape[-2], slicePositionX)
+                    sliceData = dataset[selectedRow]
+                elif self.fieldDimension == '3D':
+                    selectedX = self.GetSliceIndex(self.matrixShape[-3], slicePositionX)
+                    selectedY = self.GetSliceIndex(self.matrixShape[-2], slicePositionY)
+                    sliceData = dataset[selectedX, selectedY]
+                return sliceData * dataset.attrs["unitSI"]
+        # Fortran-ordered data: the slice is taken from the whole field, as read by openPMD-viewer
+        fieldData = self.GetAllFieldData(timeStep)
         if self.fieldDimension == '2D':
-            fieldData, _ = self.openpmd_ts.get_field(
-                                *field_and_coord, iteration=timeStep )
-            elementsX = self.matrixShape[-2]
-            selectedRow = round(elementsX*(float(slicePositionX)/100))
-            sliceData = np.array(fieldData[selectedRow])
+            return fieldData[self.GetSliceIndex(fieldData.shape[-2], slicePositionX)]
         elif self.fieldDimension == '3D':
-            # Slice first along X
-            fieldData = self._Read2DSlice(self, None, slicePositionX, timeStep)
-            # Then slice along Y
-            elementsY = self.matrixShape[-2]
-            selectedY = round(elementsY*(float(slicePositionY)/100))
-            sliceData = np.array(fieldData[selectedY])
-        return sliceData
+            selectedX = self.GetSliceIndex(fieldData.shape[-3], slicePositionX)
+            selectedY = self.GetSliceIndex(fieldData.shape[-2], slicePositionY)
+            return fieldData[selectedX, selectedY]
 
     def _Read2DSlice(self, sliceAxis, slicePosition, timeStep):
-        # Find the name of the field ; vector fields like E are encoded as "E/x"
-        field_and_coord = self.internalName.split("/")
-        # Convert the `slicePosition` from a 0-to-100 number to -1 to 1
-        slicing = -1. + 2*slicePosition/100.
-        # Extract the slice
-        sliceData, _ = self.openpmd_ts.get_field(
-                *field_and_coord, iteration=timeStep,
-                slicing_dir="x", slicing=slicing )
-        return sliceData
+        # Read only the needed hyperslab directly from the dataset
+        with self._OpenFile(timeStep) as file_content:
+            group, dataset = openpmd_find_dataset( file_content, self.internalName )
+            # (the hyperslab index assumes C-ordered data)
+            if self._GetDataOrder(group) != "F":
+                selectedRow = self.GetSliceIndex(self.matrixShape[-3], slicePosition)
+                sliceData = dataset[selectedRow]
+                return sliceData * dataset.attrs["unitSI"]
+        # Fortran-ordered data: the slice is taken from the whole field, as read by openPMD-viewer
+        fieldData = self.GetAllFieldData(timeStep)
+        return fieldData[self.GetSliceIndex(fieldData.shape[-3], slicePosition)]
+
+    def _GetDataOrder(self, group):
+        dataOrder = group.attrs.get("dataOrder", "C")
+        if isinstance(dataOrder, bytes):
+            dataOrder = dataOrder.decode()
+        return dataOrder
 
     def _ReadAllFieldData(self, timeStep):
         # Find the name of the field ; vector fields like E are encoded as "E/x"
         field_and_coord = self.internalName.split("/")
-        fieldData, _ = self.openpmd_ts.get_field(
-                        *field_and_coord, iteration=timeStep, slicing=None )
+        with self._openpmdLock:
+            fieldData, _ = self.openpmd_ts.get_field(
+                            *field_and_coord, iteration=timeStep, slicing=None )
         return fieldData
 
     def _ReadAxisData(self, timeStep):
-        # Find the name of the field ; vector fields like E are encoded as "E/x"
-        field_and_coord = self.internalName.split("/")
-        # Note: the code below has very bad performance because
-        # it automatically reads the field data, just to extract the metadata
-        # This could be improved in the future
-        _, field_meta_data = self.openpmd_ts.get_field( *field_and_coord,
-                                    iteration=timeStep, slicing=None )
-        # Construct the `axisData` from the object `field_meta_data`
-        axisData = {}
-        axisData["x"] = getattr( field_meta_data, field_meta_data.axes[0] )
-        axisData["y"] = getattr( field_meta_data, field_meta_data.axes[1] )
-        if self.fieldDimension == "3D":
-            axisData["z"] = getattr( field_meta_data, field_meta_data.axes[1] )
-        return axisData
+        # The axes are built from the attributes of the field record, without
+        # reading the dataset itself.
+        with self._OpenFile(timeStep) as file_content:
+            group, dataset = openpmd_find_dataset( file_content, self.internalName )
+            axisLabels = list(group.attrs["axisLabels"])
+            gridSpacing = list(group.attrs["gridSpacing"])
+            gridGlobalOffset = list(group.attrs["gridGlobalOffset"])
+            gridUnitSI = group.attrs["gridUnitSI"]
+            position = list(dataset.attrs["position"])
+            shape = openpmd_get_shape( dataset )
+            if self._GetDataOrder(group) == "F":
+                # Fortran order: the attributes are given in the opposite order as the dataset axes
+                axisLabels.reverse()
+                gridSpacing.reverse()
+                gridGlobalOffset.reverse()
+                position.reverse()
+            axes = list()
+            for i in range(len(axisLabels)):
+                step = gridSpacing[i] * gridUnitSI
+                start = gridGlobalOffset[i] * gridUnitSI + position[i] * step
+                axes.append(start + step * np.arange(shape[i]))
+            # Construct the `axisData`
+            axisData = {}
+            axisData["x"] = axes[0]
+            axisData["y"] = axes[1]
+            if self.fieldDimension == "3D":
+                axisData["z"] = axes[2]
+            return axisData
 
     def _ReadTime(self, timeStep):
-        # The line below sets the attribute `_current_i` of openpmd_ts
-        self.openpmd_ts._find_output( None, timeStep )
-        # This sets the corresponding time
-        self.currentTime = self.openpmd_ts.t[ self.openpmd_ts._current_i ]
+        return self.openpmd_ts.t[ self._GetIterationIndex(timeStep) ]
+
+    def GetTimes(self, timeSteps):
+        # The times of all the iterations are already known by openpmd_ts
+        indices = np.searchsorted(self.openpmd_ts.iterations, timeSteps)
+        return self.openpmd_ts.t[indices]
 
     def _ReadUnits(self):
-        file_content = self._OpenFile(self.firstTimeStep)
-        # OpenPMD data always provide conversion to SI units
-        self.axisUnits["x"] = "m"
-        self.axisUnits["y"] = "m"
-        self.axisUnits["z"] = "m"
-        self.timeUnits = "t"
-        self.dataUnits = "" # TODO find the exact unit; needs navigation in file
-        file_content.close()
+        with self._OpenFile(self.firstTimeStep) as file_content:
+            # OpenPMD data always provide conversion to SI units
+            self.axisUnits["x"] = "m"
+            self.axisUnits["y"] = "m"
+            self.axisUnits["z"] = "m"
+            self.timeUnits = "t"
+            self.dataUnits = "" # TODO find the exact unit; needs navigation in file
+
+
+    def __getstate__(self):
+        # the lock can not be sent to other processes (e.g. when tracking particles)
+        state = self.__dict__.copy()
+        del state["_openpmdLock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._openpmdLock = threading.Lock()
+
+    def _GetIterationIndex(self, timeStep):
+        # The index is found locally instead of with openpmd_ts._find_output, which
+        # sets the attribute `_current_i` shared by all the threads using the reader.
+        index = np.searchsorted(self.openpmd_ts.iterations, timeStep)
+        if index >= len(self.openpmd_ts.iterations) or self.openpmd_ts.iterations[index] != timeStep:
+            raise OSError("Iteration " + str(timeStep) + " not found in " + self.location)
+        return index
 
     def _OpenFile(self, timeStep):
-        # The line below sets the attribute `_current_i` of openpmd_ts
-        self.openpmd_ts._find_output( None, timeStep )
+        # lease of the file, to be used in a 'with' statement
+        return self._filePool.OpenFile(self._GetFilePath(timeStep))
+
+    def _GetFilePath(self, timeStep):
         # This finds the full path to the corresponding file
-        fileName = self.openpmd_ts.h5_files[ self.openpmd_ts._current_i ]
-        file_content = H5File(fileName, 'r')
-        return file_content
+        return self.openpmd_ts.h5_files[ self._GetIterationIndex(timeStep) ]
@@ -19,9 +19,10 @@
 
 
 import os
-from h5py import File as H5File
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
+from VisualPIC.DataReading.dataReader import DataReader
 from VisualPIC.DataHandling.species import Species
 from VisualPIC.DataHandling.folderDataElements import FolderField, FolderRawDataSet
 from VisualPIC.DataHandling.rawDataTags import RawDataTags
@@ -35,6 +36,7 @@ class FolderDataReader:
     def __init__(self, parentDataContainer):
         self._dataContainer = parentDataContainer
         self._dataLocation = ""
+        self._numberOfScanThreads = 8 # threads used to scan the field and species directories
         self._loadDataFrom = {"Osiris": self.LoadOsirisData,
                                "HiPACE": self.LoadHiPaceData,
                                "openPMD": self.LoadOpenPMDData }
@@ -45,6 +47,9 @@ class FolderDataReader:
     def GetDataLocation(self):
         return self._dataLocation
 
+    def SetNumberOfScanThreads(self, numberOfThreads):
+        self._numberOfScanThreads = max(1, int(numberOfThreads))
+
     """
     Data managing. Methods for adding the detected species, fields...
     """
@@ -79,7 +84,9 @@ class FolderDataReader:
     Main data loader. It will automatically call the specific loader for a particular simulation code
     """
     def LoadData(self, simulationCode):
+        DataReader.GetMetadataIndex().Load(self._dataLocation)
         self._loadDataFrom[simulationCode]()
+        DataReader.GetMetadataIndex().Save()
 
     """
     Specific data loaders
@@ -88,51 +95,75 @@ class FolderDataReader:
     def LoadOsirisData(self):
         """Osiris Loader"""
         keyFolderNames = ["DENSITY", "FLD", "PHA", "RAW" ]
-        mainFolders = os.listdir(self._dataLocation)
-        for folder in mainFolders:
-            subDir = self._dataLocation + "/" + folder
-            if folder == keyFolderNames[0]:
-                speciesNames = os.listdir(subDir)
-                for species in speciesNames:
-                    if os.path.isdir(os.path.join(subDir, species)):
-                        self.AddSpecies(Species(species))
-                        speciesFields = os.listdir(subDir + "/" + species)
-                        for field in speciesFields:
-                            if os.path.isdir(os.path.join(subDir + "/" + species, field)):
-                                fieldLocation = subDir + "/" + species + "/" + field
-                                fieldName = field
-                                timeSteps = self.GetTimeStepsInOsirisLocation(fieldLocation)
-                                if timeSteps.size != 0:
-                                    self.AddFieldToSpecies(species, FolderField("Osiris", fieldName, self.GiveStandardNameForOsirisQuantity(fieldName), fieldLocation, timeSteps, species))
-            elif folder == keyFolderNames[1]:
-                domainFields = os.listdir(subDir)
-                for field in domainFields:
-                    if os.path.isdir(os.path.join(subDir, field)):
-                        fieldLocation = subDir + "/" + field
-                        fieldName = field
-                        timeSteps = self.GetTimeStepsInOsirisLocation(fieldLocation)
-                        if timeSteps.size != 0:
-                            self.AddDomainField(FolderField("Osiris", fieldName, self.GiveStandardNameForOsirisQuantity(fieldName), fieldLocation, timeSteps))
-
-            elif folder ==  keyFolderNames[3]:
+        # First, find all the field and species directories. Their content is then scanned in parallel
+        # (one task per directory) and the results are added in the same order in which they were found.
+        speciesFieldScans = list()
+        domainFieldScans = list()
+        rawDataScans = list()
+        with ThreadPoolExecutor(max_workers = self._numberOfScanThreads) as executor:
+            mainFolders = sorted(os.listdir(self._dataLocation))
+            for folder in mainFolders:
                 subDir = self._dataLocation + "/" + folder
-                speciesNames = os.listdir(subDir)
-                for species in speciesNames:
-                    if os.path.isdir(os.path.join(subDir, species)):
-                        self.AddSpecies(Species(species))
-                        dataSetLocation = subDir + "/" + species
-                        timeSteps = self.GetTimeStepsInOsirisLocation(dataSetLocation)
-                        if timeSteps.size != 0:
-                            file_path = dataSetLocation + "/" + "RAW-" + species + "-" + str(timeSteps[0]).zfill(6) + ".h5"
-                            file_content = H5File(file_path, 'r')
-                            for dataSetName in list(file_content):
-                                if dataSetName == "tag":
-                                    self.AddRawDataTagsToSpecies(species, RawDataTags("Osiris", dataSetName, dataSetLocation, timeSteps, species, dataSetName))
-                                else:
-                                    self.AddRawDataToSpecies(species, FolderRawDataSet("Osiris", dataSetName, self.GiveStandardNameForOsirisQuantity(dataSetName), dataSetLocation, timeSteps, species, dataSetName))
-                            file_content.close()
+                if folder == keyFolderNames[0]:
+                    speciesNames = sorted(os.listdir(subDir))
+                    for species in speciesNames:
+                        if os.path.isdir(os.path.join(subDir, species)):
+                            self.AddSpecies(Species(species))
+                            speciesFields = sorted(os.listdir(subDir + "/" + species))
+                            for field in speciesFields:
+                                if os.path.isdir(os.path.join(subDir + "/" + species, field)):
+                                    fieldLocation = subDir + "/" + species + "/" + field
+                                    speciesFieldScans.append((species, executor.submit(self._ScanOsirisFieldLocation, field, fieldLocation, species)))
+                elif folder == keyFolderNames[1]:
+                    domainFields = sorted(os.listdir(subDir))
+                    for field in domainFields:
+                        if os.path.isdir(os.path.join(subDir, field)):
+                            fieldLocation = subDir + "/" + field
+                            domainFieldScans.append(executor.submit(self._ScanOsirisFieldLocation, field, fieldLocation))
+                elif folder ==  keyFolderNames[3]:
+                    speciesNames = sorted(os.listdir(subDir))
+                    for species in speciesNames:
+                        if os.path.isdir(os.path.join(subDir, species)):
+                            self.AddSpecies(Species(species))
+                            dataSetLocation = subDir + "/" + species
+                            rawDataScans.append((species, executor.submit(self._ScanOsirisRawDataLocation, dataSetLocation, species)))
+            # Add the results
+            for species, scan in speciesFieldScans:
+                field = scan.result()
+                if field is not None:
+                    self.AddFieldToSpecies(species, field)
+            for scan in domainFieldScans:
+                field = scan.result()
+                if field is not None:
+                    self.AddDomainField(field)
+            for species, scan in rawDataScans:
+                tags, dataSets = scan.result()
+                for tag in tags:
+                    self.AddRawDataTagsToSpecies(species, tag)
+                for dataSet in dataSets:
+                    self.AddRawDataToSpecies(species, dataSet)
+
+    def _ScanOsirisFieldLocation(self, fieldName, fieldLocation, speciesName = ""):
+        timeSteps = self.GetTimeStepsInOsirisLocation(fieldLocation)
+        if timeSteps.size != 0:
+            return FolderField("Osiris", fieldName, self.GiveStandardNameForOsirisQuantity(fieldName), fieldLocation, timeSteps, speciesName)
+
+    def _ScanOsirisRawDataLocation(self, dataSetLocation, speciesName):
+        tags = list()
+        dataSets = list()
+        timeSteps = self.GetTimeStepsInOsirisLocation(dataSetLocation)
+        if timeSteps.size != 0:
+            for dataSetName in self.GetRawDataSetsInOsirisLocation(dataSetLocation, speciesName, timeSteps[0]):
+                if dataSetName == "tag":
+                    tags.append(RawDataTags("Osiris", dataSetName, dataSetLocation, timeSteps, speciesName, dataSetName))
+                else:
+                    dataSets.append(FolderRawDataSet("Osiris", dataSetName, self.GiveStandardNameForOsirisQuantity(dataSetName), dataSetLocation, timeSteps, speciesName, dataSetName))
+        return tags, dataSets
 
     def GetTimeStepsInOsirisLocation(self, location):
+        timeSteps = DataReader.GetMetadataIndex().GetTimeSteps(location)
+        if timeSteps is not None:
+            return timeSteps
         fileNamesList = os.listdir(location)
         # filter only .h5 files
         h5Files = list()
@@ -147,8 +178,18 @@ class FolderDataReader:
             i+=1
         timeSteps = timeSteps.astype(np.int64)
         timeSteps.sort()
+        DataReader.GetMetadataIndex().SetTimeSteps(location, timeSteps)
         return timeSteps
 
+    def GetRawDataSetsInOsirisLocation(self, location, speciesName, timeStep):
+        dataSetNames = DataReader.GetMetadataIndex().GetDataSetNames(location)
+        if dataSetNames is None:
+            file_path = location + "/" + "RAW-" + speciesName + "-" + str(timeStep).zfill(6) + ".h5"
+            with DataReader.GetFilePool().OpenFile(file_path) as file_content:
+                dataSetNames = list(file_content)
+            DataReader.GetMetadataIndex().SetDataSetNames(location, dataSetNames)
+        return dataSetNames
+
     def GiveStandardNameForOsirisQuantity(self, osirisName):
         if "e1" in osirisName:
             return "Ez"
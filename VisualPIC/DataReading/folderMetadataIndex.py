@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import json
+import threading
+import numpy as np
+
+
+class FolderMetadataIndex(object):
+    """Index of the metadata found in the simulation folder (time steps, data sets, shapes, units and times).
+
+    It is stored as a JSON file in the simulation folder. The metadata of each directory is saved together
+    with its modification time and the size and modification time of its first and last files, so that only
+    the directories which changed since the last scan (including a last dump rewritten in place) are read again.
+    """
+    fileName = ".visualpic_index.json"
+    version = 3
+
+    def __init__(self):
+        self._enabled = True
+        self._dataLocation = None
+        self._directories = {} # directory (relative to the data location) -> metadata
+        self._checkedDirectories = set() # directories whose modification time has already been checked
+        self._modified = False
+        self._lock = threading.RLock()
+
+    def SetEnabled(self, enabled):
+        self._enabled = enabled
+
+    def IsEnabled(self):
+        return self._enabled
+
+    def Load(self, dataLocation):
+        """Reads the index stored in 'dataLocation', if any. The index of the previous location is saved first."""
+        with self._lock:
+            self.Save()
+            self._dataLocation = dataLocation
+            self._directories = {}
+            self._checkedDirectories = set()
+            self._modified = False
+            if not self._enabled:
+                return
+            try:
+                with open(self._GetFilePath(), "r") as indexFile:
+                    content = json.load(indexFile)
+                if content.get("version") == self.version:
+                    self._directories = content["directories"]
+            except (OSError, ValueError, KeyError):
+                pass # no index yet or unreadable: the folder is scanned as usual
+
+    def Save(self):
+        with self._lock:
+            if not (self._enabled and self._modified and self._dataLocation):
+                return
+            filePath = self._GetFilePath()
+            temporaryPath = filePath + ".tmp"
+            try:
+                with open(temporaryPath, "w") as indexFile:
+                    json.dump({"version":self.version, "directories":self._directories}, indexFile)
+                os.replace(temporaryPath, filePath)
+                self._modified = False
+            except OSError:
+                pass # e.g. read-only simulation folder
+
+    def GetTimeSteps(self, location):
+        directory = self._GetDirectory(location)
+        if directory is not None:
+            with self._lock:
+                timeSteps = directory.get("timeSteps")
+            if timeSteps is not None:
+                return np.array(timeSteps, dtype=np.int64)
+
+    def SetTimeSteps(self, location, timeSteps):
+        directory = self._GetDirectory(location)
+        if directory is not None:
+            with self._lock:
+                directory["timeSteps"] = [int(timeStep) for timeStep in timeSteps]
+                self._modified = True
+
+    def GetDataSetNames(self, location):
+        directory = self._GetDirectory(location)
+        if directory is not None:
+            with self._lock:
+                return directory.get("dataSets")
+
+    def SetDataSetNames(self, location, dataSetNames):
+        directory = self._GetDirectory(location)
+        if directory is not None:
+            with self._lock:
+                directory["dataSets"] = list(dataSetNames)
+                self._modified = True
+
+    def GetElementData(self, location, elementKey):
+        """Returns a dictionary with the stored metadata of a data element (e.g. shape and units), or None."""
+        directory = self._GetDirectory(location)
+        if directory is not None:
+            with self._lock:
+                return directory.setdefault("elements", {}).get(elementKey)
+
+    def SetElementData(self, location, elementKey, elementData):
+        directory = self._GetDirectory(location)
+        if directory is not None:
+            with self._lock:
+                elements = directory.setdefault("elements", {})
+                elements.setdefault(elementKey, {}).update(elementData)
+                self._modified = True
+
+    def GetTime(self, location, timeStep):
+        directory = self._GetDirectory(location)
+        if directory is not None:
+            with self._lock:
+                return directory.setdefault("times", {}).get(str(timeStep))
+
+    def SetTime(self, location, timeStep, time):
+        directory = self._GetDirectory(location)
+        if directory is not None:
+            with self._lock:
+                directory.setdefault("times", {})[str(timeStep)] = float(time)
+                self._modified = True
+
+    def _GetDirectory(self, location):
+        """Returns the stored metadata of 'location', or None if the index is disabled.
+
+        The first time a directory is accessed it is validated. The file system is only accessed outside
+        the lock, so that several directories can be validated at the same time by the scan threads.
+        """
+        if not self._enabled:
+            return None
+        key = self._GetKey(location)
+        with self._lock:
+            if key in self._checkedDirectories:
+                return self._directories[key]
+            directory = self._directories.get(key)
+        if directory is None or not self._IsUnchanged(location, directory):
+            # new or modified directory: its previous metadata is no longer valid
+            directory = self._GetSignature(location)
+        with self._lock:
+            if key not in self._checkedDirectories:
+                self._checkedDirectories.add(key)
+                if directory is not self._directories.get(key):
+                    self._directories[key] = directory
+                    self._modified = True
+            return self._directories[key]
+
+    def _IsUnchanged(self, location, directory):
+        # Only the directory and its first and last files are checked. A file rewritten in place (with the
+        # same name) does not change the modification time of the directory, but the last dump is the one
+        # which is usually rewritten (e.g. by a restarted simulation).
+        try:
+            if os.stat(location).st_mtime_ns != directory.get("mtime"):
+                return False
+            for fileName, fileSignature in directory.get("files", {}).items():
+                fileStat = os.stat(os.path.join(location, fileName))
+                if [fileStat.st_size, fileStat.st_mtime_ns] != fileSignature:
+                    return False
+        except OSError:
+            return False
+        return True
+
+    def _GetSignature(self, location):
+        # Modification time of the directory and size and modification time of its first and last files.
+        try:
+            modificationTime = os.stat(location).st_mtime_ns
+            fileNames = sorted(fileName for fileName in os.listdir(location) if not fileName.startswith("."))
+            fileSignatures = {}
+            for fileName in fileNames[:1] + fileNames[-1:]:
+                fileStat = os.stat(os.path.join(location, fileName))
+                fileSignatures[fileName] = [fileStat.st_size, fileStat.st_mtime_ns]
+        except OSError:
+            return {"mtime":None, "files":{}}
+        return {"mtime":modificationTime, "files":fileSignatures}
+
+    def _GetKey(self, location):
+        if self._dataLocation:
+            return os.path.relpath(location, self._dataLocation).replace("\\", "/")
+        return location
+
+    def _GetFilePath(self):
+        return os.path.join(self._dataLocation, self.fileName)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from h5py import File as H5File
+
+
+class _PooledFile(object):
+    def __init__(self, h5File):
+        self.file = h5File
+        self.lastUse = time.monotonic()
+        self.leases = 0 # number of users of the file at this moment
+        self.isRetired = False # removed from the pool, to be closed when the last user releases it
+
+
+class H5FilePool(object):
+    """Bounded LRU pool of open (read-only) HDF5 files, shared by all the data readers.
+
+    The files are leased with OpenFile, and a file is only closed when nobody is using it. Files
+    evicted from the pool while in use are closed when their last lease ends.
+
+    Keyword arguments:
+    capacity -- maximum number of files kept open at the same time (unless more are in use).
+    idleTimeout -- time (in seconds) after which an unused file is closed. Use None to disable it.
+    """
+    def __init__(self, capacity = 32, idleTimeout = 60):
+        self._capacity = capacity
+        self._idleTimeout = idleTimeout
+        self._openFiles = OrderedDict() # filePath -> _PooledFile
+        self._pendingOpens = {} # filePath -> threading.Event, for files being opened by another thread
+        self._lock = threading.RLock()
+
+    def SetCapacity(self, capacity):
+        with self._lock:
+            self._capacity = max(1, int(capacity))
+            self._EvictExceedingFiles()
+
+    def GetCapacity(self):
+        return self._capacity
+
+    def SetIdleTimeout(self, idleTimeout):
+        with self._lock:
+            self._idleTimeout = idleTimeout
+            self._EvictIdleFiles()
+
+    def GetIdleTimeout(self):
+        return self._idleTimeout
+
+    @contextmanager
+    def OpenFile(self, filePath):
+        """Context manager which leases an open h5py.File. The file belongs to the pool and should not be
+        closed by the caller, nor used after the end of the 'with' block."""
+        entry = self._AcquireFile(filePath)
+        try:
+            yield entry.file
+        finally:
+            self._ReleaseFile(entry)
+
+    def CloseFile(self, filePath):
+        with self._lock:
+            if filePath in self._openFiles:
+                self._RemoveFile(filePath)
+
+    def CloseAll(self):
+        with self._lock:
+            for filePath in list(self._openFiles):
+                self._RemoveFile(filePath)
+
+    def GetNumberOfOpenFiles(self):
+        return len(self._openFiles)
+
+    def _AcquireFile(self, filePath):
+        while True:
+            with self._lock:
+                self._EvictIdleFiles()
+                entry = self._openFiles.get(filePath)
+                if entry is not None:
+                    self._openFiles.move_to_end(filePath)
+                    entry.leases += 1
+                    entry.lastUse = time.monotonic()
+                    return entry
+                pendingOpen = self._pendingOpens.get(filePath)
+                if pendingOpen is None:
+                    openFinished = threading.Event()
+                    self._pendingOpens[filePath] = openFinished
+                    break
+            # If the other thread failed to open the file, the next iteration tries again.
+            pendingOpen.wait()
+        try:
+            # opened outside the lock, so that other threads can open or use other files meanwhile
+            entry = _PooledFile(H5File(filePath, 'r'))
+            entry.leases = 1
+            with self._lock:
+                self._openFiles[filePath] = entry
+                self._EvictExceedingFiles()
+        finally:
+            with self._lock:
+                del self._pendingOpens[filePath]
+            openFinished.set()
+        return entry
+
+    def _ReleaseFile(self, entry):
+        with self._lock:
+            entry.leases -= 1
+            entry.lastUse = time.monotonic()
+            if entry.leases == 0:
+                if entry.isRetired:
+                    entry.file.close()
+                else:
+                    self._EvictExceedingFiles()
+
+    def _RemoveFile(self, filePath):
+        entry = self._openFiles.pop(filePath)
+        if entry.leases == 0:
+            entry.file.close()
+        else:
+            entry.isRetired = True
+
+    def _EvictExceedingFiles(self):
+        # the least recently used files which are not in use are closed first
+        for filePath in list(self._openFiles):
+            if len(self._openFiles) <= self._capacity:
+                break
+            if self._openFiles[filePath].leases == 0:
+                self._RemoveFile(filePath)
+
+    def _EvictIdleFiles(self):
+        if self._idleTimeout is None:
+            return
+        now = time.monotonic()
+        # The dictionary is sorted by time of last use, so the oldest files come first.
+        for filePath, entry in list(self._openFiles.items()):
+            if now - entry.lastUse < self._idleTimeout:
+                break
+            if entry.leases == 0:
+                self._RemoveFile(filePath)
@@ -18,11 +18,13 @@
 #along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
 import abc
-from h5py import File as H5File
+import threading
 import numpy as np
 
 from VisualPIC.DataReading.dataReader import DataReader
+from VisualPIC.DataReading.tagIndex import TagIndex
 
 # TODO: Add try/except statement for openPMD-viewer
 from opmd_viewer import OpenPMDTimeSeries
@@ -31,68 +33,132 @@ from opmd_viewer import OpenPMDTimeSeries
 class RawDataReaderBase(DataReader):
     """Parent class for all rawDataReaders"""
     __metaclass__  = abc.ABCMeta
+    _saveTagIndices = False # whether the tag indices are saved next to the data files
+
+    @classmethod
+    def SetTagIndexPersistence(cls, enabled):
+        cls._saveTagIndices = enabled
+
     def __init__(self, location, speciesName, dataName, internalName, firstTimeStep):
         DataReader.__init__(self, location, speciesName, dataName, internalName)
         self.internalName = dataName
         self.firstTimeStep = firstTimeStep
 
-    def GetData(self, timeStep):
-        if timeStep != self.currentTimeStep:
-            self.currentTimeStep = timeStep
-            self.data = self._ReadData(timeStep)
-        return self.data
+    def GetData(self, timeStep, useCache = True):
+        """With useCache = False, the data is read without storing it in the data cache (e.g. when
+        going through all the time steps), unless it is already there."""
+        key = (self, "Data", timeStep)
+        if not useCache and not self._dataCache.Contains(key):
+            return self._ReadData(timeStep)
+        return self._dataCache.GetData(key, lambda: self._ReadData(timeStep))
+
+    def GetDataChunks(self, timeStep, chunkSize):
+        """Yields (index of first particle, data) for consecutive chunks of 'chunkSize' particles.
+        Unless the data is already cached, only one chunk is kept in memory at a time."""
+        numberOfParticles = self._GetNumberOfParticles(timeStep)
+        if numberOfParticles is None or self._dataCache.Contains((self, "Data", timeStep)):
+            data = self.GetData(timeStep)
+            for start in range(0, len(data), chunkSize):
+                yield start, data[start:start+chunkSize]
+        else:
+            for start in range(0, numberOfParticles, chunkSize):
+                yield start, self._ReadDataRange(timeStep, start, start+chunkSize)
+
+    def GetDataRange(self, timeStep, start, stop):
+        """Returns the data of the particles from 'start' to 'stop'. Unless the data is already cached
+        (or can not be read in parts), only this range is read."""
+        if self._dataCache.Contains((self, "Data", timeStep)) or self._GetNumberOfParticles(timeStep) is None:
+            return self.GetData(timeStep)[start:stop]
+        return self._ReadDataRange(timeStep, start, stop)
+
+    def GetNumberOfParticles(self, timeStep):
+        numberOfParticles = self._GetNumberOfParticles(timeStep)
+        if numberOfParticles is None:
+            numberOfParticles = len(self.GetData(timeStep))
+        return numberOfParticles
+
+    def GetTagIndex(self, timeStep):
+        """Returns a TagIndex with the (tag) data of the given time step."""
+        key = (self, "TagIndex", timeStep)
+        return self._dataCache.GetData(key, lambda: self._BuildTagIndex(timeStep))
+
+    def _BuildTagIndex(self, timeStep):
+        if not self._saveTagIndices:
+            return TagIndex.FromTags(self.GetData(timeStep))
+        dataFilePath = self._GetFilePath(timeStep)
+        dataFileModificationTime = os.stat(dataFilePath).st_mtime_ns
+        indexFileName = os.path.basename(dataFilePath) + "-" + self.speciesName + "-" + self.internalName + ".npz"
+        indexFilePath = os.path.join(os.path.dirname(dataFilePath), TagIndex.folderName, indexFileName)
+        tagIndex = TagIndex.Load(indexFilePath, dataFileModificationTime)
+        if tagIndex is None:
+            tagIndex = TagIndex.FromTags(self.GetData(timeStep))
+            tagIndex.Save(indexFilePath, dataFileModificationTime)
+        return tagIndex
+
+    def _GetNumberOfParticles(self, timeStep):
+        # Number of particles in the file, if it can be known without reading the data. Otherwise, None.
+        return None
 
     def GetDataUnits(self):
         if self.dataUnits == "":
-            self._ReadUnits()
+            self._LoadUnits()
         return self.dataUnits
 
-    def GetTime(self, timeStep):
-        if timeStep != self.currentTimeStep:
-            self.currentTimeStep = timeStep
-            self._ReadTime(timeStep)
-        return self.currentTime
-
     def GetTimeUnits(self):
         if self.timeUnits == "":
-            self._ReadUnits()
+            self._LoadUnits()
         return self.timeUnits
 
+    def _LoadUnits(self):
+        units = self._metadataIndex.GetElementData(self.location, self._GetIndexKey())
+        if units is not None and "dataUnits" in units:
+            self.dataUnits = units["dataUnits"]
+            self.timeUnits = units["timeUnits"]
+        else:
+            self._ReadUnits()
+            self._metadataIndex.SetElementData(self.location, self._GetIndexKey(), {"dataUnits":self.dataUnits, "timeUnits":self.timeUnits})
+
 
 class OsirisRawDataReader(RawDataReaderBase):
     def __init__(self, location, speciesName, dataName, internalName, firstTimeStep):
         RawDataReaderBase.__init__(self, location, speciesName, dataName, internalName, firstTimeStep)
 
     def _ReadData(self, timeStep):
-        file_content = self._OpenFile(timeStep)
-        if self.internalName == "tag":
-            tags = np.array(file_content.get(self.internalName))
-            a = tags[:,0]
-            b = tags[:,1]
-            data = 1/2*(a+b)*(a+b+1)+b # Cantor pairing function
-        else:
-            data = np.array(file_content.get(self.internalName))
-        self.currentTime = file_content.attrs["TIME"][0]
-        file_content.close()
-        return data
+        return self._ReadDataRange(timeStep, 0, None)
+
+    def _ReadDataRange(self, timeStep, start, stop):
+        with self._OpenFile(timeStep) as file_content:
+            if self.internalName == "tag":
+                # The tag is a pair of 32-bit integers (node, particle number), packed exactly into one 64-bit integer.
+                tags = np.array(file_content[self.internalName][start:stop], dtype=np.int64)
+                a = tags[:,0]
+                b = tags[:,1]
+                data = (a << 32) | (b & 0xFFFFFFFF)
+            else:
+                data = np.array(file_content[self.internalName][start:stop])
+            return data
+
+    def _GetNumberOfParticles(self, timeStep):
+        with self._OpenFile(timeStep) as file_content:
+            return file_content[self.internalName].shape[0]
 
     def _ReadTime(self, timeStep):
-        file_content = self._OpenFile(timeStep)
-        self.currentTime = file_content.attrs["TIME"][0]
-        file_content.close()
+        with self._OpenFile(timeStep) as file_content:
+            return file_content.attrs["TIME"][0]
 
     def _ReadUnits(self):
-        file_content = self._OpenFile(self.firstTimeStep)
-        self.dataUnits = str(list(file_content[self.internalName].attrs["UNITS"])[0])[2:-1].replace("\\\\","\\")
-        self.timeUnits = str(file_content.attrs["TIME UNITS"][0])[2:-1].replace("\\\\","\\")
-        file_content.close()
+        with self._OpenFile(self.firstTimeStep) as file_content:
+            self.dataUnits = str(list(file_content[self.internalName].attrs["UNITS"])[0])[2:-1].replace("\\\\","\\")
+            self.timeUnits = str(file_content.attrs["TIME UNITS"][0])[2:-1].replace("\\\\","\\")
 
     def _OpenFile(self, timeStep):
+        # lease of the file, to be used in a 'with' statement
+        return self._filePool.OpenFile(self._GetFilePath(timeStep))
+
+    def _GetFilePath(self, timeStep):
         fileName = "RAW-" + self.speciesName + "-" + str(timeStep).zfill(6)
         ending = ".h5"
-        file_path = self.location + "/" + fileName + ending
-        file_content = H5File(file_path, 'r')
-        return file_content
+        return self.location + "/" + fileName + ending
 
 
 class OpenPMDRawDataReader(RawDataReaderBase):
@@ -100,20 +166,25 @@ class OpenPMDRawDataReader(RawDataReaderBase):
         # Store an openPMD timeseries object
         # (Its API is used in order to conveniently extract data from the file)
         self.openpmd_ts = OpenPMDTimeSeries( location, check_all_files=False )
+        # The methods of openpmd_ts which read data change its state, so they can
+        # only be called by one thread at a time (e.g. when prefetching data).
+        self._openpmdLock = threading.Lock()
         # Initialize the instance
         RawDataReaderBase.__init__(self, location, speciesName, dataName, internalName, firstTimeStep)
 
     def _ReadData(self, timeStep):
-        data, = self.openpmd_ts.get_particle( [self.internalName],
-                    species=self.speciesName, iteration=timeStep )
-        self.currentTime = self._ReadTime(timeStep)
+        with self._openpmdLock:
+            data, = self.openpmd_ts.get_particle( [self.internalName],
+                        species=self.speciesName, iteration=timeStep )
         return data
 
     def _ReadTime(self, timeStep):
-        # The line below sets the attribute `_current_i` of openpmd_ts
-        self.openpmd_ts._find_output( None, timeStep )
-        # This sets the corresponding time
-        self.currentTime = self.openpmd_ts.t[ self.openpmd_ts._current_i ]
+        return self.openpmd_ts.t[ self._GetIterationIndex(timeStep) ]
+
+    def GetTimes(self, timeSteps):
+        # The times of all the iterations are already known by openpmd_ts
+        indices = np.searchsorted(self.openpmd_ts.iterations, timeSteps)
+        return self.openpmd_ts.t[indices]
 
     def _ReadUnits(self):
         # OpenPMD data always provide conversion to SI units
@@ -121,9 +192,27 @@ class OpenPMDRawDataReader(RawDataReaderBase):
         self.timeUnits = "s"
 
     def _OpenFile(self, timeStep):
-        # The line below sets the attribute `_current_i` of openpmd_ts
-        self.openpmd_ts._find_output( None, timeStep )
+        # lease of the file, to be used in a 'with' statement
+        return self._filePool.OpenFile(self._GetFilePath(timeStep))
+
+    def __getstate__(self):
+        # the lock can not be sent to other processes (e.g. when tracking particles)
+        state = self.__dict__.copy()
+        del state["_openpmdLock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._openpmdLock = threading.Lock()
+
+    def _GetIterationIndex(self, timeStep):
+        # The index is found locally instead of with openpmd_ts._find_output, which
+        # sets the attribute `_current_i` shared by all the threads using the reader.
+        index = np.searchsorted(self.openpmd_ts.iterations, timeStep)
+        if index >= len(self.openpmd_ts.iterations) or self.openpmd_ts.iterations[index] != timeStep:
+            raise OSError("Iteration " + str(timeStep) + " not found in " + self.location)
+        return index
+
+    def _GetFilePath(self, timeStep):
         # This finds the full path to the corresponding file
-        fileName = self.openpmd_ts.h5_files[ self.openpmd_ts._current_i ]
-        file_content = H5File(fileName, 'r')
-        return file_content
+        return self.openpmd_ts.h5_files[ self._GetIterationIndex(timeStep) ]
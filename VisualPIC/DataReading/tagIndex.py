@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import numpy as np
+
+
+class TagIndex(object):
+    """Sorted index of the particle tags in one time step, used to find the position of any tag in O(log N)."""
+    folderName = ".visualpic_tags" # hidden folder where the indices are saved, next to the data files
+
+    def __init__(self, sortedTags, sortingIndices):
+        self.sortedTags = sortedTags
+        self.sortingIndices = sortingIndices
+
+    @classmethod
+    def FromTags(cls, tags):
+        tags = np.asarray(tags)
+        sortingIndices = np.argsort(tags, kind="mergesort")
+        return cls(tags[sortingIndices], sortingIndices)
+
+    @classmethod
+    def Load(cls, filePath, sourceModificationTime):
+        """Reads an index saved with 'Save'. Returns None if it does not exist or if the data file has changed since."""
+        try:
+            with np.load(filePath) as indexFile:
+                if indexFile["sourceModificationTime"] != sourceModificationTime:
+                    return None
+                return cls(indexFile["sortedTags"], indexFile["sortingIndices"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def Save(self, filePath, sourceModificationTime):
+        temporaryPath = filePath + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(filePath), exist_ok=True)
+            with open(temporaryPath, "wb") as indexFile:
+                np.savez(indexFile, sortedTags=self.sortedTags, sortingIndices=self.sortingIndices, sourceModificationTime=sourceModificationTime)
+            os.replace(temporaryPath, filePath)
+        except OSError:
+            pass # e.g. read-only simulation folder
+
+    @property
+    def nbytes(self):
+        return self.sortedTags.nbytes + self.sortingIndices.nbytes
+
+    def GetNumberOfTags(self):
+        return len(self.sortedTags)
+
+    def GetIndicesOfTags(self, tags):
+        """Returns the position in the data file of each of the given tags (-1 if not present)."""
+        tags = np.asarray(tags)
+        if len(self.sortedTags) == 0:
+            return -np.ones(len(tags), dtype=int)
+        positions = np.minimum(np.searchsorted(self.sortedTags, tags), len(self.sortedTags)-1)
+        isFound = self.sortedTags[positions] == tags
+        return np.where(isFound, self.sortingIndices[positions], -1)
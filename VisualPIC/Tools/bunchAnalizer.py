@@ -1,121 +1,185 @@
-## -*- coding: utf-8 -*-
-
-#### TO REMOVE ###
-## Add VisualPIC folder to python path, so that folders can be called as modules
-#import os
-#import inspect
-#currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-#parentdir = os.path.dirname(os.path.dirname(currentdir))
-#os.sys.path.insert(0,parentdir) 
-#### TO REMOVE ###
-
-#from VisualPIC.DataReading.availableData import AvailableData
-#from VisualPIC.DataReading.species import Species
-
-#from VisualPIC.DataPlotting.colorMapsCollection import ColorMapsCollection
-#from VisualPIC.DataPlotting.dataPlotter import DataPlotter
-#from VisualPIC.DataHandling.fieldToPlot import FieldToPlot
-#from VisualPIC.DataHandling.rawDataSetToPlot import RawDataSetToPlot
-#from VisualPIC.DataHandling.subplot import Subplot
-#import VisualPIC.DataHandling.unitConverters as unitConverters
-
-#import numpy as np
-
-#class BunchAnalizer:
-
-#    def __init__(self, availableData, dataPlotter, colorMapsCollection):
-#        self.availableData = availableData
-#        self.dataPlotter = dataPlotter
-#        self.colorMapsCollection = colorMapsCollection
-#        self.rawSpeciesList = self.availableData.GetSpeciesWithRawData() #list containing the species, not just the names
-
-#    def GetSpecies(self, speciesName):
-#        for species in self.rawSpeciesList:
-#            if species.GetName() == speciesName:
-#                return species
-
-#    def dot(self, A, B):
-#        return np.sum(A.conj()*B, axis=0)
-
-#    def WeightedMean(self, x, x_weight):
-#        w = np.divide(x_weight,np.sum(x_weight))
-#        mean = self.dot(x, w)
-#        std = np.sqrt(self.dot(np.square(x-mean),w))
-#        return mean, std
-
-#    def CalculateMeanEnergy(self, bunchName, timeStep):
-#        c=299792458 #m/s
-#        e=1.60217733e-19 #C
-#        m_e=9.1093897e-31 #kg
-#        selectedSpecies = self.GetSpecies(bunchName)
-
-#        ene = np.array(selectedSpecies.GetRawDataSet("ene").GetPlotData(timeStep)[0])
-#        q = np.array(selectedSpecies.GetRawDataSet("q").GetPlotData(timeStep)[0])
-
-#        eMean, eStd = self.WeightedMean(ene, q)
-#        return eMean*m_e*c**2/e
-
-#    def CalculateEnergySpread(self, bunchName, timeStep):
-#        selectedSpecies = self.GetSpecies(bunchName)
-
-#        ene = np.array(selectedSpecies.GetRawDataSet("ene").GetPlotData(timeStep)[0])
-#        q = np.array(selectedSpecies.GetRawDataSet("q").GetPlotData(timeStep)[0])
-
-#        eMean, eStd = self.WeightedMean(ene, q)
-#        eSpread = eStd / eMean
-#        return eSpread
-
-#    def CalculateEmmitance(self, bunchName, timeStep):
-#        c=299792458 #m/s
-#        e=1.60217733e-19 #C
-#        m_e=9.1093897e-31 #kg
-#        eps_0=8.854187817e-12 #As/(Vm)
-
-#        n_p = 1e17
-#        n_p_SI = n_p*1e6
-#        w_p = np.sqrt(n_p_SI*(e)**2/(m_e*eps_0)) #plasma freq (s-1)
-#        s_d = c/w_p #plasma skin depth [m]
-
-#        selectedSpecies = self.GetSpecies(bunchName)
-
-#        eMass = 0.510998 # in MeV
-
-#        p1 = np.array(selectedSpecies.GetRawDataSet("p1").GetPlotData(timeStep)[0])
-#        p2 = np.array(selectedSpecies.GetRawDataSet("p2").GetPlotData(timeStep)[0])
-#        ene = np.array(selectedSpecies.GetRawDataSet("ene").GetPlotData(timeStep)[0])
-#        x2 = np.array(selectedSpecies.GetRawDataSet("x2").GetPlotData(timeStep)[0])
-#        q = np.array(selectedSpecies.GetRawDataSet("q").GetPlotData(timeStep)[0])
-
-#        p = np.divide(q,np.sum(q))
-
-#        x2pr = np.divide(p2, p1)
-
-#        x2_ave = self.dot(np.square(x2),p) - np.square(self.dot(x2,p))
-#        x2pr_ave = self.dot(np.square(x2pr),p) - np.square(self.dot(x2pr,p))
-#        x2x2pr_ave = self.dot(np.multiply(x2,x2pr),p) - np.multiply(self.dot(x2,p),self.dot(x2pr,p))
-
-#        emitt=np.sqrt(x2_ave*x2pr_ave-x2x2pr_ave*x2x2pr_ave)
-#        eMean = self.WeightedMean(ene, q)[0]
-#        norm_trans_emm = emitt*s_d*eMean*eMass*1e6
-#        return norm_trans_emm
-
-#    def CalculateAll(self, bunchName, timeStep):
-#        print(self.CalculateMeanEnergy(bunchName, timeStep))
-#        print(self.CalculateEnergySpread(bunchName, timeStep))
-#        print(self.CalculateEmmitance(bunchName, timeStep))
-
-
-#availableData = AvailableData()
-#colorMapsCollection = ColorMapsCollection()
-#dataPlotter = DataPlotter(colorMapsCollection)
-
-#folderPath = 'H:\\PhD\\Osiris_test_data\\MS'
-#availableData.SetDataFolderLocation(folderPath)
-#availableData.LoadFolderData()
-
-#analizer = BunchAnalizer(availableData, dataPlotter, colorMapsCollection)
-#em = analizer.CalculateAll("sinbad-bunch", 26)
-
-
-
-
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+from VisualPIC.DataHandling.binnedMomentAccumulator import BinnedMomentAccumulator
+
+
+def WeightedMean(values, weights):
+    return np.sum(values*weights) / np.sum(weights)
+
+def WeightedCovariance(valuesA, valuesB, weights):
+    meanA = WeightedMean(valuesA, weights)
+    meanB = WeightedMean(valuesB, weights)
+    return np.sum((valuesA-meanA)*(valuesB-meanB)*weights) / np.sum(weights)
+
+def WeightedVariance(values, weights):
+    return WeightedCovariance(values, values, weights)
+
+
+class BunchAnalyzer(object):
+    """Calculates the main parameters of a particle bunch (a species with raw data) in IS units.
+
+    All the parameters of a time step are calculated together, reading each data set only once,
+    and they are cached per (species, time step).
+
+    Keyword arguments:
+    dataContainer -- the DataContainer with the simulation data.
+    numberOfSlices -- number of longitudinal slices used for the slice parameters.
+    numberOfCurrentBins -- number of longitudinal bins of the current profile.
+    """
+    def __init__(self, dataContainer, numberOfSlices = BinnedMomentAccumulator.defaultNumberOfSlices, numberOfCurrentBins = 100):
+        self.c = 299792458 #m/s
+        self.m_e = 9.1093897 * 10**(-31) #kg
+        self._dataContainer = dataContainer
+        self._numberOfSlices = numberOfSlices
+        self._numberOfCurrentBins = numberOfCurrentBins
+        self._cachedParameters = {} # (species name, time step) -> parameters
+        self._cachedSimulationParameters = None
+
+    def SetNumberOfSlices(self, numberOfSlices):
+        self._numberOfSlices = numberOfSlices
+        self.ClearCache()
+
+    def SetNumberOfCurrentBins(self, numberOfBins):
+        self._numberOfCurrentBins = numberOfBins
+        self.ClearCache()
+
+    def ClearCache(self):
+        self._cachedParameters = {}
+
+    def GetSpeciesNames(self):
+        names = list()
+        for species in self._dataContainer.GetSpeciesWithRawData():
+            names.append(species.GetName())
+        return names
+
+    def GetTimeSteps(self, speciesName):
+        return self._dataContainer.GetSpecies(speciesName).GetRawDataTimeSteps()
+
+    def GetParameters(self, speciesName, timeStep):
+        """Returns a dictionary with the bunch parameters in the given time step."""
+        # The parameters in IS units depend on the simulation parameters (e.g. the plasma density).
+        simulationParameters = dict(self._dataContainer.GetSimulationParameters())
+        if simulationParameters != self._cachedSimulationParameters:
+            self.ClearCache()
+            self._cachedSimulationParameters = simulationParameters
+        key = (speciesName, timeStep)
+        if key not in self._cachedParameters:
+            self._cachedParameters[key] = self._CalculateParameters(self._dataContainer.GetSpecies(speciesName), timeStep)
+        return self._cachedParameters[key]
+
+    def GetEvolution(self, speciesName, parameterNames = None):
+        """Returns a dictionary with an array with the value of each (scalar) parameter in all the time steps,
+        as well as the "Time" (in s) and the "Time steps"."""
+        timeSteps = self.GetTimeSteps(speciesName)
+        species = self._dataContainer.GetSpecies(speciesName)
+        referenceDataSet = species.GetRawDataSet("z")
+        evolution = {"Time steps":timeSteps, "Time":np.zeros(len(timeSteps))}
+        for i in np.arange(len(timeSteps)):
+            parameters = self.GetParameters(speciesName, timeSteps[i])
+            if parameterNames is None:
+                parameterNames = [name for name, value in parameters.items() if np.ndim(value) == 0]
+            for parameterName in parameterNames:
+                if parameterName not in evolution:
+                    evolution[parameterName] = np.full(len(timeSteps), np.nan)
+                evolution[parameterName][i] = parameters.get(parameterName, np.nan)
+            evolution["Time"][i] = referenceDataSet.GetTimeInUnits("s", timeSteps[i])
+        return evolution
+
+    def _GetData(self, species, dataSetName, timeStep):
+        dataSet = species.GetRawDataSet(dataSetName)
+        if dataSet is not None:
+            return np.asarray(dataSet.GetDataInISUnits(timeStep))
+
+    def _CalculateParameters(self, species, timeStep):
+        # each data set is read only once
+        data = {}
+        for dataSetName in ["x", "y", "z", "Px", "Py", "Pz", "Charge"]:
+            data[dataSetName] = self._GetData(species, dataSetName, timeStep)
+        z = data["z"]
+        pz = data["Pz"]
+        q = data["Charge"]
+        if q is None:
+            q = np.ones(len(z))
+        weights = np.abs(q)
+        parameters = {}
+        parameters["Charge"] = np.sum(q)
+        if len(z) == 0 or np.sum(weights) == 0:
+            return parameters
+        # Longitudinal parameters
+        momentum = np.square(pz)
+        for transverseMomentumName in ["Px", "Py"]:
+            transverseMomentum = data[transverseMomentumName]
+            if transverseMomentum is not None:
+                momentum = momentum + np.square(transverseMomentum)
+        gamma = np.sqrt(1 + momentum/(self.m_e*self.c)**2)
+        kineticEnergy = (gamma-1)*self.m_e*self.c**2
+        meanEnergy = WeightedMean(kineticEnergy, weights)
+        parameters["Mean z"] = WeightedMean(z, weights)
+        parameters["Length"] = np.sqrt(WeightedVariance(z, weights))
+        parameters["Mean energy"] = meanEnergy
+        parameters["Energy spread"] = np.sqrt(WeightedVariance(kineticEnergy, weights)) / meanEnergy
+        parameters["Mean gamma"] = WeightedMean(gamma, weights)
+        parameters["Current profile"] = self._CalculateCurrentProfile(z, q)
+        # all the slice moments are computed with the same accumulator, without looping over the slices
+        slices = BinnedMomentAccumulator.FromCoordinate(z, weights, self._numberOfSlices)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            parameters["Slice energy spread"] = np.sqrt(slices.GetVariance(gamma)) / (slices.GetMean(gamma)-1)
+        # Transverse parameters of each plane (only the ones available in the simulation)
+        for plane in ["x", "y"]:
+            position = data[plane]
+            transverseMomentum = data["P" + plane]
+            if position is None or transverseMomentum is None:
+                continue
+            divergence = transverseMomentum/pz
+            positionVariance = WeightedVariance(position, weights)
+            divergenceVariance = WeightedVariance(divergence, weights)
+            correlation = WeightedCovariance(position, divergence, weights)
+            emittance = np.sqrt(positionVariance*divergenceVariance - correlation**2) # trace space
+            parameters["Mean " + plane] = WeightedMean(position, weights)
+            parameters["Size " + plane] = np.sqrt(positionVariance)
+            parameters["Divergence " + plane] = np.sqrt(divergenceVariance)
+            parameters["Emittance " + plane] = self._CalculateNormalizedEmittance(position, transverseMomentum, weights)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                parameters["Beta " + plane] = positionVariance / emittance
+                parameters["Alpha " + plane] = -correlation / emittance
+                parameters["Gamma " + plane] = divergenceVariance / emittance
+            parameters["Slice emittance " + plane] = slices.GetEmittance(position, transverseMomentum/(self.m_e*self.c))
+        parameters["Slice z"] = slices.GetBinCenters()
+        return parameters
+
+    def _CalculateNormalizedEmittance(self, position, transverseMomentum, weights):
+        """Normalized emittance in phase space (in m*rad)."""
+        normalizedMomentum = transverseMomentum/(self.m_e*self.c)
+        positionVariance = WeightedVariance(position, weights)
+        momentumVariance = WeightedVariance(normalizedMomentum, weights)
+        correlation = WeightedCovariance(position, normalizedMomentum, weights)
+        return np.sqrt(positionVariance*momentumVariance - correlation**2)
+
+    def _CalculateCurrentProfile(self, z, q):
+        """Returns the centers of the longitudinal bins and the current (in A) in each of them."""
+        charge, binEdges = np.histogram(z, bins = self._numberOfCurrentBins, weights = q)
+        binCenters = (binEdges[1:] + binEdges[:-1]) / 2
+        binLength = binEdges[1] - binEdges[0]
+        if binLength == 0:
+            return binCenters, np.zeros(len(charge))
+        return binCenters, charge / binLength * self.c
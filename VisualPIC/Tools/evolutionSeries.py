@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from h5py import File as H5File
+
+from VisualPIC.DataPlotting.rawDataEvolutionToPlot import RawDataEvolutionToPlot
+from VisualPIC.DataHandling.folderDataElements import FolderDataElement
+from VisualPIC.DataHandling.selfContainedDataElements import EvolutionData
+
+
+"""
+Reductions of the data of a time step to a single value
+"""
+class Reduction(object):
+    """Base class of the reductions. The name identifies the reduction in the cache file, so it
+    must include all the settings which change the result."""
+    name = ""
+
+    def Reduce(self, dataElement, timeStep):
+        raise NotImplementedError
+
+    def _GetData(self, dataElement, timeStep):
+        # Fields and raw data sets, in original units. The data read from the folder is not stored in the
+        # data cache, so that going through all the time steps does not evict the data being shown.
+        if isinstance(dataElement, FolderDataElement):
+            if hasattr(dataElement, "GetAllFieldDataInOriginalUnits"):
+                return np.asarray(dataElement.GetAllFieldDataInOriginalUnits(timeStep, useCache = False))
+            return np.asarray(dataElement.GetDataInOriginalUnits(timeStep, useCache = False))
+        if hasattr(dataElement, "GetAllFieldDataInOriginalUnits"):
+            return np.asarray(dataElement.GetAllFieldDataInOriginalUnits(timeStep))
+        return np.asarray(dataElement.GetDataInOriginalUnits(timeStep))
+
+
+class MaximumReduction(Reduction):
+    def __init__(self, absolute = False):
+        self.absolute = absolute
+        self.name = "max abs" if absolute else "max"
+
+    def Reduce(self, dataElement, timeStep):
+        data = self._GetData(dataElement, timeStep)
+        if self.absolute:
+            data = np.abs(data)
+        return np.nanmax(data)
+
+
+class MinimumReduction(Reduction):
+    name = "min"
+
+    def Reduce(self, dataElement, timeStep):
+        return np.nanmin(self._GetData(dataElement, timeStep))
+
+
+class MeanReduction(Reduction):
+    name = "mean"
+
+    def Reduce(self, dataElement, timeStep):
+        return np.nanmean(self._GetData(dataElement, timeStep))
+
+
+class PercentileReduction(Reduction):
+    def __init__(self, percentile):
+        self.percentile = percentile
+        self.name = "percentile " + str(percentile)
+
+    def Reduce(self, dataElement, timeStep):
+        return np.nanpercentile(self._GetData(dataElement, timeStep), self.percentile)
+
+
+class WeightedMomentReduction(Reduction):
+    """Weighted mean ("mean") or weighted standard deviation ("rms") of a raw data set, with the weights
+    given by another raw data set of the same species (e.g. the charge)."""
+    def __init__(self, weightDataSet, moment = "mean"):
+        if moment not in ["mean", "rms"]:
+            raise ValueError("Unknown moment: " + str(moment))
+        self.weightDataSet = weightDataSet
+        self.moment = moment
+        self.name = "weighted " + moment + " (" + weightDataSet.GetName() + ")"
+
+    def Reduce(self, dataElement, timeStep):
+        data = self._GetData(dataElement, timeStep)
+        weights = np.abs(self._GetData(self.weightDataSet, timeStep))
+        if np.sum(weights) == 0:
+            return np.nan
+        mean = np.average(data, weights=weights)
+        if self.moment == "mean":
+            return mean
+        return np.sqrt(np.average(np.square(data-mean), weights=weights))
+
+
+class EvolutionSeries(object):
+    """Evolution of a reduction (e.g. the maximum or the weighted mean) of a data element along all its time steps.
+
+    The time steps are reduced in parallel, and the results of the elements read from the simulation folder
+    are stored in a cache file in that folder, together with the modification time of the source file of each
+    time step. When new time steps appear or files are rewritten, only those time steps are reduced.
+
+    Keyword arguments:
+    dataContainer -- the DataContainer with the simulation data.
+    numberOfThreads -- number of time steps reduced at the same time.
+    """
+    cacheFileName = ".visualpic_evolution.h5"
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, dataContainer, numberOfThreads = 4):
+        self._dataContainer = dataContainer
+        self._numberOfThreads = numberOfThreads
+        self._lock = threading.Lock()
+
+    def SetNumberOfThreads(self, numberOfThreads):
+        self._numberOfThreads = max(1, int(numberOfThreads))
+
+    def GetSeries(self, dataElement, reduction):
+        """Returns an EvolutionData element with the reduced value in each time step (in original units)."""
+        timeSteps = np.asarray(dataElement.GetTimeSteps())
+        values = np.full(len(timeSteps), np.nan)
+        useCache = isinstance(dataElement, FolderDataElement)
+        isMissing = np.ones(len(timeSteps), dtype=bool)
+        if useCache:
+            modificationTimes = self._GetModificationTimes(dataElement, timeSteps)
+            cachedTimeSteps, cachedValues, cachedModificationTimes = self._ReadFromCache(dataElement, reduction)
+            positions = np.clip(np.searchsorted(cachedTimeSteps, timeSteps), 0, max(len(cachedTimeSteps)-1, 0))
+            if len(cachedTimeSteps) > 0:
+                isMissing = (cachedTimeSteps[positions] != timeSteps) | (cachedModificationTimes[positions] != modificationTimes)
+                values[~isMissing] = cachedValues[positions[~isMissing]]
+        missingTimeSteps = timeSteps[isMissing]
+        if len(missingTimeSteps) > 0:
+            isKnown = ~isMissing
+            values[isMissing], isKnown[isMissing] = self._ReduceTimeSteps(dataElement, reduction, missingTimeSteps)
+            if useCache:
+                # time steps which failed to be read are not stored, so that they are tried again
+                isValid = isKnown & (modificationTimes != -1)
+                self._WriteToCache(dataElement, reduction, timeSteps[isValid], values[isValid], modificationTimes[isValid])
+        timeValues = dataElement.GetTimeTableInOriginalUnits()
+        return EvolutionData(dataElement.GetName(), values, dataElement.GetDataOriginalUnits(), dataElement.hasNonISUnits,
+                             timeValues, dataElement.GetTimeOriginalUnits(), timeSteps, dataElement.GetSpeciesName())
+
+    def GetSeriesDataToPlot(self, dataElement, reduction):
+        """Returns the series as data for a RawDataEvolutionSubplot (a single line of the value vs time)."""
+        series = self.GetSeries(dataElement, reduction)
+        time = EvolutionData("Time", series.GetAllTimeInOriginalUnits(), series.GetTimeOriginalUnits(), dataElement.hasNonISUnits,
+                             series.GetAllTimeInOriginalUnits(), series.GetTimeOriginalUnits(), series.GetTimeSteps())
+        seriesData = {}
+        seriesData["plotStyle"] = 'C0'
+        seriesData["x"] = RawDataEvolutionToPlot(time)
+        seriesData["y"] = RawDataEvolutionToPlot(series)
+        return [seriesData]
+
+    def ClearCache(self, dataElement = None, reduction = None):
+        """Removes the cached results of the given element and reduction (or of all of them)."""
+        with self._lock:
+            try:
+                with H5File(self._GetCacheFilePath(), "a") as cacheFile:
+                    if dataElement is None:
+                        for key in list(cacheFile.keys()):
+                            del cacheFile[key]
+                    else:
+                        key = self._GetCacheKey(dataElement, reduction)
+                        if key in cacheFile:
+                            del cacheFile[key]
+            except OSError:
+                pass
+
+    def _ReduceTimeSteps(self, dataElement, reduction, timeSteps):
+        """Returns the reduced values (NaN where the time step failed) and a boolean array telling which
+        time steps were reduced."""
+        def Reduce(timeStep):
+            try:
+                return reduction.Reduce(dataElement, timeStep), True
+            except (OSError, KeyError, ValueError):
+                # unreadable or empty time step
+                self._logger.warning("Reducing time step %s of %s failed", timeStep, dataElement.GetName(), exc_info=True)
+                return np.nan, False
+        if self._numberOfThreads > 1 and len(timeSteps) > 1:
+            with ThreadPoolExecutor(self._numberOfThreads) as executor:
+                results = list(executor.map(Reduce, timeSteps))
+        else:
+            results = [Reduce(timeStep) for timeStep in timeSteps]
+        values = np.array([value for value, wasReduced in results], dtype=float)
+        wasReduced = np.array([wasReduced for value, wasReduced in results], dtype=bool)
+        return values, wasReduced
+
+    def _GetModificationTimes(self, dataElement, timeSteps):
+        modificationTimes = np.full(len(timeSteps), -1, dtype=np.int64)
+        for i, timeStep in enumerate(timeSteps):
+            try:
+                modificationTimes[i] = dataElement.GetFileModificationTime(timeStep)
+            except (OSError, IndexError):
+                pass # missing file: its time step is never taken from the cache
+        return modificationTimes
+
+    def _GetCacheFilePath(self):
+        return os.path.join(self._dataContainer.GetDataFolderLocation(), self.cacheFileName)
+
+    def _GetCacheKey(self, dataElement, reduction):
+        key = "|".join([dataElement.__class__.__name__, dataElement.GetSpeciesName(), dataElement.GetName(), reduction.name])
+        return key.replace("/", ":")
+
+    def _ReadFromCache(self, dataElement, reduction):
+        with self._lock:
+            try:
+                with H5File(self._GetCacheFilePath(), "r") as cacheFile:
+                    group = cacheFile[self._GetCacheKey(dataElement, reduction)]
+                    return group["TimeSteps"][()], group["Values"][()], group["ModificationTimes"][()]
+            except (OSError, KeyError):
+                return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+    def _WriteToCache(self, dataElement, reduction, timeSteps, values, modificationTimes):
+        with self._lock:
+            try:
+                with H5File(self._GetCacheFilePath(), "a") as cacheFile:
+                    key = self._GetCacheKey(dataElement, reduction)
+                    if key in cacheFile:
+                        del cacheFile[key]
+                    group = cacheFile.create_group(key)
+                    group.create_dataset("TimeSteps", data = np.asarray(timeSteps, dtype=np.int64))
+                    group.create_dataset("Values", data = values)
+                    group.create_dataset("ModificationTimes", data = modificationTimes)
+                    group.attrs["Units"] = dataElement.GetDataOriginalUnits()
+            except OSError:
+                pass # e.g. read-only simulation folder
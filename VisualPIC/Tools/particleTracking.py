@@ -18,76 +18,267 @@
 #along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import logging
+import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
 from h5py import File as H5File
 
 from VisualPIC.DataPlotting.rawDataEvolutionToPlot import RawDataEvolutionToPlot
+from VisualPIC.DataHandling.dataElement import DataElement
 from VisualPIC.DataHandling.selfContainedDataElements import SelfContainedRawDataSet, EvolutionData
+from VisualPIC.DataHandling.customDataElements import CustomDataElement
+from VisualPIC.DataReading.dataReader import DataReader
+from VisualPIC.DataReading.dataCache import DataCache
+
+
+"""
+Tracking work on a group of time steps. These functions are used both in the main process and,
+when tracking with several processes, in the worker processes (each one with a shard of the time steps).
+"""
+def _FindIndicesOfTags(species, timeSteps, tags, stopWhenParticlesLeave = False):
+    """Returns a (tags x time steps) array with the position of each tag in each time step (-1 if not present)
+    and a boolean array telling which time steps could be read."""
+    particleIndices = -np.ones([len(tags), len(timeSteps)], dtype=int)
+    wasRead = np.zeros(len(timeSteps), dtype=bool)
+    particlesFound = False
+    for i in np.arange(len(timeSteps)):
+        try:
+            tagIndex = species.GetRawDataTagIndex(timeSteps[i])
+        except:
+            continue
+        wasRead[i] = True
+        particleIndices[:,i] = tagIndex.GetIndicesOfTags(tags)
+        anyParticleInFile = np.any(particleIndices[:,i] != -1)
+        if stopWhenParticlesLeave and particlesFound and not anyParticleInFile:
+            break # break loop if all the particles have already dissapeared from the files (simulation domain)
+        particlesFound = particlesFound or anyParticleInFile
+    return particleIndices, wasRead
+
+def _RemoveIndicesAfterParticlesLeave(particleIndices, wasRead):
+    """Once all the particles have left the simulation domain, later time steps are ignored."""
+    isAnyParticleInFile = np.any(particleIndices != -1, axis=0)
+    firstStepWithParticles = np.argmax(isAnyParticleInFile)
+    stepsWithoutParticles = np.flatnonzero(wasRead & ~isAnyParticleInFile)
+    stepsWithoutParticles = stepsWithoutParticles[stepsWithoutParticles > firstStepWithParticles]
+    if np.any(isAnyParticleInFile) and len(stepsWithoutParticles) > 0:
+        particleIndices[:,stepsWithoutParticles[0]:] = -1
+
+def _GatherValuesOfParticles(dataSets, timeSteps, particleIndices):
+    """Returns a dictionary with a (particles x time steps) array with the values of each data set (NaN where
+    the particle is not present) and an array with the time of each time step. Each time step is read only once."""
+    isInFile = particleIndices != -1
+    evolutionValues = {}
+    for dataSet in dataSets:
+        evolutionValues[dataSet.GetName()] = np.full(particleIndices.shape, np.nan)
+    timeValues = np.full(len(timeSteps), np.nan)
+    # which time steps are available in each data set, found at once with a sorted search
+    isAvailable = {}
+    for dataSet in dataSets:
+        isAvailable[dataSet.GetName()] = _IsInSortedArray(timeSteps, dataSet.GetTimeSteps())
+    for i in np.where(np.any(isInFile, axis=0))[0]:
+        timeStep = timeSteps[i]
+        particlesInFile = isInFile[:,i]
+        indices = particleIndices[particlesInFile, i]
+        timeValues[i] = dataSets[0].GetTimeInOriginalUnits(timeStep)
+        for dataSet in dataSets:
+            if isAvailable[dataSet.GetName()][i]:
+                data = dataSet.GetDataInOriginalUnits(timeStep)
+                evolutionValues[dataSet.GetName()][particlesInFile, i] = data[indices]
+    return evolutionValues, timeValues
 
+def _IsInSortedArray(values, sortedArray):
+    """Returns a boolean array telling which of the 'values' are in 'sortedArray'."""
+    sortedArray = np.asarray(sortedArray)
+    if len(sortedArray) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(sortedArray, values), len(sortedArray)-1)
+    return sortedArray[positions] == values
 
-class Particle():
-    def __init__(self, tag):
-        self.tag = tag
-        self._timeStepQuantities = {}
-        self._wholeSimulationQuantities = {}
-        self._particleIndices = None
-        self._trackedTimeSteps = []
+_trackedSpecies = None # species being tracked, in the worker processes
+_workerCacheBytes = 64*1024**2 # budget of the data and result caches of each worker process
+
+def _InitializeTrackingProcess(species, unitConverter):
+    global _trackedSpecies
+    _trackedSpecies = species
+    DataElement.SetUnitConverter(unitConverter)
+    # Each worker reads every time step only once, so the default (GB) caches would only multiply
+    # the peak memory by the number of processes.
+    DataReader.SetDataCache(DataCache(_workerCacheBytes))
+    CustomDataElement.SetResultCache(DataCache(_workerCacheBytes))
+
+def _CheckTrackingProcess():
+    return True
+
+def _FindIndicesOfTagsInProcess(timeSteps, tags):
+    return _FindIndicesOfTags(_trackedSpecies, timeSteps, tags)
+
+def _GatherValuesOfParticlesInProcess(timeSteps, particleIndices):
+    return _GatherValuesOfParticles(_trackedSpecies.GetAllRawDataSets(), timeSteps, particleIndices)
+
+
+class TrackedParticleSet(object):
+    """Contains the data of a population of particles as arrays (structure of arrays).
+
+    The position of the particles in the data files and the evolution of their quantities are stored
+    in (particles x time steps) arrays. Where a particle is not present, its index is -1 and its values are NaN.
+    """
+    def __init__(self, tags):
+        self.tags = np.asarray(tags)
+        self.timeSteps = np.array([], dtype=int)
+        self.particleIndices = -np.ones([len(self.tags), 0], dtype=int)
+        self._timeStepQuantities = {} # name -> 1D array with the value of each particle in the selection time step
+        self._wholeSimulationQuantities = {} # name -> {"values", "units", "hasNonISUnits"}
+
+    def __len__(self):
+        return len(self.tags)
 
-    def AddTimeStepQuantity(self, quantityName, quantityValue):
-        self._timeStepQuantities[quantityName] = quantityValue
+    def GetNumberOfParticles(self):
+        return len(self.tags)
+
+    def AddTimeStepQuantity(self, quantityName, quantityValues):
+        self._timeStepQuantities[quantityName] = np.asarray(quantityValues)
+
+    def GetNamesOfTimeStepQuantities(self):
+        return list(self._timeStepQuantities.keys())
+
+    def GetTimeStepQuantity(self, quantityName):
+        return self._timeStepQuantities[quantityName]
+
+    def SetParticleIndices(self, timeSteps, particleIndices):
+        self.timeSteps = np.asarray(timeSteps)
+        self.particleIndices = particleIndices
+
+    def GetParticleIndices(self):
+        return self.particleIndices
+
+    def GetPresenceMask(self):
+        """Returns a boolean (particles x time steps) array which is True where the particle is present."""
+        return self.particleIndices != -1
+
+    def SetTimeInfo(self, timeValues, timeUnits, hasNonISUnits):
+        """timeValues is a 1D array with the time of each time step."""
+        self._wholeSimulationQuantities = {"Time":{"values":np.asarray(timeValues), "units":timeUnits, "hasNonISUnits":hasNonISUnits}}
 
     def AddWholeSimulationQuantity(self, dataSet, quantityValues):
-        #self._wholeSimulationQuantities[quantityName] = {"values":quantityValues, "units":quantityUnits}
-        quantityName = dataSet.GetName()
-        quantityUnits = dataSet.GetDataOriginalUnits()
-        timeValues = self._wholeSimulationQuantities["Time"].GetAllDataInOriginalUnits()
-        timeUnits = dataSet.GetTimeOriginalUnits()
-        self._wholeSimulationQuantities[quantityName] = EvolutionData(quantityName, quantityValues, quantityUnits, dataSet.hasNonISUnits, timeValues, timeUnits, self._trackedTimeSteps)
+        """quantityValues is a (particles x time steps) array."""
+        self._wholeSimulationQuantities[dataSet.GetName()] = {"values":quantityValues, "units":dataSet.GetDataOriginalUnits(), "hasNonISUnits":dataSet.hasNonISUnits}
+
+    def GetNamesOfWholeSimulationQuantities(self):
+        return list(self._wholeSimulationQuantities.keys())
+
+    def GetWholeSimulationQuantityValues(self, quantityName):
+        """Returns the (particles x time steps) array of the quantity, with NaN where the particles are not present."""
+        values = self._wholeSimulationQuantities[quantityName]["values"]
+        if quantityName == "Time":
+            values = np.where(self.GetPresenceMask(), values, np.nan)
+        return values
+
+    def GetWholeSimulationQuantityUnits(self, quantityName):
+        return self._wholeSimulationQuantities[quantityName]["units"]
+
+    def WholeSimulationQuantityHasNonISUnits(self, quantityName):
+        return self._wholeSimulationQuantities[quantityName]["hasNonISUnits"]
+
+    def GetTimeValues(self):
+        """Returns a 1D array with the time of each time step."""
+        return self._wholeSimulationQuantities["Time"]["values"]
+
+    def GetWholeSimulationQuantityElement(self, quantityName):
+        """Returns an EvolutionData element with the (particles x time steps) values of the quantity."""
+        quantity = self._wholeSimulationQuantities[quantityName]
+        timeQuantity = self._wholeSimulationQuantities["Time"]
+        return EvolutionData(quantityName, quantity["values"], quantity["units"], quantity["hasNonISUnits"], timeQuantity["values"], timeQuantity["units"], self.timeSteps)
+
+    def WriteDataToFile(self, filePath, compression = None):
+        """Writes all the particles to a single HDF5 file, in IS units. Each quantity is stored as a
+        (particles x time steps) dataset with NaN where the particle is not present, except the time,
+        which is a single value per time step.
+
+        Keyword arguments:
+        compression -- compression filter of the datasets (e.g. "gzip" or "lzf"). None for no compression.
+        """
+        h5file = H5File(filePath, "w")
+        h5file.create_dataset("Tags", data = self.tags)
+        h5file.create_dataset("TimeSteps", data = self.timeSteps)
+        for quantityName in self.GetNamesOfWholeSimulationQuantities():
+            quantity = self.GetWholeSimulationQuantityElement(quantityName)
+            values = quantity.GetAllDataInISUnits()
+            if values.size > 0:
+                dataSet = h5file.create_dataset(quantityName, data = values, chunks = True, compression = compression)
+            else:
+                dataSet = h5file.create_dataset(quantityName, data = values)
+            dataSet.attrs["Units"] = quantity.GetDataISUnits()
+        h5file.close()
+
+    def GetTimeStepsWithParticles(self):
+        return self.timeSteps[np.any(self.GetPresenceMask(), axis=0)]
+
+    def GetParticle(self, index):
+        return Particle(self, index)
+
+    def GetSubset(self, indices):
+        """Returns a new set with only the particles in the given positions."""
+        subset = TrackedParticleSet(self.tags[indices])
+        for quantityName, values in self._timeStepQuantities.items():
+            subset.AddTimeStepQuantity(quantityName, values[indices])
+        subset.SetParticleIndices(self.timeSteps, self.particleIndices[indices])
+        for quantityName, quantity in self._wholeSimulationQuantities.items():
+            subsetQuantity = dict(quantity)
+            if quantityName != "Time":
+                subsetQuantity["values"] = quantity["values"][indices]
+            subset._wholeSimulationQuantities[quantityName] = subsetQuantity
+        return subset
+
+    def GetEvolutionData(self, quantityName, index):
+        """Returns an EvolutionData element with the quantity of a single particle in the time steps in which it is present."""
+        isPresent = self.particleIndices[index] != -1
+        timeQuantity = self._wholeSimulationQuantities["Time"]
+        timeValues = timeQuantity["values"][isPresent]
+        quantity = self._wholeSimulationQuantities[quantityName]
+        if quantityName == "Time":
+            quantityValues = timeValues
+        else:
+            quantityValues = quantity["values"][index][isPresent]
+        return EvolutionData(quantityName, quantityValues, quantity["units"], quantity["hasNonISUnits"], timeValues, timeQuantity["units"], self.timeSteps[isPresent])
 
-    def AddTimeInfo(self, timeValues, timeUnits, hasNonISUnits):
-        self._wholeSimulationQuantities["Time"] = EvolutionData("Time", timeValues, timeUnits, hasNonISUnits, timeValues, timeUnits, self._trackedTimeSteps)
+
+class Particle():
+    """Lightweight view of a single particle in a TrackedParticleSet."""
+    def __init__(self, particleSet, index):
+        self._particleSet = particleSet
+        self._index = index
+        self.tag = particleSet.tags[index]
 
     def GetNamesOfWholeSimulationQuantities(self):
-        quantitiesList = list()
-        for key in self._wholeSimulationQuantities:
-            quantitiesList.append(key)
-        return quantitiesList
+        return self._particleSet.GetNamesOfWholeSimulationQuantities()
 
     def GetNamesOfTimeStepQuantities(self):
-        quantitiesList = list()
-        for key in self._timeStepQuantities:
-            quantitiesList.append(key)
-        return quantitiesList
+        return self._particleSet.GetNamesOfTimeStepQuantities()
 
     def GetCurrentTimeStepQuantities(self):
-        return self._timeStepQuantities
-
-    def GetWholeSimulationQuantity(self, quantityName):
-        return self._wholeSimulationQuantities[quantityName]
-
-    def GetDataAtTimeStep(self, timeStep):
         timeStepQuantities = {}
-        for key in self._timeStepQuantities:
-            timeStepQuantities[key] = self._wholeSimulationQuantities[key][timeStep]
+        for quantityName in self._particleSet.GetNamesOfTimeStepQuantities():
+            timeStepQuantities[quantityName] = self._particleSet.GetTimeStepQuantity(quantityName)[self._index]
         return timeStepQuantities
 
-    def SetTrackedTimeSteps(self, timeSteps):
-        self._trackedTimeSteps = timeSteps
+    def GetWholeSimulationQuantity(self, quantityName):
+        return self._particleSet.GetEvolutionData(quantityName, self._index)
 
     def GetTrackedTimeSteps(self):
-        return self._trackedTimeSteps
-
-    def SetIndices(self, indices):
-        self._particleIndices = indices
+        return self._particleSet.timeSteps[self._particleSet.particleIndices[self._index] != -1]
 
     def GetIndex(self, timeStep):
-        return self._particleIndices[np.where(self._trackedTimeSteps == timeStep)[0][0]]
+        return self._particleSet.particleIndices[self._index][np.where(self._particleSet.timeSteps == timeStep)[0][0]]
 
     def WriteDataToFile(self, location, fileName):
         h5file = H5File(location + "/" + fileName + ".h5", "w")
-        for key in self._wholeSimulationQuantities:
-            dataSet = h5file.create_dataset(key, data = self._wholeSimulationQuantities[key].GetAllDataInISUnits())
-            dataSet.attrs["Units"] = self._wholeSimulationQuantities[key].GetDataISUnits()
+        for key in self.GetNamesOfWholeSimulationQuantities():
+            quantity = self.GetWholeSimulationQuantity(key)
+            dataSet = h5file.create_dataset(key, data = quantity.GetAllDataInISUnits())
+            dataSet.attrs["Units"] = quantity.GetDataISUnits()
         h5file.close()
 
 
@@ -96,19 +287,17 @@ class ParticleTracker():
         self._dataContainer = dataContainer
         self._speciesList = self._dataContainer.GetSpeciesWithTrackingData()
         self._speciesToAnalyze = None
-        self._particleList = list()
+        self._particleSet = TrackedParticleSet([])
         self._instantRawDataSetsList = list()
-        self.timeInfoAdded = False
-        self.indexInfoAdded = False
+        self._chunkSize = 2**20 # number of particles read at once when selecting particles
+        self._numberOfProcesses = 1 # processes used for tracking the particles through the time steps
         """
         Explanation:
-            To save computational time and not having to look where the particle is in the file for 
-        every quantity, a list of indices will be created when the first "WholeSimulationQuantity" 
-        is loaded. Therefore, for loading the following quantities, the code will already know where
-        the particle is without calling the expensive method "GetParticleIndexFromTag".
-            Also, the time will be added as a "WholeSimulationQuantity" when loading the first 
-        quantity. In order not to repeat this for every quantity, the boolean variable 
-        self.indexInfoAdded is introduced.
+            To save computational time and not having to look where the particle is in the file for
+        every quantity, the position of each tracked particle in every time step is stored in the
+        (particles x time steps) index matrix of the TrackedParticleSet (-1 where the particle is not
+        present). It is filled once by "_FindIndicesOfParticles" and then used to gather the values
+        of all quantities for all the particles at once.
         """
 
     def GetDataLocation(self):
@@ -139,6 +328,15 @@ class ParticleTracker():
             if dataSet.GetName() == dataSetName:
                 return dataSet
 
+    def SetNumberOfProcesses(self, numberOfProcesses):
+        """Number of processes used to track the particles. The time steps are split in shards which are
+        processed in parallel. With 1 process (default), all the work is done in the current process."""
+        self._numberOfProcesses = max(1, int(numberOfProcesses))
+
+    def SetSelectionChunkSize(self, chunkSize):
+        """Number of particles read at once when selecting particles from the data files."""
+        self._chunkSize = max(1, int(chunkSize))
+
     def FindParticles(self, timeStep, speciesName, filters):
         """filters is a dictionary where the keys are the names of the variables 
         to filter (eg /q, /x1, etc.) and the values are a tuple with two numbers
@@ -146,170 +344,166 @@ class ParticleTracker():
         for species in self._speciesList:
             if species.GetName() == speciesName:
                 self._speciesToAnalyze = species
-        indicesList = list()
-        for rawDataSetName, range in filters.items():
-            indicesList.append(self._GetIndicesOfParticlesInRange(timeStep, self._speciesToAnalyze, rawDataSetName, range))
-        indicesOfFoundParticles = self._GetCommonElementsInListOfArrays(indicesList)
+        indicesOfFoundParticles = self._GetIndicesOfParticlesInRanges(timeStep, self._speciesToAnalyze, filters)
         particles = self._GetParticlesFromIndices(timeStep, self._speciesToAnalyze, indicesOfFoundParticles)
         return particles
     
-    def _GetIndicesOfParticlesInRange(self, timeStep, species, rawDataSetName, range):
-        dataSet = species.GetRawDataSet(rawDataSetName)
-        data = dataSet.GetDataInOriginalUnits(timeStep)
-        iLowRange = np.where(data > range[0])
-        iHighRange = np.where(data < range[1])
-        iRange = np.intersect1d(iLowRange, iHighRange)
-        return iRange
-
-    def _GetCommonElementsInListOfArrays(self, listOfArrays):
-        n = len(listOfArrays)
-        commonEls = listOfArrays[0]
-        for i in np.arange(1,n):
-            commonEls = np.intersect1d(listOfArrays[i], commonEls)
-        return commonEls
+    def _GetIndicesOfParticlesInRanges(self, timeStep, species, filters):
+        """Returns the (sorted) indices of the particles inside all the ranges. The data sets are read
+        chunk by chunk and all the ranges are combined in a single mask, so that the memory needed does
+        not depend on the number of particles or filters."""
+        dataSetNames = list(filters.keys())
+        chunkReaders = [species.GetRawDataSet(name).GetDataChunksInOriginalUnits(timeStep, self._chunkSize) for name in dataSetNames]
+        indices = list()
+        for chunks in zip(*chunkReaders):
+            start = chunks[0][0]
+            mask = np.ones(len(chunks[0][1]), dtype=bool)
+            inRange = np.empty(len(chunks[0][1]), dtype=bool)
+            for (chunkStart, chunkData), dataSetName in zip(chunks, dataSetNames):
+                lowLimit, highLimit = filters[dataSetName]
+                np.greater(chunkData, lowLimit, out=inRange)
+                mask &= inRange
+                np.less(chunkData, highLimit, out=inRange)
+                mask &= inRange
+            indices.append(start + np.flatnonzero(mask))
+        if len(indices) == 0:
+            return np.array([], dtype=int)
+        return np.concatenate(indices)
+
+    def _GetValuesAtIndices(self, chunks, indices):
+        """Returns the elements in the (sorted) 'indices' positions of the data given in chunks."""
+        values = list()
+        for start, chunkData in chunks:
+            first, last = np.searchsorted(indices, [start, start+len(chunkData)])
+            values.append(chunkData[indices[first:last]-start])
+            if last == len(indices):
+                break
+        if len(values) == 0:
+            return np.array([])
+        return np.concatenate(values)
 
     def _GetParticlesFromIndices(self, timeStep, species, indices):
         rawDataSets = species.GetAllRawDataSets()
-        particleTags = species.GetRawDataTags(timeStep)
-        dataSetValues = {}
+        particleTags = self._GetValuesAtIndices(species.GetRawDataTagChunks(timeStep, self._chunkSize), indices)
+        particleSet = TrackedParticleSet(particleTags)
         for dataSet in rawDataSets:
-            dataSetValues[dataSet.GetName()] = dataSet.GetDataInOriginalUnits(timeStep) # particle data in selected time step
-        particlesList = list()
-        for index in indices:
-            particle = Particle(particleTags[index]) # create particle instance with corresponding tag
-            for dataSetName, values in dataSetValues.items():
-                particle.AddTimeStepQuantity(dataSetName, values[index])
-            particlesList.append(particle)
-        return particlesList
-
-    def SetParticlesToTrack(self, particleList):
-        self._particleList = particleList
+            # particle data in selected time step
+            dataSetChunks = dataSet.GetDataChunksInOriginalUnits(timeStep, self._chunkSize)
+            particleSet.AddTimeStepQuantity(dataSet.GetName(), self._GetValuesAtIndices(dataSetChunks, indices))
+        return particleSet
+
+    def SetParticlesToTrack(self, particleSet):
+        self._particleSet = particleSet
 
     def FillEvolutionOfAllDataSetsInParticles(self):
-        self.timeInfoAdded = False
         rawDataSets = self._speciesToAnalyze.GetAllRawDataSets()
-        self._FindIndicesOfParticles()
+        # The time of all the time steps is needed, so the whole table is built at once (before
+        # sending the data sets to the worker processes).
+        rawDataSets[0].GetTimeTableInOriginalUnits()
+        processPool = None
+        if self._numberOfProcesses > 1:
+            processPool = self._StartProcessPool()
+        if processPool is not None:
+            with processPool:
+                self._FindIndicesOfParticles(processPool)
+                evolutionValues, timeValues = self._GetEvolutionOfDataSets(rawDataSets, processPool)
+        else:
+            self._FindIndicesOfParticles()
+            evolutionValues, timeValues = self._GetEvolutionOfDataSets(rawDataSets)
+        self._particleSet.SetTimeInfo(timeValues, rawDataSets[0].GetTimeOriginalUnits(), rawDataSets[0].hasNonISUnits)
         for dataSet in rawDataSets:
-            self._FillEvolutionOfDataSetInParticles(dataSet)
-
-    def _FindIndicesOfParticles(self):
+            self._particleSet.AddWholeSimulationQuantity(dataSet, evolutionValues[dataSet.GetName()])
+
+    def _StartProcessPool(self):
+        """Returns a pool of worker processes ready to track, or None if it could not be started
+        (e.g. the data elements of the species could not be sent to the worker processes)."""
+        processPool = None
+        try:
+            processPool = self._CreateProcessPool()
+            processPool.submit(_CheckTrackingProcess).result()
+        except (pickle.PicklingError, TypeError, AttributeError, OSError, BrokenProcessPool):
+            logging.getLogger(__name__).warning("The tracking processes could not be started, tracking in a single process", exc_info=True)
+            if processPool is not None:
+                processPool.shutdown(wait = False)
+            return None
+        return processPool
+
+    def _CreateProcessPool(self):
+        # The workers are started with "spawn" instead of forking this process, since forked processes would
+        # inherit the open HDF5 files (HDF5 is not fork-safe) and locks held by other threads (e.g. prefetching).
+        return ProcessPoolExecutor(max_workers = self._numberOfProcesses, mp_context = multiprocessing.get_context("spawn"),
+                                   initializer = _InitializeTrackingProcess, initargs = (self._speciesToAnalyze, self._dataContainer.unitConverter))
+
+    def _GetTimeStepShards(self, timeStepsToProcess):
+        """Splits the positions of the time steps to process into groups for the worker processes."""
+        numberOfShards = min(len(timeStepsToProcess), 4*self._numberOfProcesses)
+        return [shard for shard in np.array_split(timeStepsToProcess, max(numberOfShards, 1)) if len(shard) > 0]
+
+    def _FindIndicesOfParticles(self, processPool = None):
         timeSteps = self._speciesToAnalyze.GetRawDataTimeSteps()
-        trackedParticleTags = self._GetTrackedParticleTags()
-        totalTimeSteps = len(timeSteps)
-        numberOfParticles = len(self._particleList)
-        trackedTimeSteps = -np.ones([numberOfParticles, totalTimeSteps], dtype=int)
-        particleIndices = -np.ones([numberOfParticles, totalTimeSteps], dtype=int)
-        particlesFound = False
-        i = 0
-        for timeStep in timeSteps:
-            print(timeStep)
-            try:
-                allParticleTagsInFile = self._speciesToAnalyze.GetRawDataTags(timeStep)
-                j = 0
-                count = 0
-                for tag in allParticleTagsInFile:
-                    if tag in trackedParticleTags:
-                        particlesFound = True
-                        pIndex = np.where(trackedParticleTags == tag)[0][0]
-                        particleIndices[pIndex, i] = j
-                        trackedTimeSteps[pIndex, i] = timeStep
-                        count += 1
-                        if count == numberOfParticles:
-                            break
-                    j += 1
-            except:
-                pass
-            finally:
-                if particlesFound and count == 0:
-                    break # break loop if all the particles have already dissapeared from the files (simulation domain)
-                i+=1
-        k = 0
-        for particle in self._particleList:
-            unfilteredIndices = particleIndices[k]
-            filteredIndices = np.delete(unfilteredIndices, np.where(unfilteredIndices == -1))
-            unfilteredTimeSteps = trackedTimeSteps[k]
-            filteredTimeSteps = np.delete(unfilteredTimeSteps, np.where(unfilteredTimeSteps == -1))
-            particle.SetIndices(filteredIndices)
-            particle.SetTrackedTimeSteps(filteredTimeSteps)
-            k += 1
-        
-    def _GetTrackedParticleTags(self):
-        tags = list()
-        for particle in self._particleList:
-            tags.append(particle.tag)
-        return tags
-                
-    def _FillEvolutionOfDataSetInParticles(self, dataSet):
-        timeStepsWithParticleData = np.array([])
-        quantityValues = list() # one 1D array for each particle
-        timeValues = list()
-        counter = list()
-        for particle in self._particleList:
-            timeStepsWithParticleData = np.unique(np.concatenate((timeStepsWithParticleData,particle.GetTrackedTimeSteps()),0))
-            quantityValues.append(np.zeros(len(particle.GetTrackedTimeSteps())))
-            if not self.timeInfoAdded:
-                timeValues.append(np.zeros(len(particle.GetTrackedTimeSteps())))
-            counter.append(0)
-        allSimulatedTimeSteps = dataSet.GetTimeSteps()
-        for timeStep in allSimulatedTimeSteps:
-            if timeStep <= max(timeStepsWithParticleData) and (timeStep in timeStepsWithParticleData):
-                print(timeStep)
-                data = dataSet.GetDataInOriginalUnits(timeStep)
-                p = 0
-                for particle in self._particleList:
-                    if timeStep in particle.GetTrackedTimeSteps():
-                        step = counter[p]
-                        quantityValues[p][step] = data[particle.GetIndex(timeStep)]
-                        if not self.timeInfoAdded:
-                            timeValues[p][step] = dataSet.GetTimeInOriginalUnits(timeStep)
-                        counter[p] += 1
-                    p += 1
-        for particle in self._particleList:
-            if not self.timeInfoAdded:
-                particle.AddTimeInfo(timeValues[self._particleList.index(particle)], dataSet.GetTimeOriginalUnits(), dataSet.hasNonISUnits)
-            particle.AddWholeSimulationQuantity(dataSet, quantityValues[self._particleList.index(particle)])
-        self.timeInfoAdded = True
+        trackedParticleTags = self._particleSet.tags
+        if processPool is None:
+            particleIndices, wasRead = _FindIndicesOfTags(self._speciesToAnalyze, timeSteps, trackedParticleTags, stopWhenParticlesLeave = True)
+        else:
+            particleIndices = -np.ones([len(trackedParticleTags), len(timeSteps)], dtype=int)
+            wasRead = np.zeros(len(timeSteps), dtype=bool)
+            shards = self._GetTimeStepShards(np.arange(len(timeSteps)))
+            results = processPool.map(_FindIndicesOfTagsInProcess, [timeSteps[shard] for shard in shards], [trackedParticleTags]*len(shards))
+            for shard, (shardIndices, shardWasRead) in zip(shards, results):
+                particleIndices[:,shard] = shardIndices
+                wasRead[shard] = shardWasRead
+            _RemoveIndicesAfterParticlesLeave(particleIndices, wasRead)
+        self._particleSet.SetParticleIndices(timeSteps, particleIndices)
+
+    def _GetEvolutionOfDataSets(self, dataSets, processPool = None):
+        timeSteps = self._particleSet.timeSteps
+        particleIndices = self._particleSet.GetParticleIndices()
+        if processPool is None:
+            return _GatherValuesOfParticles(dataSets, timeSteps, particleIndices)
+        evolutionValues = {}
+        for dataSet in dataSets:
+            evolutionValues[dataSet.GetName()] = np.full(particleIndices.shape, np.nan)
+        timeValues = np.full(len(timeSteps), np.nan)
+        stepsWithParticles = np.flatnonzero(np.any(particleIndices != -1, axis=0))
+        shards = self._GetTimeStepShards(stepsWithParticles)
+        results = processPool.map(_GatherValuesOfParticlesInProcess, [timeSteps[shard] for shard in shards], [particleIndices[:,shard] for shard in shards])
+        for shard, (shardValues, shardTimeValues) in zip(shards, results):
+            for dataSetName, values in shardValues.items():
+                evolutionValues[dataSetName][:,shard] = values
+            timeValues[shard] = shardTimeValues
+        return evolutionValues, timeValues
 
     def MakeInstantaneousRawDataSets(self):
         self._instantRawDataSetsList.clear()
-        trackedQuantities = self._particleList[0].GetNamesOfWholeSimulationQuantities()
-        timeStepsWithParticleData = np.array([])
-        for particle in self._particleList:
-            timeStepsWithParticleData = np.unique(np.concatenate((timeStepsWithParticleData,particle.GetTrackedTimeSteps()),0))
+        trackedQuantities = self._particleSet.GetNamesOfWholeSimulationQuantities()
+        stepsWithParticleData = np.any(self._particleSet.GetPresenceMask(), axis=0)
+        timeStepsWithParticleData = self._particleSet.timeSteps[stepsWithParticleData]
+        timeValues = self._particleSet.GetTimeValues()[stepsWithParticleData]
+        timeUnits = self._particleSet.GetWholeSimulationQuantityUnits("Time")
         for quantityName in trackedQuantities:
             if quantityName != "Time":
-                data = np.zeros([len(timeStepsWithParticleData),len(self._particleList)])
-                data.fill(np.nan)
-                timeValues = np.array([])
-                n = 0
-                for particle in self._particleList:
-                    quantity = particle.GetWholeSimulationQuantity(quantityName)
-                    particleTimeSteps = particle.GetTrackedTimeSteps()
-                    first = np.where(timeStepsWithParticleData == particleTimeSteps.min())[0][0]
-                    last = np.where(timeStepsWithParticleData == particleTimeSteps.max())[0][0]
-                    data[first:last+1,n] = quantity.GetAllDataInOriginalUnits()
-                    timeData = particle.GetWholeSimulationQuantity("Time")
-                    timeValues = np.unique(np.concatenate((timeValues,timeData.GetAllDataInOriginalUnits()),0))
-                    dataUnits = quantity.GetDataOriginalUnits()
-                    timeUnits = timeData.GetTimeOriginalUnits()
-                    n += 1 
-                self._instantRawDataSetsList.append(SelfContainedRawDataSet(quantityName, data, dataUnits, quantity.hasNonISUnits, timeValues, timeUnits, timeStepsWithParticleData, self._speciesToAnalyze.GetName()))
+                # rows are time steps and columns are particles
+                data = self._particleSet.GetWholeSimulationQuantityValues(quantityName)[:,stepsWithParticleData].T
+                dataUnits = self._particleSet.GetWholeSimulationQuantityUnits(quantityName)
+                hasNonISUnits = self._particleSet.WholeSimulationQuantityHasNonISUnits(quantityName)
+                self._instantRawDataSetsList.append(SelfContainedRawDataSet(quantityName, data, dataUnits, hasNonISUnits, timeValues, timeUnits, timeStepsWithParticleData, self._speciesToAnalyze.GetName()))
 
     def GetTrackedParticles(self):
-        return self._particleList
+        return self._particleSet
 
     def GetAvailableWholeSimulationQuantitiesInParticles(self):
-        return self._particleList[0].GetNamesOfWholeSimulationQuantities()
+        return self._particleSet.GetNamesOfWholeSimulationQuantities()
 
     def GetAvailableTimeStepQuantitiesInParticles(self):
-        return self._particleList[0].GetNamesOfTimeStepQuantities()
+        return self._particleSet.GetNamesOfTimeStepQuantities()
 
     def GetTotalNumberOfTrackedParticles(self):
-        return len(self._particleList)
+        return len(self._particleSet)
 
     def GetTrackedParticlesDataToPlot(self, xDataName, yDataName, zDataName = None):
         allParticlesData = list()
-        for particle in self._particleList:
+        for index in np.arange(len(self._particleSet)):
+            particle = self._particleSet.GetParticle(index)
             singleParticleData = {}
             singleParticleData["plotStyle"] = 'C0' # todo: find a better place for storing the plotStyles in all dataTypes (Field, Raw and RawEvolution)
             singleParticleData["particle"] = particle
@@ -323,7 +517,15 @@ class ParticleTracker():
     def GetTrackedSpeciesName(self):
         return self._speciesToAnalyze.GetName()
 
-    def ExportParticleData(self, particleIndices, location):
-        for index in particleIndices:
-            fileName = "particle" + str(index+1).zfill(3)
-            self._particleList[index].WriteDataToFile(location, fileName)
+    def ExportParticleData(self, particleIndices, location, singleFile = True, compression = None):
+        """Exports the data of the tracked particles in the positions given by 'particleIndices'.
+        By default, all of them are written to a single file. If 'singleFile' is False, one file
+        per particle is created instead."""
+        if singleFile:
+            particlesToExport = self._particleSet.GetSubset(np.asarray(particleIndices, dtype=int))
+            fileName = "trackedParticles-" + self.GetTrackedSpeciesName() + ".h5"
+            particlesToExport.WriteDataToFile(location + "/" + fileName, compression)
+        else:
+            for index in particleIndices:
+                fileName = "particle" + str(index+1).zfill(3)
+                self._particleSet.GetParticle(index).WriteDataToFile(location, fileName)
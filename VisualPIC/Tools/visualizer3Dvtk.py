@@ -18,11 +18,35 @@
 #along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import vtk
-from vtk.qt4.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+from vtk.util.numpy_support import vtk_to_numpy
+
+from VisualPIC.DataReading.dataCache import DataCache
+from VisualPIC.DataHandling.dataElement import DataElement
+from VisualPIC.Tools.volumePreparation import GetAbsoluteRange, QuantizeVolume, DownsampleVolume, VolumeBuffer
+
 
 class VolumeVTK():
+    # uint8 volumes, shared by all the volumes of the same fields. The entries of a custom field are
+    # removed when its data changes (see DataContainer.SetSimulationParameters).
+    _quantizedVolumes = DataCache(1024**3)
+    _numberOfThreads = 4
+
+    @classmethod
+    def SetNumberOfThreads(cls, numberOfThreads):
+        cls._numberOfThreads = max(1, int(numberOfThreads))
+
+    @classmethod
+    def SetQuantizedVolumesCacheSize(cls, maxBytes):
+        cls._quantizedVolumes.SetMaxBytes(maxBytes)
+
+    @classmethod
+    def GetQuantizedVolumesCache(cls):
+        return cls._quantizedVolumes
+
     def __init__(self, field3D):
         self.actorType = "Volume"
         self.name = field3D.GetName()
@@ -31,6 +55,7 @@ class VolumeVTK():
         self.opacity = vtk.vtkPiecewiseFunction()
         self.color = vtk.vtkColorTransferFunction()
         self.customCMapRange = False
+        self.levelOfDetailMethod = "mean" # how the coarse levels of detail are built ("mean" or "max")
         self._SetDefaultStyle()
 
     def _SetDefaultStyle(self):
@@ -78,11 +103,13 @@ class VolumeVTK():
             #self.SetOpacityValue(i, point[0], point[1])
 
     def SetCMapRangeFromCurrentTimeStep(self, timeStep):
-        fieldData = np.absolute(self.field.GetAllFieldDataInOriginalUnits(timeStep))
-        self.maxRange = np.amax(fieldData)
-        self.minRange = np.amin(fieldData)
+        fieldData = self.field.GetAllFieldDataInOriginalUnits(timeStep)
+        self.minRange, self.maxRange = GetAbsoluteRange(fieldData, numberOfThreads = self._numberOfThreads)
         self.customCMapRange = True
 
+    def SetLevelOfDetailMethod(self, method):
+        self.levelOfDetailMethod = method
+
     def SetCMapRange(self, min, max):
         self.maxRange = max
         self.minRange = min
@@ -97,23 +124,33 @@ class VolumeVTK():
             values.append([val[0], val[1]])
         return values
 
-    def GetData(self, timeStep, transvEl = None, longEl = None, fraction = 1):
+    def GetData(self, timeStep, transvEl = None, longEl = None, fraction = 1, level = 0):
+        """Returns the absolute value of the field quantized to uint8 in the colormap range. The quantized
+        volumes are cached, so the returned array must not be modified.
+
+        Each 'level' of detail halves the resolution of the previous one (level 0 is the full resolution).
+        """
+        cMapRange = (self.minRange, self.maxRange) if self.customCMapRange else None
+        if self.field.GetFieldDimension() == "3D":
+            key = (self.field, timeStep, cMapRange)
+        else:
+            key = (self.field, timeStep, cMapRange, transvEl, longEl, fraction)
+        if level == 0:
+            return self._quantizedVolumes.GetData(key, lambda: self._QuantizeData(timeStep, cMapRange, transvEl, longEl, fraction))
+        key += ("Level", level, self.levelOfDetailMethod)
+        return self._quantizedVolumes.GetData(key, lambda: DownsampleVolume(self.GetData(timeStep, transvEl, longEl, fraction, level-1), self.levelOfDetailMethod))
+
+    def _QuantizeData(self, timeStep, cMapRange, transvEl, longEl, fraction):
         if self.field.GetFieldDimension() == "3D":
-            fieldData = np.absolute(self.field.GetAllFieldDataInOriginalUnits(timeStep))
+            fieldData = self.field.GetAllFieldDataInOriginalUnits(timeStep)
         if self.field.GetFieldDimension() == "2D":
-            fieldData = np.absolute(self.field.Get3DFieldFrom2DSliceInOriginalUnits(timeStep, transvEl, longEl, fraction))
-        if self.customCMapRange:
-            maxvalue = self.maxRange
-            minvalue = self.minRange
+            fieldData = self.field.Get3DFieldFrom2DSliceInOriginalUnits(timeStep, transvEl, longEl, fraction)
+        if cMapRange is not None:
+            minvalue, maxvalue = cMapRange
         else:
-            maxvalue = np.amax(fieldData)
-            minvalue = np.amin(fieldData)
-        fieldData = np.round(255 * (fieldData-minvalue)/(maxvalue-minvalue))
-        fieldData[fieldData < 0] = 0
-        fieldData[fieldData > 255] = 255
-        # Change data from float to unsigned char
-        npdatauchar = np.array(fieldData, dtype=np.uint8)
-        return npdatauchar
+            minvalue, maxvalue = GetAbsoluteRange(fieldData, numberOfThreads = self._numberOfThreads)
+        npdatauchar = np.empty(np.shape(fieldData), dtype=np.uint8)
+        return QuantizeVolume(fieldData, minvalue, maxvalue, npdatauchar, numberOfThreads = self._numberOfThreads)
 
     def GetAxes(self, timeStep):
         axes = {}
@@ -141,13 +178,32 @@ class VolumeVTK():
             spacing["z"] = np.abs(axesz[-1]-axesz[0])/transvEl*fraction
         return spacing
 
+
+DataElement.RegisterDerivedDataCache(VolumeVTK.GetQuantizedVolumesCache())
+
+
 class Visualizer3Dvtk():
+    """3D volume renderer of the fields. It renders either into a Qt widget (GetVTKWidget) or, without Qt
+    nor a display, into an offscreen window (CreateOffscreenRenderWindow), e.g. to make animations in batch jobs:
+
+        visualizer = Visualizer3Dvtk(dataContainer)
+        visualizer.CreateOffscreenRenderWindow(1920, 1080)
+        visualizer.AddVolumeField("Ez", "")
+        visualizer.RenderAnimation(visualizer.GetTimeSteps(), framesDir, "movie")
+    """
     def __init__(self, dataContainer):
         self.dataContainer = dataContainer
         self._GetAvailable3DFields()
+        self.renderer = None
+        self.renderWindow = None
+        self.interactor = None
         self.volumeList = list()
         self.volume = None
-        self.volumeMapper = None
+        self.volumeProperty = None
+        self.numberOfLevelsOfDetail = 3 # full resolution and 2 coarser levels for interaction
+        self._levelsOfDetail = list() # import, mapper, buffer and LOD id of each level
+        self._volumesInProperty = list()
+        self._isCameraSet = False
 
     def _GetAvailable3DFields(self):
         self.availableFields = list()
@@ -179,15 +235,34 @@ class Visualizer3Dvtk():
         return timeSteps
 
     def GetVTKWidget(self, parentWidget):
+        # Qt is only needed when rendering into a widget
+        from vtk.qt4.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
         self.vtkWidget = QVTKRenderWindowInteractor(parentWidget)
         self.renderer = vtk.vtkRenderer()
         self.renderer.SetBackground(0,0,0)
-        self.vtkWidget.GetRenderWindow().AddRenderer(self.renderer)
-        self.interactor = self.vtkWidget.GetRenderWindow().GetInteractor()
+        self.renderWindow = self.vtkWidget.GetRenderWindow()
+        self.renderWindow.AddRenderer(self.renderer)
+        self.interactor = self.renderWindow.GetInteractor()
         self.interactor.Initialize()
         self.vtkCamera = self.renderer.GetActiveCamera()
         return self.vtkWidget
 
+    def CreateOffscreenRenderWindow(self, width = 1280, height = 720):
+        """Renders into an offscreen window of the given size instead of a Qt widget. There is no user
+        interaction, so only the full resolution level of detail is used."""
+        self.renderer = vtk.vtkRenderer()
+        self.renderer.SetBackground(0,0,0)
+        self.renderWindow = vtk.vtkRenderWindow()
+        self.renderWindow.SetOffScreenRendering(1)
+        self.renderWindow.SetSize(width, height)
+        self.renderWindow.AddRenderer(self.renderer)
+        self.interactor = None
+        self.vtkCamera = self.renderer.GetActiveCamera()
+        self.volume = None
+        self._isCameraSet = False
+        self.numberOfLevelsOfDetail = 1
+        return self.renderWindow
+
     def AddVolumeField(self, fieldName, speciesName):
         if speciesName == "":
             for volume in self.volumeList:
@@ -217,73 +292,156 @@ class Visualizer3Dvtk():
                 return volume
 
     def CreateVolume(self, timeStep):
-        firstTime = False
-        # Get data
-        npdatauchar = list()
-        volumeprop = vtk.vtkVolumeProperty()
-        volumeprop.IndependentComponentsOn()
-        volumeprop.SetInterpolationTypeToLinear()
-        for i, volume in enumerate(self.volumeList):
-            npdatauchar.append(volume.GetData(timeStep, 200, 300, 0.5)) # limit on elements only applies for 2d case
-            volumeprop.SetColor(i,volume.color)
-            volumeprop.SetScalarOpacity(i,volume.opacity)
-            volumeprop.ShadeOff(i)
-        npdatamulti = np.concatenate([aux[...,np.newaxis] for aux in npdatauchar], axis=3)
+        """Updates the data of the volume to the given time step and renders it. The VTK pipeline is only
+        created the first time; afterwards, only the imported data and its extent, spacing and origin change.
+
+        The volume is a vtkLODProp3D with several levels of detail. VTK automatically renders a coarse
+        level while the user interacts (when the full resolution is too slow) and the full resolution otherwise.
+        """
+        if len(self.volumeList) == 0:
+            return
+        if self.volume == None:
+            self._CreatePipeline()
+        self._UpdateVolumeProperty()
         axes = self.volumeList[0].GetAxes(timeStep)
         axesSpacing = self.volumeList[0].GetAxesSpacing(timeStep, 200, 300, 0.5) # limit on elements only applies for 2d case
-        # Put data in VTK format
-        dataImport = vtk.vtkImageImport()
+        for level, levelOfDetail in enumerate(self._levelsOfDetail):
+            # Get data. Each volume is written directly into its component of the (reused) interleaved buffer.
+            for i, volume in enumerate(self.volumeList):
+                npdatauchar = volume.GetData(timeStep, 200, 300, 0.5, level) # limit on elements only applies for 2d case
+                if i == 0:
+                    npdatamulti = levelOfDetail["buffer"].GetBuffer(npdatauchar.shape, len(self.volumeList))
+                npdatamulti[..., i] = npdatauchar
+            if level == 0:
+                fullShape = np.array(npdatamulti.shape[:3])
+            # elements of the full resolution volume in each element of this level, along z, y and x
+            scale = fullShape / np.maximum(np.array(npdatamulti.shape[:3]), 1)
+            spacing = (axesSpacing["x"]*scale[2], axesSpacing["y"]*scale[1], axesSpacing["z"]*scale[0])
+            origin = (axes["x"][0] + axesSpacing["x"]*(scale[2]-1)/2, axes["y"][0] + axesSpacing["y"]*(scale[1]-1)/2, axes["z"][0] + axesSpacing["z"]*(scale[0]-1)/2)
+            self._UpdateImportedData(levelOfDetail["dataImport"], npdatamulti, spacing, origin)
+        # The camera is only placed automatically the first time, afterwards it is kept.
+        if not self._isCameraSet:
+            self.renderer.ResetCamera()
+            self._isCameraSet = True
+        self.renderer.GetRenderWindow().Render()
+
+    def SetNumberOfLevelsOfDetail(self, numberOfLevels):
+        """Sets the number of levels of detail of the volume (1 to always render the full resolution)."""
+        self.numberOfLevelsOfDetail = max(1, int(numberOfLevels))
+        if self.volume != None:
+            # the pipeline is created again in the next render
+            self.renderer.RemoveVolume(self.volume)
+            self.volume = None
+            self._levelsOfDetail = list()
+
+    def _CreatePipeline(self):
+        self.volumeProperty = vtk.vtkVolumeProperty()
+        self.volumeProperty.IndependentComponentsOn()
+        self.volumeProperty.SetInterpolationTypeToLinear()
+        self._volumesInProperty = list()
+        self.volume = vtk.vtkLODProp3D()
+        self._levelsOfDetail = list()
+        for level in range(self.numberOfLevelsOfDetail):
+            dataImport = vtk.vtkImageImport()
+            dataImport.SetDataScalarTypeToUnsignedChar()
+            volumeMapper = vtk.vtkGPUVolumeRayCastMapper()
+            volumeMapper.SetAutoAdjustSampleDistances(1)
+            volumeMapper.SetInputConnection(dataImport.GetOutputPort())
+            lodID = self.volume.AddLOD(volumeMapper, self.volumeProperty, 0.0)
+            self.volume.SetLODLevel(lodID, level) # lower level means higher quality
+            self._levelsOfDetail.append({"dataImport":dataImport, "volumeMapper":volumeMapper, "buffer":VolumeBuffer(), "id":lodID})
+        self.renderer.AddVolume(self.volume)
+
+    def _UpdateImportedData(self, dataImport, npdatamulti, spacing, origin):
         dataImport.SetImportVoidPointer(npdatamulti)
-        dataImport.SetDataScalarTypeToUnsignedChar()
-        dataImport.SetNumberOfScalarComponents(len(self.volumeList))
+        dataImport.SetNumberOfScalarComponents(npdatamulti.shape[3])
         dataImport.SetDataExtent(0, npdatamulti.shape[2]-1, 0, npdatamulti.shape[1]-1, 0, npdatamulti.shape[0]-1)
         dataImport.SetWholeExtent(0, npdatamulti.shape[2]-1, 0, npdatamulti.shape[1]-1, 0, npdatamulti.shape[0]-1)
-        dataImport.SetDataSpacing(axesSpacing["x"],axesSpacing["y"],axesSpacing["z"])
-        dataImport.SetDataOrigin(axes["x"][0],axes["y"][0],axes["z"][0])
-        dataImport.Update()
-        # Set the mapper
-        if self.volumeMapper == None:
-            self.volumeMapper = vtk.vtkGPUVolumeRayCastMapper()
-        self.volumeMapper.SetAutoAdjustSampleDistances(1)
-        self.volumeMapper.SetInputConnection(dataImport.GetOutputPort())
-        self.volumeMapper.Update()
-        # Create volume
-        if self.volume == None:
-            self.volume = vtk.vtkVolume()
-            firstTime = True
-            self.volume.SetMapper(self.volumeMapper)
-            self.volume.SetProperty(volumeprop)
-        # Add to render
-        if firstTime:
-            self.renderer.AddVolume(self.volume)
-        else:
-            self.volume.Modified()
-        if firstTime:
-            self.renderer.ResetCamera()
-            self.renderer.GetRenderWindow().Render()
-        else:
-            #currentCameraPosition = np.array(self.renderer.GetActiveCamera().GetPosition())
-            #newDataOrigin = np.array((axes["x"][0],axes["y"][0],axes["z"][0]))
-            #newCameraPosition = newDataOrigin - self.pastDataOrigin + currentCameraPosition
-            self.renderer.ResetCamera()
-            #self.renderer.GetActiveCamera().SetPosition(newCameraPosition[0],newCameraPosition[1],newCameraPosition[2])
-            self.vtkWidget.GetRenderWindow().Render()
-        #self.pastDataOrigin = np.array((axes["x"][0],axes["y"][0],axes["z"][0]))
-        self.interactor.Initialize()
+        dataImport.SetDataSpacing(spacing[0], spacing[1], spacing[2])
+        dataImport.SetDataOrigin(origin[0], origin[1], origin[2])
+        dataImport.Modified() # the buffer can be the same as before, but its content has changed
+
+    def _UpdateVolumeProperty(self):
+        # The transfer functions of each volume are shared with the property, so they only have to be
+        # set again when the list of volumes changes. Their changes are then applied in place.
+        if self._volumesInProperty == self.volumeList:
+            return
+        for i, volume in enumerate(self.volumeList):
+            self.volumeProperty.SetColor(i,volume.color)
+            self.volumeProperty.SetScalarOpacity(i,volume.opacity)
+            self.volumeProperty.ShadeOff(i)
+        self._volumesInProperty = list(self.volumeList)
+
+    def ResetCamera(self):
+        self.renderer.ResetCamera()
+        self.renderer.GetRenderWindow().Render()
 
     def MakeRender(self, timeStep):
         self.CreateVolume(timeStep)
 
     def UpdateRender(self):
-        self.interactor.Render()
+        if self.interactor != None:
+            self.interactor.Render()
+        else:
+            self.renderWindow.Render()
 
     def SaveScreenshot(self, path):
-        w2if = vtk.vtkWindowToImageFilter()
-        w2if.SetInput(self.vtkWidget.GetRenderWindow())
-        w2if.Update()
- 
         writer = vtk.vtkPNGWriter()
         writer.SetFileName(path + ".png")
-        writer.SetInputData(w2if.GetOutput())
+        writer.SetInputData(self._GetRenderedImage())
         writer.Write()
 
+    def GetRenderedFrame(self):
+        """Returns the rendered image as a (height, width, 3) uint8 array, with the first row at the top."""
+        image = self._GetRenderedImage()
+        width, height, _ = image.GetDimensions()
+        pixels = vtk_to_numpy(image.GetPointData().GetScalars())
+        return np.flipud(pixels.reshape(height, width, -1))
+
+    def _GetRenderedImage(self):
+        # frames are always taken with the full resolution
+        if self.volume != None:
+            self.volume.AutomaticLODSelectionOff()
+            self.volume.SetSelectedLODID(self._levelsOfDetail[0]["id"])
+            self.renderWindow.Render()
+        w2if = vtk.vtkWindowToImageFilter()
+        w2if.SetInput(self.renderWindow)
+        w2if.Update()
+        if self.volume != None:
+            self.volume.AutomaticLODSelectionOn()
+        return w2if.GetOutput()
+
+    """
+    Animations
+    """
+    def RenderAnimation(self, timeSteps, framesDir, movieName, frameWriter = None):
+        """Renders the given time steps and saves each frame as framesDir/movieName_frame_<step>.png or, if
+        given, passes it to 'frameWriter' (a function taking the array from GetRenderedFrame, e.g. the
+        append_data method of a video writer).
+
+        The data of the next time step is read and prepared in a background thread while the current one
+        is rendered and saved.
+        """
+        timeSteps = list(timeSteps)
+        if len(timeSteps) == 0 or len(self.volumeList) == 0:
+            return
+        if frameWriter == None and not os.path.exists(framesDir):
+            os.makedirs(framesDir)
+        with ThreadPoolExecutor(1) as executor:
+            preparedData = executor.submit(self._PrepareTimeStep, timeSteps[0])
+            for i, timeStep in enumerate(timeSteps):
+                preparedData.result()
+                if i+1 < len(timeSteps):
+                    preparedData = executor.submit(self._PrepareTimeStep, timeSteps[i+1])
+                self.CreateVolume(timeStep)
+                if frameWriter == None:
+                    self.SaveScreenshot(framesDir + "/" + movieName + "_frame_" + str(timeStep).zfill(6))
+                else:
+                    frameWriter(self.GetRenderedFrame())
+
+    def _PrepareTimeStep(self, timeStep):
+        # leaves the volumes of all the levels of detail in the cache of quantized volumes
+        for volume in self.volumeList:
+            for level in range(self.numberOfLevelsOfDetail):
+                volume.GetData(timeStep, 200, 300, 0.5, level)
+
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2016-2017 Angel Ferran Pousa, DESY
+#
+#This file is part of VisualPIC.
+#
+#VisualPIC is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#VisualPIC is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with VisualPIC.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+"""
+Preparation of the volume data for the 3D visualizer
+"""
+def _GetChunks(fieldData, chunkSize):
+    # chunks of whole rows (along the first axis) with about 'chunkSize' elements
+    numberOfRows = len(fieldData)
+    rowSize = max(1, fieldData[0].size) if numberOfRows > 0 else 1
+    rowsPerChunk = max(1, chunkSize // rowSize)
+    return [(start, min(start+rowsPerChunk, numberOfRows)) for start in range(0, numberOfRows, rowsPerChunk)]
+
+def _RunOnChunks(function, chunks, numberOfThreads):
+    if numberOfThreads > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(numberOfThreads) as executor:
+            return list(executor.map(function, chunks))
+    return [function(chunk) for chunk in chunks]
+
+def GetAbsoluteRange(fieldData, chunkSize = 2**22, numberOfThreads = 1):
+    """Returns the minimum and maximum of the absolute value of the data, without a full-size temporary array."""
+    def GetChunkRange(chunk):
+        absoluteValues = np.absolute(fieldData[chunk[0]:chunk[1]])
+        return np.amin(absoluteValues), np.amax(absoluteValues)
+    ranges = _RunOnChunks(GetChunkRange, _GetChunks(fieldData, chunkSize), numberOfThreads)
+    return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+def QuantizeVolume(fieldData, minValue, maxValue, out, chunkSize = 2**22, numberOfThreads = 1):
+    """Writes round(255*(|data|-min)/(max-min)), clipped to [0, 255], into the uint8 array 'out'.
+
+    The data is processed in chunks (in parallel if numberOfThreads > 1), so that the only temporary
+    arrays have the size of a chunk. 'out' can be a strided view, e.g. one component of an
+    interleaved multi-component buffer.
+    """
+    scale = 255 / (maxValue-minValue) if maxValue != minValue else 0
+    def QuantizeChunk(chunk):
+        values = np.absolute(fieldData[chunk[0]:chunk[1]], dtype=np.float32)
+        values -= minValue
+        values *= scale
+        np.rint(values, out=values)
+        np.clip(values, 0, 255, out=values)
+        out[chunk[0]:chunk[1]] = values
+    _RunOnChunks(QuantizeChunk, _GetChunks(fieldData, chunkSize), numberOfThreads)
+    return out
+
+
+class VolumeBuffer(object):
+    """Reusable interleaved uint8 buffer with the data of all the volumes (one component per volume)."""
+    def __init__(self):
+        self._buffer = None
+
+    def GetBuffer(self, shape, numberOfComponents):
+        """Returns a C-contiguous (shape + (numberOfComponents,)) uint8 array. It is only reallocated
+        when the shape or number of components change."""
+        bufferShape = tuple(shape) + (numberOfComponents,)
+        if self._buffer is None or self._buffer.shape != bufferShape:
+            self._buffer = np.empty(bufferShape, dtype=np.uint8)
+        return self._buffer
+
+    def Release(self):
+        self._buffer = None
+
+
+def DownsampleVolume(volumeData, method = "mean"):
+    """Halves the resolution of a 3D uint8 volume, replacing each block of 2x2x2 elements by their mean
+    ("mean") or their maximum ("max", which keeps small bright features visible). Axes with a single
+    element are kept and odd elements at the end of an axis are dropped."""
+    factors = [2 if n >= 2 else 1 for n in volumeData.shape]
+    newShape = [n // f for n, f in zip(volumeData.shape, factors)]
+    croppedData = volumeData[:newShape[0]*factors[0], :newShape[1]*factors[1], :newShape[2]*factors[2]]
+    blocks = croppedData.reshape(newShape[0], factors[0], newShape[1], factors[1], newShape[2], factors[2])
+    if method == "max":
+        return np.ascontiguousarray(blocks.max(axis=(1, 3, 5)))
+    elif method == "mean":
+        blockSize = factors[0]*factors[1]*factors[2]
+        sums = blocks.sum(axis=(1, 3, 5), dtype=np.uint16)
+        sums += blockSize // 2 # rounding
+        sums //= blockSize
+        return sums.astype(np.uint8)
+    raise ValueError("Unknown downsampling method: " + str(method))
@@ -210,15 +210,12 @@ class CreateVTKAnimationWindow(QtWidgets.QDialog):
         lastTimeStep = int(self.lastStep_lineEdit.text())
         lastIndex = np.where(simulationTimeSteps == lastTimeStep)[0][0]
         freq = int(self.frequency_lineEdit.text())
-        for i in simulationTimeSteps[firstIndex:lastIndex+1:freq]:
-            self.mainWindow.timeStep_Slider.setValue(i)
-            self.mainWindow.MakeRender()
-            movieName = self.fileName_lineEdit.text()
-            framesDir = self.saveTo_lineEdit.text() + "/" + movieName + "_frames"
-            frameNameAndPath = framesDir + "/" + movieName + "_frame_" + str(i).zfill(6)
-            if not os.path.exists(framesDir):
-                os.makedirs(framesDir)
-            self.mainWindow.SaveScreenshot(frameNameAndPath)
+        timeSteps = simulationTimeSteps[firstIndex:lastIndex+1:freq]
+        movieName = self.fileName_lineEdit.text()
+        framesDir = self.saveTo_lineEdit.text() + "/" + movieName + "_frames"
+        # the frames are rendered directly by the visualizer, which prepares the next one in the background
+        self.mainWindow.RenderAnimation(timeSteps, framesDir, movieName)
+        self.mainWindow.timeStep_Slider.setValue(timeSteps[-1])
 
 
 class InputFilter(QtCore.QObject):
@@ -34,6 +34,7 @@ from VisualPIC.Views.aboutWindow import AboutWindow
 from VisualPIC.Views.particleTrackerWindow import ParticleTrackerWindow
 from VisualPIC.Views.visualizer3DvtkWindow import Visualizer3DvtkWindow
 from VisualPIC.DataHandling.dataContainer import DataContainer
+from VisualPIC.DataHandling.dataPrefetcher import DataPrefetcher
 from VisualPIC.DataPlotting.fieldToPlot import FieldToPlot
 from VisualPIC.DataPlotting.rawDataSetToPlot import RawDataSetToPlot
 from VisualPIC.DataPlotting.subplot import *
@@ -58,6 +59,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         super(MainWindow, self).__init__()
         self.setupUi(self)
         self.dataContainer = DataContainer()
+        self.dataPrefetcher = DataPrefetcher()
         self.colorMapsCollection = ColorMapsCollection()
         self.dataPlotter = DataPlotter(self.colorMapsCollection)
         self.InitialUIValues()
@@ -354,6 +356,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.fieldsToPlot_listWidget.clear()
         self.currentAxesFieldsToPlot[:] = []
         self.subplotList[:] = []
+        self.dataPrefetcher.CancelAll()
         
     def LoadFolderData(self):
         ParametersWindow = SimulationParametersWindow(self)
@@ -429,8 +432,17 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         rows = self.rows_spinBox.value()
         columns = self.columns_spinBox.value()
         timeStep = self.timeStep_Slider.value()
+        self.dataPrefetcher.CancelAll()
         self.dataPlotter.MakePlot(self.figure, self.subplotList, rows, columns, timeStep)
         self.canvas.draw()
+        self.PrefetchNeighbouringTimeSteps(timeStep)
+
+    def PrefetchNeighbouringTimeSteps(self, timeStep):
+        dataSources = list()
+        for subplot in self.subplotList:
+            dataSources += subplot.GetDataToPrefetch()
+        self.dataPrefetcher.SetDataSources(dataSources)
+        self.dataPrefetcher.TimeStepChanged(timeStep, self.timeSteps)
             
     def RemoveSubplot(self, item):
         index = self.subplotList.index(item.subplot)
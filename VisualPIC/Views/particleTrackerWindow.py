@@ -372,22 +372,16 @@ class ParticleTrackerWindow(QParticleTrackerWindow, Ui_ParticleTrackerWindow):
             self.exportPath_lineEdit.setText(folderPath)
 
     def FindParticles(self, timeStep, speciesName, filter):
-        self.particleList = self.particleTracker.FindParticles(timeStep, speciesName, filter)
+        self.particleSet = self.particleTracker.FindParticles(timeStep, speciesName, filter)
         self.CreateParticleTable()
 
     def CreateParticleTable(self):
-        n = len(self.particleList)
+        n = len(self.particleSet)
         if n > 0:
-            variableNames = self.particleList[0].GetNamesOfTimeStepQuantities()
-            allParticlesData = list()
+            variableNames = self.particleSet.GetNamesOfTimeStepQuantities()
             tableData = {}
-            for particle in self.particleList:
-                allParticlesData.append(particle.GetCurrentTimeStepQuantities())
             for variableName in variableNames:
-                varValues = np.zeros(n)
-                for i in np.arange(0,n):
-                    varValues[i] = allParticlesData[i][variableName]
-                tableData[variableName] = varValues
+                tableData[variableName] = self.particleSet.GetTimeStepQuantity(variableName)
             self.particleList_tableWidget.setColumnCount(len(variableNames)+1)
             self.particleList_tableWidget.setRowCount(n)
             tableHeaders = variableNames
@@ -404,12 +398,12 @@ class ParticleTrackerWindow(QParticleTrackerWindow, Ui_ParticleTrackerWindow):
             self.particleList_tableWidget.setHorizontalHeaderLabels(tableHeaders)
 
     def GetSelectedParticles(self):
-        selectedParticles = list()
+        selectedRows = list()
         for row in np.arange(0, self.particleList_tableWidget.rowCount()):
             item = self.particleList_tableWidget.item(row, 0)
             if item.checkState():
-                selectedParticles.append(self.particleList[row])
-        return selectedParticles
+                selectedRows.append(row)
+        return self.particleSet.GetSubset(np.array(selectedRows, dtype=int))
 
     def GetSelectedFilters(self):
         filters = {}
@@ -425,16 +419,10 @@ class ParticleTrackerWindow(QParticleTrackerWindow, Ui_ParticleTrackerWindow):
     def CreateTrackedParticlesTable(self):
         trackedParticles = self.particleTracker.GetTrackedParticles()
         n = len(trackedParticles)
-        variableNames = trackedParticles[0].GetNamesOfTimeStepQuantities()
-        allParticlesData = list()
+        variableNames = trackedParticles.GetNamesOfTimeStepQuantities()
         tableData = {}
-        for particle in trackedParticles:
-            allParticlesData.append(particle.GetCurrentTimeStepQuantities())
         for variableName in variableNames:
-            varValues = np.zeros(n)
-            for i in np.arange(0,n):
-                varValues[i] = allParticlesData[i][variableName]
-            tableData[variableName] = varValues
+            tableData[variableName] = trackedParticles.GetTimeStepQuantity(variableName)
         self.trackedParticlesList_tableWidget.setColumnCount(len(variableNames)+1)
         self.trackedParticlesList_tableWidget.setRowCount(n)
         tableHeaders = variableNames
@@ -181,3 +181,6 @@ class Visualizer3DvtkWindow(QVisualizer3DvtkWindow, Ui_Visualizer3DvtkWindow):
 
     def SaveScreenshot(self, path):
         self.visualizer3Dvtk.SaveScreenshot(path)
+
+    def RenderAnimation(self, timeSteps, framesDir, movieName):
+        self.visualizer3Dvtk.RenderAnimation(timeSteps, framesDir, movieName)